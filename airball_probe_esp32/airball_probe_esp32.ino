@@ -47,6 +47,7 @@ void metrics_send_one(Metric& metric) {
   if (metric.ready()) {
     sprintf(data_sentence_buffer, "$M,%s", metric.str());
     Serial.println(data_sentence_buffer);
+    wifi->send(data_sentence_buffer);
   }
 }
 
@@ -0,0 +1,167 @@
+import os
+import numpy as np
+
+import airdata_engine
+from plotting import pyplot, ensure_dir
+
+########################################################################
+
+# Accuracy of the calibration tables against the fitted models, over
+# the whole (dpa/dp0, dpb/dp0) domain rather than only at the tunnel
+# points.
+#
+# Every table cell is sampled on a regular subdivisions x subdivisions
+# lattice of points at the centres of equal sub-cells, and the grid is
+# extended by a band of `outside` cells beyond the last grid point on
+# each axis, where the firmware's idx() reports an error. The tables
+# are looked up with the float32 firmware math of airdata_engine (with
+# dp0 = 1, dpa = x and dpb = y the four airdata outputs are the four
+# table values), and compared with the fitted models evaluated in
+# float64. Surfaces on the same grid share the points and the lookups.
+#
+# For each surface and cell this gives the maximum and RMS error and
+# the fraction of points whose lookup failed; plot_map draws these as
+# heatmaps, and summary_table lists the numbers for each surface.
+
+subdivisions = 32
+
+outside = 2
+
+########################################################################
+
+# Sample coordinates along one table axis, cell by cell, and the number
+# of cells covered (those of the table plus the band outside it)
+def _samples(axis, subdivisions, outside):
+    cells = axis['size'] - 1 + outside
+    offsets = (np.arange(0, subdivisions) + 0.5) / subdivisions
+    i = np.arange(0, cells)[:, None] + offsets[None, :]
+    return (axis['step'] * i.ravel() - axis['zero_offset'], cells)
+
+def _per_cell(v, nx, ny, s):
+    return v.reshape(nx, s, ny, s)
+
+# Accuracy maps of the given tables (surface dicts, e.g. from
+# generate_calibrations.generate_tables or calibration_surface.read_tables)
+# against model, a dict from surface name to a function of (x, y).
+def accuracy_map(model, surfaces, subdivisions=subdivisions, outside=outside):
+    engine = airdata_engine.Engine(surfaces)
+    outputs = dict(zip(airdata_engine.SURFACES, ['alpha', 'beta', 'q', 'p']))
+    maps = {}
+    for g in engine.grids:
+        s = surfaces[g.names[0]]
+        (xs, nx) = _samples(s['x'], subdivisions, outside)
+        (ys, ny) = _samples(s['y'], subdivisions, outside)
+        # The firmware sees float32 ratios, so the models get them too
+        x = np.repeat(xs, len(ys)).astype(np.float32).astype(np.float64)
+        y = np.tile(ys, len(xs)).astype(np.float32).astype(np.float64)
+        r = engine(1.0, x, y, 0.0)
+        for name in g.names:
+            bit = 1 << airdata_engine.SURFACES.index(name)
+            failed = (r['failed'] & bit) != 0
+            err = r[outputs[name]].astype(np.float64) - model[name](x, y)
+            err[failed] = 0
+            n_ok = _per_cell(~failed, nx, ny, subdivisions).sum(axis=(1, 3))
+            with np.errstate(invalid='ignore'):
+                maps[name] = {
+                    'x_edges': s['x']['step'] * np.arange(0, nx + 1) - s['x']['zero_offset'],
+                    'y_edges': s['y']['step'] * np.arange(0, ny + 1) - s['y']['zero_offset'],
+                    'table_cells': (s['x']['size'] - 1, s['y']['size'] - 1),
+                    'points': len(x),
+                    'max_error': np.where(
+                        n_ok > 0,
+                        _per_cell(np.abs(err), nx, ny, subdivisions).max(axis=(1, 3)),
+                        np.nan),
+                    'rms_error': np.sqrt(
+                        _per_cell(np.square(err), nx, ny, subdivisions).sum(axis=(1, 3)) / n_ok),
+                    'failed': 1 - n_ok / float(subdivisions * subdivisions),
+                    'worst': _worst(err, x, y),
+                }
+    return maps
+
+def _worst(err, x, y):
+    i = int(np.argmax(np.abs(err)))
+    return (float(x[i]), float(y[i]), float(err[i]))
+
+########################################################################
+
+# Column, header width and format of the summary table
+summary_columns = [
+    ('surface', -18, '%-18s'),
+    ('cells', 9, '%9s'),
+    ('points', 9, '%9d'),
+    ('max_error', 10, '%10.3g'),
+    ('at_x', 6, '%6.3f'),
+    ('at_y', 6, '%6.3f'),
+    ('rms_error', 10, '%10.3g'),
+    ('p99_cell_max', 12, '%12.3g'),
+    ('failed_inside', 13, '%13.4f'),
+    ('failed_outside', 14, '%14.4f'),
+]
+
+# One row of numbers per surface. failed_inside, the fraction of points
+# within the table's own grid whose lookup failed, should be 0.
+def summary(maps):
+    rows = []
+    for name in maps:
+        m = maps[name]
+        (tx, ty) = m['table_cells']
+        inside = np.zeros(m['failed'].shape, bool)
+        inside[:tx, :ty] = True
+        rms = m['rms_error'][inside]
+        (x, y, e) = m['worst']
+        rows.append({
+            'surface': name,
+            'cells': '%dx%d' % (tx, ty),
+            'points': m['points'],
+            'max_error': abs(e),
+            'at_x': x,
+            'at_y': y,
+            'rms_error': float(np.sqrt(np.nanmean(np.square(rms)))),
+            'p99_cell_max': float(np.nanpercentile(m['max_error'][inside], 99)),
+            'failed_inside': float(np.mean(m['failed'][inside])),
+            'failed_outside': float(np.mean(m['failed'][~inside])) if (~inside).any() else 0.0,
+        })
+    return rows
+
+def summary_table(rows):
+    lines = [' '.join('%*s' % (w, k) for (k, w, f) in summary_columns)]
+    for r in rows:
+        lines.append(' '.join(f % r[k] for (k, w, f) in summary_columns))
+    return '\n'.join(lines) + '\n'
+
+########################################################################
+
+def plot_map(name, m, path):
+    plt = pyplot()
+    fig, axes = plt.subplots(1, 3, figsize=(17, 5.5))
+    (tx, ty) = m['table_cells']
+    panels = [
+        ('max |error|', m['max_error'], 'viridis'),
+        ('rms error', m['rms_error'], 'viridis'),
+        ('failed lookups', m['failed'], 'Reds'),
+    ]
+    for (ax, (title, v, cmap)) in zip(axes, panels):
+        mesh = ax.pcolormesh(
+            m['x_edges'], m['y_edges'], np.asarray(v).T, cmap=cmap, shading='flat')
+        ax.axvline(m['x_edges'][tx], color='k', lw=0.8, ls='--')
+        ax.axhline(m['y_edges'][ty], color='k', lw=0.8, ls='--')
+        ax.set_title(name + ': ' + title)
+        ax.set_xlabel('dpa_over_dp0')
+        ax.set_ylabel('dpb_over_dp0')
+        fig.colorbar(mesh, ax=ax)
+    (x, y, e) = m['worst']
+    axes[0].plot([x], [y], 'rx')
+    fig.tight_layout()
+    plt.savefig(path, dpi=150)
+    plt.close()
+    return path
+
+def plot_maps(maps, queue, directory):
+    ensure_dir(directory)
+    for name in maps:
+        m = {k: queue.share(v) if isinstance(v, np.ndarray) else v for (k, v) in maps[name].items()}
+        queue.submit(plot_map, name, m, os.path.join(directory, 'accuracy_' + name + '.png'))
+
+def write_summary(rows, path):
+    with open(path, 'w') as f:
+        f.write(summary_table(rows))
@@ -0,0 +1,57 @@
+import numpy as np
+
+import accuracy_map
+
+########################################################################
+
+# Accuracy maps of tables made from functions whose interpolation error
+# is known: none for a bilinear function, and t (1 - t) step^2 at a
+# fraction t across a cell for x^2.
+
+step = 0.5
+
+axes = {
+    'x': {'size': 5, 'step': step, 'zero_offset': 0.0},
+    'y': {'size': 4, 'step': step, 'zero_offset': 0.0},
+}
+
+models = {
+    'alpha': lambda x, y: 1 + 2 * x - 3 * y + x * y,
+    'beta': lambda x, y: np.square(x),
+    'q_over_dp0': lambda x, y: 0.5 + 0 * x,
+    'minus_s_over_dp0': lambda x, y: np.square(x) + y,
+}
+
+def surfaces():
+    x = step * np.arange(0, axes['x']['size'])
+    y = step * np.arange(0, axes['y']['size'])
+    (gx, gy) = np.meshgrid(x, y, indexing='ij')
+    return {
+        name: dict(axes, data=np.float32(models[name](gx, gy)).ravel())
+        for name in models
+    }
+
+def test_accuracy_map():
+    maps = accuracy_map.accuracy_map(models, surfaces(), subdivisions=8, outside=2)
+    # The sub-cell centres nearest the middle of a cell
+    t = 3.5 / 8
+    quadratic = t * (1 - t) * step ** 2
+    for (name, m) in maps.items():
+        assert m['max_error'].shape == (4 + 2, 3 + 2)
+        assert m['points'] == (6 * 8) * (5 * 8)
+        np.testing.assert_equal(m['failed'][:4, :3], 0)
+        np.testing.assert_equal(m['failed'][4:, :], 1)
+        np.testing.assert_equal(m['failed'][:, 3:], 1)
+        assert np.all(np.isnan(m['max_error'][4:, :]))
+        inside = m['max_error'][:4, :3]
+        if name in ['beta', 'minus_s_over_dp0']:
+            np.testing.assert_allclose(inside, quadratic, rtol=1e-4)
+            assert abs(m['worst'][2]) == np.max(inside)
+        else:
+            assert np.all(inside < 1e-5)
+    rows = {r['surface']: r for r in accuracy_map.summary(maps)}
+    assert rows['beta']['cells'] == '4x3'
+    np.testing.assert_allclose(rows['beta']['max_error'], quadratic, rtol=1e-4)
+    for r in rows.values():
+        assert r['failed_inside'] == 0 and r['failed_outside'] == 1
+    assert len(accuracy_map.summary_table(rows.values()).splitlines()) == 5
@@ -0,0 +1,349 @@
+import argparse
+import sys
+import time
+import numpy as np
+
+import calibration_surface
+
+########################################################################
+
+# Batch evaluation of the firmware airdata math in NumPy.
+#
+# This is pressures_to_airdata.cpp, with the idx / lineint / interpolate
+# of calibration_surface.cpp, rewritten to run over arrays of samples.
+# In float32 mode every operation is the float32 operation the firmware
+# does, in the same order, so results are bit for bit those of the
+# compiled library (probe_calibration_lib), which is built without fused
+# multiply-adds. Error flags are returned per sample: 'err' is True
+# where any lookup failed, as the firmware's err, and 'failed' has bit k
+# set where the lookup in the k-th surface of SURFACES failed. As in the
+# firmware, a failed lookup gives 0.
+#
+# Speed comes from doing per table what the firmware does per sample:
+#
+#   - Surfaces on the same grid share the cell index and the position
+#     within the cell, (x - x1) / (x2 - x1), which the firmware computes
+#     identically for each of them.
+#   - For each grid cell, the corner values and the differences y2 - y1
+#     of lineint along x are worked out once, in float32 like the
+#     firmware, and stored together, so a sample needs one or two
+#     gathers per grid rather than four per surface.
+#   - Failed lookups read an extra all-zero cell, which interpolates to
+#     the firmware's 0, rather than having their results masked out:
+#     masked NumPy operations are an order of magnitude slower than
+#     plain ones.
+#   - Samples are processed in chunks that fit in cache, reusing scratch
+#     buffers, with no temporaries.
+#
+# airdata_engine_test.py checks it against the compiled library. Run as
+# a script, it compares the two on any tables and reports the throughput
+# of both.
+
+SURFACES = ['alpha', 'beta', 'q_over_dp0', 'minus_s_over_dp0']
+
+DEFAULT_CHUNK = 1 << 14
+
+# Longest cell record gathered in one np.take
+PART_BYTES = 32
+
+########################################################################
+
+def _axis_key(a):
+    return (int(a['size']), float(a['step']), float(a['zero_offset']))
+
+# Grid positions of one axis: the cell corners x1 = step * i - zero_offset
+# and x2, and x2 - x1, as computed in lineint's arguments
+class _Axis:
+
+    def __init__(self, axis, dtype):
+        self.size = int(axis['size'])
+        self.step = dtype.type(axis['step'])
+        self.zero_offset = dtype.type(axis['zero_offset'])
+        self.last = dtype.type(self.size - 1)
+        i = np.arange(0, self.size - 1).astype(dtype)
+        self.x1 = self.step * i - self.zero_offset
+        self.width = (self.step * (i + 1) - self.zero_offset) - self.x1
+        self.big = np.finfo(dtype).max
+
+# Surfaces sharing one grid. The record of a cell holds, for each surface,
+#   v(ix, iy), v(ix + 1, iy) - v(ix, iy), v(ix, iy + 1), v(ix + 1, iy + 1) - v(ix, iy + 1)
+# Record 0 is all zeros, for failed lookups, so they interpolate to 0
+# without a masked write. Records are split into parts of a few surfaces
+# each, of at most PART_BYTES, as np.take gathers short records much
+# faster than long ones.
+class _Grid:
+
+    def __init__(self, surfaces, names, dtype):
+        s = surfaces[names[0]]
+        self.names = names
+        self.x = _Axis(s['x'], dtype)
+        self.y = _Axis(s['y'], dtype)
+        (nx, ny) = (self.x.size, self.y.size)
+        per_part = max(1, PART_BYTES // (4 * dtype.itemsize))
+        self.parts = []
+        for i in range(0, len(names), per_part):
+            part = names[i:i + per_part]
+            cells = np.zeros(((nx - 1) * (ny - 1) + 1, 4, len(part)), dtype)
+            for (k, name) in enumerate(part):
+                v = calibration_surface.decoded_values(surfaces[name]).astype(dtype)
+                v = v.reshape(nx, ny)
+                cells[1:, 0, k] = v[:-1, :-1].ravel()
+                cells[1:, 1, k] = (v[1:, :-1] - v[:-1, :-1]).ravel()
+                cells[1:, 2, k] = v[:-1, 1:].ravel()
+                cells[1:, 3, k] = (v[1:, 1:] - v[:-1, 1:]).ravel()
+            record = np.dtype((np.void, cells[0].nbytes))
+            self.parts.append((part, cells.reshape(len(cells), -1).view(record).ravel()))
+        # Bits of the surfaces of this grid in 'failed'
+        self.bits = np.uint8(sum(1 << SURFACES.index(name) for name in names))
+
+class Engine:
+
+    def __init__(self, surfaces, dtype=np.float32, chunk=DEFAULT_CHUNK):
+        self.dtype = np.dtype(dtype)
+        self.chunk = chunk
+        groups = {}
+        for name in SURFACES:
+            s = surfaces[name]
+            groups.setdefault((_axis_key(s['x']), _axis_key(s['y'])), []).append(name)
+        self.grids = [_Grid(surfaces, names, self.dtype) for names in groups.values()]
+
+    # Tables from a generated header or blob (see calibration_surface.read_tables)
+    @classmethod
+    def from_file(cls, path, dtype=np.float32, chunk=DEFAULT_CHUNK):
+        return cls(calibration_surface.read_tables(path), dtype, chunk)
+
+    # Tables straight from generate_calibrations.generate_tables(), as they
+    # would be exported in the given encoding
+    @classmethod
+    def from_structs(cls, structs, encoding='float32', dtype=np.float32, chunk=DEFAULT_CHUNK):
+        return cls(
+            {k: calibration_surface.quantize(structs[k], encoding) for k in structs},
+            dtype, chunk)
+
+    def __call__(self, dp0, dpa, dpb, raw_baro=0.0):
+        t = self.dtype
+        (dp0, dpa, dpb, raw_baro) = [
+            np.ravel(v) for v in np.broadcast_arrays(*[
+                np.asarray(v, dtype=t) for v in (dp0, dpa, dpb, raw_baro)])]
+        n = len(dp0)
+        r = {k: np.empty(n, t) for k in ('alpha', 'beta', 'q', 'p')}
+        r['failed'] = np.zeros(n, np.uint8)
+        scratch = _Scratch(min(n, self.chunk), t, self.grids)
+        # Samples that fail a lookup (dp0 = 0, NaN, off the table) go
+        # through the arithmetic too, with values that are thrown away
+        with np.errstate(all='ignore'):
+            for start in range(0, n, self.chunk):
+                end = min(n, start + self.chunk)
+                if end - start != scratch.n:
+                    scratch.resize(end - start)
+                self._chunk(
+                    scratch, dp0[start:end], dpa[start:end], dpb[start:end], raw_baro[start:end],
+                    r['alpha'][start:end], r['beta'][start:end], r['q'][start:end],
+                    r['p'][start:end], r['failed'][start:end])
+        r['err'] = r['failed'] != 0
+        return r
+
+    def _chunk(self, s, dp0, dpa, dpb, raw_baro, alpha, beta, q, p, failed):
+        # abs_sign of dpa / dp0 and dpb / dp0
+        np.divide(dpa, dp0, out=s.rpa)
+        np.divide(dpb, dp0, out=s.rpb)
+        self._sign(s.rpa, s.neg, s.sign_a)
+        self._sign(s.rpb, s.neg, s.sign_b)
+        np.abs(s.rpa, out=s.rpa)
+        np.abs(s.rpb, out=s.rpb)
+
+        for (g, gs) in zip(self.grids, s.grids):
+            self._lookup(g, gs, s)
+            for ((names, cells), records, out) in zip(g.parts, gs.records, gs.values):
+                np.take(cells, gs.cell, out=records.reshape(len(records), -1).view(cells.dtype)[:, 0])
+                self._interpolate(gs, s, records, out)
+            np.multiply(gs.ok, g.bits, out=s.bits)
+            np.bitwise_xor(s.bits, g.bits, out=s.bits)
+            np.bitwise_or(failed, s.bits, out=failed)
+
+        np.multiply(s.values['alpha'], s.sign_a, out=alpha)
+        np.multiply(s.values['beta'], s.sign_b, out=beta)
+        np.multiply(dp0, s.values['q_over_dp0'], out=q)
+        np.multiply(s.values['minus_s_over_dp0'], dp0, out=p)
+        np.add(raw_baro, p, out=p)
+
+    # The sign of abs_sign, x < 0 ? -1 : 1
+    @staticmethod
+    def _sign(v, neg, sign):
+        np.less(v, 0, out=neg)
+        sign[...] = neg
+        np.multiply(sign, -2, out=sign)
+        np.add(sign, 1, out=sign)
+
+    # idx() for x and y, the cell of each sample (0 where a lookup failed)
+    # and the positions within the cell
+    def _lookup(self, g, gs, s):
+        self._idx(g.x, s.rpa, gs.ix, gs.fx, gs.ok, s.inside)
+        self._idx(g.y, s.rpb, gs.iy, gs.fy, gs.ok_y, s.inside)
+        np.logical_and(gs.ok, gs.ok_y, out=gs.ok)
+        np.multiply(gs.ix, g.y.size - 1, out=gs.cell)
+        np.add(gs.cell, gs.iy, out=gs.cell)
+        np.add(gs.cell, 1, out=gs.cell)
+        np.multiply(gs.cell, gs.ok, out=gs.cell)
+        self._position(g.x, s.rpa, gs.ix, gs.fx, s.tmp)
+        self._position(g.y, s.rpb, gs.iy, gs.fy, s.tmp)
+
+    # The cell index of idx() into i and whether it is on the table into
+    # ok. Off the table, and for NaN, i is a valid index whose cell is
+    # not used.
+    @staticmethod
+    def _idx(axis, v, i, f, ok, inside):
+        np.add(v, axis.zero_offset, out=f)
+        np.divide(f, axis.step, out=f)
+        # int() truncates toward zero, so i < 0 where f <= -1
+        np.greater(f, -1, out=ok)
+        np.less_equal(f, axis.last, out=inside)
+        np.logical_and(ok, inside, out=ok)
+        # fmax and fmin take NaN to 0, and the cast truncates
+        np.fmax(f, 0, out=f)
+        np.fmin(f, axis.size - 2, out=f)
+        i[...] = f
+
+    # (x - x1) / (x2 - x1) of lineint, into f. Where the lookup failed f
+    # may be anything, so it is kept finite for the zero record to
+    # interpolate to 0.
+    @staticmethod
+    def _position(axis, v, i, f, tmp):
+        np.take(axis.x1, i, out=f)
+        np.subtract(v, f, out=f)
+        np.take(axis.width, i, out=tmp)
+        np.divide(f, tmp, out=f)
+        np.fmax(f, -axis.big, out=f)
+        np.fmin(f, axis.big, out=f)
+
+    # lineint along x at y1 and y2, then along y between them, for each
+    # surface of one part of the cell records. Each surface is done on
+    # its own: NumPy loops over the short surface axis innermost otherwise.
+    @staticmethod
+    def _interpolate(gs, s, c, out):
+        at_y0 = s.at_y0
+        for k in range(0, c.shape[2]):
+            r = out[k]
+            np.multiply(gs.fx, c[:, 1, k], out=at_y0)
+            np.add(c[:, 0, k], at_y0, out=at_y0)
+            np.multiply(gs.fx, c[:, 3, k], out=r)
+            np.add(c[:, 2, k], r, out=r)
+            np.subtract(r, at_y0, out=r)
+            np.multiply(gs.fy, r, out=r)
+            np.add(at_y0, r, out=r)
+
+# Scratch buffers for one chunk of samples
+class _Scratch:
+
+    def __init__(self, n, dtype, grids):
+        self._full = {
+            'rpa': np.empty(n, dtype),
+            'rpb': np.empty(n, dtype),
+            'neg': np.empty(n, bool),
+            'inside': np.empty(n, bool),
+            'sign_a': np.empty(n, dtype),
+            'sign_b': np.empty(n, dtype),
+            'tmp': np.empty(n, dtype),
+            'bits': np.empty(n, np.uint8),
+            'at_y0': np.empty(n, dtype),
+        }
+        self._grids = [_GridScratch(n, dtype, g) for g in grids]
+        self.resize(n)
+
+    def resize(self, n):
+        self.n = n
+        for (k, v) in self._full.items():
+            setattr(self, k, v[:n])
+        self.grids = [g.resize(n) for g in self._grids]
+        # The interpolated values of each surface
+        self.values = {}
+        for (g, gs) in zip(self._grids, self.grids):
+            for ((names, cells), out) in zip(g.parts, gs.values):
+                for (k, name) in enumerate(names):
+                    self.values[name] = out[k]
+        return self
+
+class _GridScratch:
+
+    def __init__(self, n, dtype, grid):
+        self.parts = grid.parts
+        self._full = {
+            'ix': np.empty(n, np.intp),
+            'iy': np.empty(n, np.intp),
+            'cell': np.empty(n, np.intp),
+            'fx': np.empty(n, dtype),
+            'fy': np.empty(n, dtype),
+            'ok': np.empty(n, bool),
+            'ok_y': np.empty(n, bool),
+        }
+        self._records = [np.empty((n, 4, len(names)), dtype) for (names, cells) in grid.parts]
+        self._values = [np.empty((len(names), n), dtype) for (names, cells) in grid.parts]
+
+    def resize(self, n):
+        for (k, v) in self._full.items():
+            setattr(self, k, v[:n])
+        self.records = [v[:n] for v in self._records]
+        self.values = [v[:, :n] for v in self._values]
+        return self
+
+########################################################################
+
+def pressures_to_airdata(surfaces, dp0, dpa, dpb, raw_baro=0.0, dtype=np.float32):
+    return Engine(surfaces, dtype)(dp0, dpa, dpb, raw_baro)
+
+########################################################################
+
+# Random samples over and around the tables, including dp0 = 0 and NaN
+def random_samples(n, seed=0):
+    rng = np.random.default_rng(seed)
+    dp0 = rng.uniform(-20, 200, n).astype(np.float32)
+    dpa = (dp0 * rng.uniform(-3.5, 3.5, n)).astype(np.float32)
+    dpb = (dp0 * rng.uniform(-3, 3, n)).astype(np.float32)
+    raw_baro = rng.uniform(900, 1100, n).astype(np.float32)
+    dp0[:n // 1000] = 0
+    dpa[n // 1000:n // 500] = np.nan
+    return (dp0, dpa, dpb, raw_baro)
+
+# Number of samples for which the engine and the compiled library differ,
+# comparing the bits of the results
+def mismatches(engine, library):
+    bad = engine['err'] != (library['err'] != 0)
+    for k in ('alpha', 'beta', 'q', 'p'):
+        bad |= engine[k].view(np.uint32) != library[k].view(np.uint32)
+    return int(np.sum(bad))
+
+def _best_time(fn, repeat=3):
+    best = float('inf')
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return (best, result)
+
+def main(argv):
+    import probe_calibration_lib
+    parser = argparse.ArgumentParser(
+        description='Check the NumPy airdata engine against the compiled firmware math')
+    parser.add_argument(
+        'tables', nargs='?', default=None,
+        help='header or .bin blob (default: probe_calibration.h, as compiled into the library)')
+    parser.add_argument('--samples', type=int, default=4000000)
+    args = parser.parse_args(argv)
+
+    samples = random_samples(args.samples)
+    tables = calibration_surface.read_tables(args.tables or 'probe_calibration.h')
+    engine = Engine(tables)
+    # The library has probe_calibration.h compiled in; other tables are
+    # loaded into it as a blob
+    blob = None if args.tables is None else calibration_surface.blob_bytes(tables)
+    (t_engine, r_engine) = _best_time(lambda: engine(*samples))
+    (t_library, r_library) = _best_time(
+        lambda: probe_calibration_lib.pressures_to_airdata(*samples, blob=blob))
+    n = args.samples
+    print('%d samples, %d failed lookups, %d mismatches' % (
+        n, int(np.sum(r_engine['err'])), mismatches(r_engine, r_library)))
+    print('engine  %.1f M samples/s' % (n / t_engine / 1e6))
+    print('library %.1f M samples/s' % (n / t_library / 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
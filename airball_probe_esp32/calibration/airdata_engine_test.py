@@ -0,0 +1,38 @@
+import os
+import numpy as np
+
+import airdata_engine
+import calibration_surface
+import probe_calibration_lib
+
+########################################################################
+
+# The NumPy engine against the compiled firmware math, bit for bit, on
+# random samples over and around the tables of probe_calibration.h.
+
+header = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'probe_calibration.h')
+
+samples = airdata_engine.random_samples(50000, seed=1)
+
+def test_matches_library():
+    engine = airdata_engine.Engine(calibration_surface.read_tables(header))
+    r_engine = engine(*samples)
+    r_library = probe_calibration_lib.pressures_to_airdata(*samples)
+    assert np.sum(r_engine['err']) > 0
+    assert airdata_engine.mismatches(r_engine, r_library) == 0
+
+def test_matches_library_on_blobs():
+    tables = calibration_surface.read_tables(header)
+    for encoding in ['float32', 'int16', 'float16']:
+        quantized = {k: calibration_surface.quantize(s, encoding) for (k, s) in tables.items()}
+        blob = calibration_surface.blob_bytes(quantized)
+        r_engine = airdata_engine.Engine(calibration_surface.parse_blob(blob))(*samples)
+        r_library = probe_calibration_lib.pressures_to_airdata(*samples, blob=blob)
+        assert airdata_engine.mismatches(r_engine, r_library) == 0, encoding
+
+def test_chunks_do_not_change_results():
+    tables = calibration_surface.read_tables(header)
+    whole = airdata_engine.Engine(tables)(*samples)
+    chunked = airdata_engine.Engine(tables, chunk=999)(*samples)
+    for k in ('alpha', 'beta', 'q', 'p', 'err', 'failed'):
+        np.testing.assert_array_equal(chunked[k], whole[k])
@@ -0,0 +1,364 @@
+import abc
+import datetime
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import numpy as np
+
+########################################################################
+
+# Content-hashed artifacts, for rebuilding only what changed.
+#
+# The pipeline is described as a graph of nodes:
+#
+#   File    an input file (sweep CSV, .cal file, template), keyed on the
+#           hash of its contents
+#   Value   a setting, keyed on the hash of its value
+#   Task    a function of other nodes and of settings, keyed on the keys
+#           of its inputs, its settings, its own source and the source
+#           of the modules (or functions) its result depends on
+#
+# Keys are worked out from the inputs' keys alone, without evaluating
+# anything, so an up to date Task is loaded from the store and its
+# inputs are never computed. A stale Task computes its inputs (each in
+# turn loaded or computed), runs, and saves its result in the store as
+# <store_dir>/<name>/<key>/, together with meta.json recording the
+# provenance of the result: the keys of its inputs, the input files,
+# settings and source hashes, and when and where it was made. Only the
+# keep_entries most recent entries of each Task are kept, so switching
+# back and forth between a few settings does not recompute anything.
+#
+# PlotCache does the same for plot jobs, which write files into the
+# tree rather than returning values.
+
+store_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'artifacts')
+
+keep_entries = 4
+
+########################################################################
+
+def _feed(h, v):
+    if isinstance(v, Node):
+        h.update(b'node:' + v.key().encode('ascii'))
+    elif hasattr(v, 'digest') and isinstance(getattr(v, 'digest'), str):
+        h.update(b'digest:' + v.digest.encode('ascii'))
+    elif isinstance(v, dict):
+        h.update(b'dict:%d' % len(v))
+        for k in sorted(v, key=str):
+            _feed(h, str(k))
+            _feed(h, v[k])
+    elif isinstance(v, (list, tuple)):
+        h.update(b'list:%d' % len(v))
+        for x in v:
+            _feed(h, x)
+    elif isinstance(v, (np.ndarray, np.generic)):
+        a = np.ascontiguousarray(v)
+        h.update(('array:%s:%r' % (a.dtype.str, a.shape)).encode('ascii'))
+        h.update(a.tobytes())
+    elif isinstance(v, float):
+        h.update(b'float:' + repr(v).encode('ascii'))
+    elif isinstance(v, (str, int, bool, type(None))):
+        h.update(('%s:%r' % (type(v).__name__, v)).encode('utf-8'))
+    elif callable(v) and hasattr(v, '__qualname__'):
+        h.update(('fn:%s.%s:' % (v.__module__, v.__qualname__)).encode('utf-8'))
+        try:
+            h.update(inspect.getsource(v).encode('utf-8'))
+        except (OSError, TypeError):
+            h.update(source_digest(v.__module__).encode('ascii'))
+    else:
+        h.update(('%s:%r' % (type(v).__name__, v)).encode('utf-8'))
+
+# Stable hash of nested settings, arrays, nodes and functions. Functions
+# hash as their name and their own source, so editing one plot function
+# only invalidates the plots it draws; whatever else a result depends on
+# is named in the code= of its Task.
+def digest(value):
+    h = hashlib.sha256()
+    _feed(h, value)
+    return h.hexdigest()
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+_source_digests = {}
+
+def source_digest(module_name):
+    if module_name not in _source_digests:
+        module = sys.modules.get(module_name) or importlib.import_module(module_name)
+        path = getattr(module, '__file__', None)
+        _source_digests[module_name] = (
+            file_digest(path) if path and path.endswith('.py') else module_name)
+    return _source_digests[module_name]
+
+########################################################################
+
+# How a Task result is written to and read from its store directory
+
+class PickleCodec:
+    file_name = 'value.pickle'
+
+    def dump(self, value, path):
+        with open(path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+# For a dict of arrays
+class NpzCodec:
+    file_name = 'value.npz'
+
+    def dump(self, value, path):
+        with open(path, 'wb') as f:
+            np.savez(f, **value)
+
+    def load(self, path):
+        with np.load(path) as f:
+            return {k: f[k] for k in f.files}
+
+class JsonCodec:
+    file_name = 'value.json'
+
+    def dump(self, value, path):
+        with open(path, 'w') as f:
+            json.dump(value, f, indent=2, default=_json_default)
+
+    def load(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+def _json_default(v):
+    if isinstance(v, np.ndarray):
+        return v.tolist()
+    if isinstance(v, np.generic):
+        return v.item()
+    raise TypeError('cannot store %r as JSON' % (v,))
+
+########################################################################
+
+class Node(abc.ABC):
+
+    @abc.abstractmethod
+    def key(self):
+        pass
+
+    @abc.abstractmethod
+    def value(self):
+        pass
+
+    def provenance(self):
+        return {'key': self.key()}
+
+class File(Node):
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self._key = None
+
+    def key(self):
+        if self._key is None:
+            self._key = file_digest(self.path)
+        return self._key
+
+    def value(self):
+        return self.path
+
+    def provenance(self):
+        return {'file': self.path, 'key': self.key()}
+
+class Value(Node):
+
+    def __init__(self, value):
+        self._value = value
+
+    def key(self):
+        return digest(self._value)
+
+    def value(self):
+        return self._value
+
+    def provenance(self):
+        return {'value': self._value, 'key': self.key()}
+
+def _code_digests(code):
+    return [source_digest(c) if isinstance(c, str) else digest(c) for c in code]
+
+def _code_name(c):
+    if isinstance(c, str):
+        return c
+    if hasattr(c, '__qualname__'):
+        return '%s.%s' % (c.__module__, c.__qualname__)
+    return type(c).__name__
+
+def _code_names(code):
+    return ['%d %s' % (i, _code_name(c)) for (i, c) in enumerate(code)]
+
+def _evaluate(v):
+    if isinstance(v, Node):
+        return v.value()
+    return [_evaluate(x) for x in v]
+
+def _provenance(v):
+    if isinstance(v, Node):
+        return v.provenance()
+    return [_provenance(x) for x in v]
+
+# fn is called with the values of the inputs (a node or a list of nodes
+# each) and the params as keyword arguments. options are passed too but
+# are not part of the key, for things such as worker counts that do not
+# change the result.
+class Task(Node):
+
+    def __init__(self, name, fn, inputs=None, params=None, code=(), codec=None,
+                 options=None):
+        self.name = name
+        self.fn = fn
+        self.inputs = dict(inputs or {})
+        self.params = dict(params or {})
+        self.code = list(code)
+        self.codec = codec or PickleCodec()
+        self.options = dict(options or {})
+        self._key = None
+        self._value = None
+        self._done = False
+        self.computed = False
+
+    def key(self):
+        if self._key is None:
+            self._key = digest({
+                'task': self.name,
+                'fn': self.fn,
+                'code': _code_digests(self.code),
+                'params': self.params,
+                'inputs': self.inputs,
+            })
+        return self._key
+
+    def entry(self):
+        return os.path.join(store_dir, self.name, self.key())
+
+    def fresh(self):
+        return os.path.exists(os.path.join(self.entry(), self.codec.file_name))
+
+    def value(self):
+        if self._done:
+            return self._value
+        path = os.path.join(self.entry(), self.codec.file_name)
+        if os.path.exists(path):
+            self._value = self.codec.load(path)
+        else:
+            inputs = {k: _evaluate(v) for (k, v) in self.inputs.items()}
+            self._value = self.fn(**inputs, **self.params, **self.options)
+            self._save()
+            self.computed = True
+        self._done = True
+        return self._value
+
+    def provenance(self):
+        return {
+            'task': self.name,
+            'key': self.key(),
+            'fn': '%s.%s' % (self.fn.__module__, self.fn.__qualname__),
+            'code': dict(zip(_code_names(self.code), _code_digests(self.code))),
+            'params': self.params,
+            'inputs': {k: _provenance(v) for (k, v) in self.inputs.items()},
+        }
+
+    def meta(self):
+        path = os.path.join(self.entry(), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save(self):
+        parent = os.path.join(store_dir, self.name)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        self.codec.dump(self._value, os.path.join(tmp, self.codec.file_name))
+        meta = dict(
+            self.provenance(),
+            created=datetime.datetime.now().isoformat(timespec='seconds'),
+            host=platform.node())
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2, default=_json_default)
+        old = sorted(
+            [os.path.join(parent, n) for n in os.listdir(parent)
+             if n != self.key() and not n.startswith('tmp')],
+            key=os.path.getmtime)
+        for path in old[:max(0, len(old) - (keep_entries - 1))]:
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rename(tmp, self.entry())
+        except OSError:
+            # Another process got there first with the same content
+            shutil.rmtree(tmp, ignore_errors=True)
+
+# Write content (bytes) to path unless it is there already, so the
+# modification time of an up to date output, and whatever make rules
+# depend on it, are left alone. Returns True if the file was written.
+def publish(content, path):
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == content:
+                return False
+    with open(path, 'wb') as f:
+        f.write(content)
+    return True
+
+########################################################################
+
+# Record of the plot files made by plot jobs. A job is keyed on its
+# function and arguments (see digest); it is up to date if the files it
+# made last time under the same key are still there, unchanged.
+
+class PlotCache:
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(store_dir, 'plots.json')
+        self.jobs = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.jobs = json.load(f)
+        self.skipped = 0
+        self.rendered = 0
+
+    def key(self, fn, args, kwargs):
+        return digest({'fn': fn, 'args': list(args), 'kwargs': kwargs})
+
+    def fresh(self, key):
+        files = self.jobs.get(key)
+        if not files:
+            return False
+        for (path, d) in files.items():
+            if not os.path.exists(path) or file_digest(path) != d:
+                return False
+        return True
+
+    # Record the files a job wrote, forgetting older jobs that wrote them
+    def record(self, key, paths):
+        paths = [os.path.abspath(p) for p in paths if p]
+        for (k, files) in list(self.jobs.items()):
+            if any(p in files for p in paths):
+                del self.jobs[k]
+        self.jobs[key] = {p: file_digest(p) for p in paths}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.jobs, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
@@ -0,0 +1,91 @@
+import contextlib
+import os
+import tempfile
+
+import artifacts
+
+########################################################################
+
+# Rebuilding only what changed, on a small graph:
+#
+#   numbers (File) -> parsed -> scaled (k) -> total
+
+def parse(path):
+    with open(path) as f:
+        return [float(x) for x in f.read().split()]
+
+def scale(parsed, k):
+    return [k * x for x in parsed]
+
+def total(scaled):
+    return sum(scaled)
+
+def graph(path, k):
+    g = {}
+    g['parsed'] = artifacts.Task('parsed', parse, inputs={'path': artifacts.File(path)})
+    g['scaled'] = artifacts.Task(
+        'scaled', scale, inputs={'parsed': g['parsed']}, params={'k': k})
+    g['total'] = artifacts.Task('total', total, inputs={'scaled': g['scaled']})
+    return g
+
+def build(path, k):
+    g = graph(path, k)
+    value = g['total'].value()
+    return (value, sorted(n for (n, t) in g.items() if t.computed))
+
+# A store of its own in a temporary directory, which is returned
+@contextlib.contextmanager
+def temporary_store():
+    store_dir = artifacts.store_dir
+    with tempfile.TemporaryDirectory() as d:
+        artifacts.store_dir = os.path.join(d, 'store')
+        try:
+            yield d
+        finally:
+            artifacts.store_dir = store_dir
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def test_rebuilds_only_changed_nodes():
+    with temporary_store() as d:
+        path = os.path.join(d, 'numbers.txt')
+        write(path, '1 2 3')
+        assert build(path, 2.0) == (12.0, ['parsed', 'scaled', 'total'])
+        assert build(path, 2.0) == (12.0, [])
+        # A new setting reuses the parsed file
+        assert build(path, 3.0) == (18.0, ['scaled', 'total'])
+        # Back to an earlier setting, which is still in the store
+        assert build(path, 2.0) == (12.0, [])
+        write(path, '1 2 4')
+        assert build(path, 2.0) == (14.0, ['parsed', 'scaled', 'total'])
+        g = graph(path, 2.0)
+        assert g['total'].fresh() and g['total'].meta()['key'] == g['total'].key()
+
+def test_up_to_date_task_does_not_evaluate_its_inputs():
+    with temporary_store() as d:
+        path = os.path.join(d, 'numbers.txt')
+        write(path, '1 2 3')
+        build(path, 2.0)
+        os.remove(os.path.join(graph(path, 2.0)['parsed'].entry(), 'value.pickle'))
+        g = graph(path, 2.0)
+        assert g['total'].value() == 12.0
+        assert not g['parsed'].fresh() and not g['parsed'].computed
+
+def test_publish_leaves_unchanged_files_alone():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'out.h')
+        assert artifacts.publish(b'abc', path)
+        assert not artifacts.publish(b'abc', path)
+        assert artifacts.publish(b'abd', path)
+
+def test_incomplete_node_fails_when_created():
+    class KeyOnly(artifacts.Node):
+        def key(self):
+            return 'k'
+    try:
+        KeyOnly()
+    except TypeError:
+        return
+    assert False, 'a Node without value() was created'
@@ -0,0 +1,361 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import log_replay
+import sentences
+
+########################################################################
+
+# Offline simulation of the firmware's PressureAutozero over recorded
+# power-on logs, to see how its two constants behave on real data.
+#
+# At power on the firmware sums the first kAccumulatorReadings (dp0,
+# dpa, dpb) readings in float32, scales the sum by -1/kAccumulatorReadings
+# to get candidate offsets, and keeps them only if none of them exceeds
+# kReasonableZeroOffset in magnitude. simulate() does the same, for a
+# whole grid of (window, threshold) settings at once: the running float32
+# sum of a session's readings gives the candidate offsets for every
+# window, bit for bit those of the firmware, and each is compared with
+# every threshold.
+#
+# Logs are streamed a chunk at a time (see log_replay) and only their $A
+# lines and the offsets the firmware reports are read. A session is one
+# power-on, starting at count 0 and running until the count goes back
+# down; sessions whose start is not in the log are counted but not
+# simulated. The offset error of an accepted autozero is measured against
+# reference offsets, minus the mean of the first `reference` readings of
+# the session, a longer average than any window should need.
+#
+# $A readings are logged after the autozero has added its offsets: the
+# ones it started with up to the last reading of its own window, and from
+# that reading on the ones it calculated, if it accepted them. The
+# firmware prints both on Serial ("Starting with loaded offsets: ...",
+# "Calculated new offsets: ..."), to two decimals. When a log has these
+# lines, the offsets are subtracted to get back the raw readings. When a
+# session has no "Starting with" line its offsets are unknown: it is
+# simulated on the logged readings as they are, which makes the candidate
+# offsets look closer to zero than those of the raw sensor readings, and
+# its reference only uses the readings before the firmware's own window
+# ends, which all carry the same offsets. The results warn about them.
+#
+# Logs are independent, so they are spread over a process pool.
+
+firmware_file = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pressure_autozero.cpp')
+
+CHANNELS = ['dp0', 'dpa', 'dpb']
+
+default_windows = [25, 50, 100, 200, 400]
+
+default_thresholds = [10.0, 25.0, 50.0, 100.0, 200.0]
+
+default_reference = 1000
+
+########################################################################
+
+# The window and threshold the firmware uses, read from its source
+def firmware_settings(path=firmware_file):
+    with open(path) as f:
+        text = f.read()
+    window = re.search(r'kAccumulatorReadings\s*=\s*(\d+)', text)
+    threshold = re.search(r'kReasonableZeroOffset\s*=\s*([0-9.]+)', text)
+    return (int(window.group(1)), float(threshold.group(1)))
+
+# Candidate offsets for each window, as the firmware computes them:
+# readings summed in float32 in order, then scaled in float32
+def candidate_offsets(readings, windows):
+    sums = np.cumsum(np.asarray(readings, dtype=np.float32), axis=0, dtype=np.float32)
+    w = np.asarray(windows)
+    scale = (-1.0 / w).astype(np.float32)
+    return sums[w - 1] * scale[:, None]
+
+# The firmware rejects offsets if any of them is greater in magnitude
+# than the threshold. Returns (windows, thresholds) booleans.
+def accepted(offsets, thresholds):
+    magnitude = np.max(np.abs(offsets), axis=-1)
+    return magnitude[:, None] <= np.asarray(thresholds, dtype=np.float32)[None, :]
+
+########################################################################
+
+# Offsets the firmware reports: what it starts a session with, and the
+# new ones it calculates
+offset_pattern = re.compile(
+    rb'(?:^|\n)(Starting with (?:loaded|default)|Calculated new) offsets:([^\n]*)')
+
+# The $A readings and offset reports of a chunk in log order: arrays of
+# $A rows, and ('start' or 'new', offsets) pairs
+def read_chunk(chunk):
+    items = []
+    at = 0
+    for m in offset_pattern.finditer(chunk):
+        items.append(_parse_raw(chunk[at:m.start()]))
+        offsets = m.group(2).split()
+        try:
+            offsets = np.array([float(v) for v in offsets])
+        except ValueError:
+            offsets = []
+        if len(offsets) == len(CHANNELS):
+            items.append(('start' if m.group(1).startswith(b'Starting') else 'new', offsets))
+        at = m.end()
+    items.append(_parse_raw(chunk[at:]))
+    return items
+
+def _parse_raw(chunk):
+    return log_replay.parse_lines(chunk, b'$A,', len(sentences.raw_airdata_dtype))
+
+########################################################################
+
+# Outcome counts and offset errors of each setting, over many sessions
+class Tally:
+
+    def __init__(self, windows, thresholds, reference=default_reference):
+        self.windows = list(windows)
+        self.thresholds = list(thresholds)
+        self.reference = reference
+        shape = (len(self.windows), len(self.thresholds))
+        self.sessions = 0
+        self.joined_late = 0
+        self.offsets_unknown = 0
+        self.complete = np.zeros(len(self.windows), np.int64)
+        self.accepted = np.zeros(shape, np.int64)
+        self.squares = np.zeros(shape + (len(CHANNELS),))
+        self.max = np.zeros(shape + (len(CHANNELS),))
+
+    # Rows needed from the start of a session
+    def needed(self):
+        return max(max(self.windows), self.reference)
+
+    # Simulate one session, given at least its first needed() readings
+    # if it has that many. same_offsets, if given, says the readings
+    # still carry unknown offsets, the same ones for the first
+    # same_offsets readings; only those go into the reference.
+    def add(self, readings, same_offsets=None):
+        self.sessions += 1
+        readings = np.asarray(readings)
+        reference = self.reference
+        if same_offsets is not None:
+            self.offsets_unknown += 1
+            reference = min(reference, same_offsets)
+        complete = np.asarray(self.windows) <= len(readings)
+        self.complete += complete
+        if not complete.any():
+            return
+        windows = np.asarray(self.windows)[complete]
+        offsets = candidate_offsets(readings, windows)
+        ok = accepted(offsets, self.thresholds)
+        reference = -np.mean(readings[:reference], axis=0)
+        error = offsets.astype(np.float64) - reference
+        self.accepted[complete] += ok
+        self.squares[complete] += ok[:, :, None] * np.square(error)[:, None, :]
+        self.max[complete] = np.maximum(
+            self.max[complete], ok[:, :, None] * np.abs(error)[:, None, :])
+
+    def merge(self, other):
+        self.sessions += other.sessions
+        self.joined_late += other.joined_late
+        self.offsets_unknown += other.offsets_unknown
+        self.complete += other.complete
+        self.accepted += other.accepted
+        self.squares += other.squares
+        self.max = np.maximum(self.max, other.max)
+
+    # One row per setting
+    def summary(self):
+        rows = []
+        for (i, w) in enumerate(self.windows):
+            for (j, t) in enumerate(self.thresholds):
+                n = int(self.accepted[i, j])
+                complete = int(self.complete[i])
+                rows.append({
+                    'window': w,
+                    'threshold': t,
+                    'sessions': self.sessions,
+                    'incomplete': self.sessions - complete,
+                    'accepted': n,
+                    'rejected': complete - n,
+                    'accept_rate': n / complete if complete else float('nan'),
+                    'rms_error': {
+                        c: float(np.sqrt(self.squares[i, j, k] / n)) if n else float('nan')
+                        for (k, c) in enumerate(CHANNELS)
+                    },
+                    'max_error': {
+                        c: float(self.max[i, j, k]) if n else float('nan')
+                        for (k, c) in enumerate(CHANNELS)
+                    },
+                })
+        return rows
+
+    def warning(self):
+        if not self.offsets_unknown:
+            return None
+        return (
+            '%d of %d sessions have no logged starting offsets; they were simulated on '
+            'readings that still carry the firmware offsets, so their accept rates and '
+            'errors are not those of the raw sensor readings' % (
+                self.offsets_unknown, self.sessions))
+
+# Splits a stream of $A arrays and offset reports into sessions, keeping
+# the first rows of each with the offsets in force, and hands every
+# finished session to the tally with the offsets taken out. switch is
+# where the firmware puts in the offsets it calculates: the last reading
+# of its window.
+class Sessions:
+
+    def __init__(self, tally, switch):
+        self.tally = tally
+        self.need = tally.needed()
+        self.switch = switch
+        self.rows = None
+        self.last = None
+        self.starting = None
+
+    def _finish(self):
+        if self.rows is not None:
+            readings = np.concatenate(self.rows)[:self.need]
+            if self.start is None:
+                self.tally.add(readings, self.new_at)
+            else:
+                in_force = np.tile(self.start, (len(readings), 1))
+                if self.new is not None:
+                    in_force[self.new_at:] = self.new
+                self.tally.add(readings - in_force)
+        self.rows = None
+
+    def event(self, kind, offsets):
+        if kind == 'start':
+            self.starting = offsets
+        elif self.rows is not None:
+            self.new = offsets
+            self.new_at = sum(len(r) for r in self.rows)
+
+    def add(self, raw):
+        if not len(raw):
+            return
+        count = raw[:, 0]
+        cuts = np.flatnonzero(np.diff(count) < 0) + 1
+        if self.last is None or count[0] < self.last:
+            cuts = np.concatenate(([0], cuts))
+        self.last = count[-1]
+        bounds = list(cuts) + [len(raw)]
+        if bounds[0] > 0 and self.rows is not None:
+            self._keep(raw[:bounds[0], 3:6])
+        for (start, end) in zip(bounds[:-1], bounds[1:]):
+            self._finish()
+            if count[start] != 0:
+                self.tally.joined_late += 1
+                continue
+            self.rows = []
+            (self.start, self.starting) = (self.starting, None)
+            (self.new, self.new_at) = (None, self.switch)
+            self._keep(raw[start:end, 3:6])
+
+    def _keep(self, readings):
+        kept = sum(len(r) for r in self.rows)
+        if kept < self.need:
+            self.rows.append(readings[:self.need - kept])
+
+    def close(self):
+        self._finish()
+
+def simulate_log(path, windows, thresholds, reference=default_reference,
+                 chunk_bytes=log_replay.DEFAULT_CHUNK_BYTES):
+    tally = Tally(windows, thresholds, reference)
+    sessions = Sessions(tally, firmware_settings()[0] - 1)
+    for (_, start, end) in log_replay.chunk_ranges(path, chunk_bytes):
+        for item in read_chunk(log_replay.read_range(path, start, end)):
+            if isinstance(item, tuple):
+                sessions.event(*item)
+            else:
+                sessions.add(item)
+    sessions.close()
+    return tally
+
+def simulate(logs, windows, thresholds, reference=default_reference,
+             chunk_bytes=log_replay.DEFAULT_CHUNK_BYTES, workers=None):
+    tally = Tally(windows, thresholds, reference)
+    workers = min(workers or os.cpu_count() or 1, max(1, len(logs)))
+    if workers == 1:
+        parts = [simulate_log(l, windows, thresholds, reference, chunk_bytes) for l in logs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            n = len(logs)
+            parts = pool.map(
+                simulate_log, logs, [windows] * n, [thresholds] * n,
+                [reference] * n, [chunk_bytes] * n)
+    for p in parts:
+        tally.merge(p)
+    return tally
+
+########################################################################
+
+def summary_table(rows, firmware=None):
+    lines = ['%7s %9s %8s %10s %8s %8s %7s  %s  %s' % (
+        'window', 'threshold', 'sessions', 'incomplete', 'accepted', 'rejected', 'accept',
+        ' '.join('%9s' % ('rms ' + c) for c in CHANNELS),
+        ' '.join('%9s' % ('max ' + c) for c in CHANNELS))]
+    for r in rows:
+        mark = '*' if firmware == (r['window'], r['threshold']) else ' '
+        lines.append('%6d%s %9g %8d %10d %8d %8d %7.3f  %s  %s' % (
+            r['window'], mark, r['threshold'], r['sessions'], r['incomplete'],
+            r['accepted'], r['rejected'], r['accept_rate'],
+            ' '.join('%9.4g' % r['rms_error'][c] for c in CHANNELS),
+            ' '.join('%9.4g' % r['max_error'][c] for c in CHANNELS)))
+    return '\n'.join(lines) + '\n'
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Simulate the firmware autozero over power-on logs for a grid of settings')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument(
+        '--windows', type=int, nargs='+', default=None,
+        help='readings to average (default: %s and the firmware value)' % default_windows)
+    parser.add_argument(
+        '--thresholds', type=float, nargs='+', default=None,
+        help='largest offset to accept, in Pa (default: %s and the firmware value)' % default_thresholds)
+    parser.add_argument(
+        '--reference', type=int, default=default_reference,
+        help='readings averaged for the reference offsets (default: %d)' % default_reference)
+    parser.add_argument('--chunk-mb', type=int, default=log_replay.DEFAULT_CHUNK_BYTES >> 20)
+    parser.add_argument('--output', default=None, help='write the results as JSON here')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    firmware = firmware_settings()
+    windows = sorted(set(args.windows or default_windows + [firmware[0]]))
+    thresholds = sorted(set(args.thresholds or default_thresholds + [firmware[1]]))
+    start = time.monotonic()
+    tally = simulate(
+        args.logs, windows, thresholds, args.reference, args.chunk_mb << 20, args.jobs)
+    elapsed = time.monotonic() - start
+    rows = tally.summary()
+    sys.stdout.write(summary_table(rows, firmware))
+    sys.stderr.write('%d sessions (%d joined late) from %d logs in %.2f s\n' % (
+        tally.sessions, tally.joined_late, len(args.logs), elapsed))
+    warning = tally.warning()
+    if warning:
+        sys.stderr.write('warning: %s\n' % warning)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'firmware': {'window': firmware[0], 'threshold': firmware[1]},
+                'reference': args.reference,
+                'sessions': tally.sessions,
+                'joined_late': tally.joined_late,
+                'offsets_unknown': tally.offsets_unknown,
+                'warning': warning,
+                'settings': rows,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
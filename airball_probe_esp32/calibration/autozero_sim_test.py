@@ -0,0 +1,113 @@
+import os
+import tempfile
+import numpy as np
+
+import autozero_sim
+import sentences
+
+########################################################################
+
+# Simulation over a log where the probe was reset in the middle of
+# writing a line.
+
+windows = [4, 8]
+
+thresholds = [1.0, 100.0]
+
+def session(n, offset, seed):
+    rng = np.random.default_rng(seed)
+    return [
+        sentences.format_raw_airdata(i, 101325.0, 15.0, *(offset + rng.normal(0, 0.5, 3)))
+        for i in range(n)
+    ]
+
+def simulate(lines, chunk_bytes=autozero_sim.log_replay.DEFAULT_CHUNK_BYTES):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'log.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        tally = autozero_sim.simulate_log(path, windows, thresholds, 10, chunk_bytes)
+    return tally.summary()
+
+def test_reset_truncated_line():
+    first = session(20, np.array([10.0, -5.0, 2.0]), 0)
+    second = session(20, np.array([-20.0, 3.0, 1.0]), 1)
+    # The reset cut off the last line of the first session, with or
+    # without a newline before the next session starts
+    truncated = first[-1][:len(first[-1]) - 12]
+    expected = simulate(first[:-1] + second)
+    assert expected[0]['sessions'] == 2
+    np.testing.assert_equal(simulate(first[:-1] + [truncated] + second), expected)
+    np.testing.assert_equal(simulate(first[:-1] + [truncated + second[0]] + second[1:]),
+                            simulate(first[:-1] + second[1:]))
+    # A garbled line in the middle of a session only loses that reading
+    garbled = first[5].replace('.', 'x', 2)
+    np.testing.assert_equal(
+        simulate(first[:5] + [garbled] + first[6:-1] + [truncated] + second),
+        simulate(first[:5] + first[6:-1] + second))
+
+def test_reset_truncated_line_across_chunks():
+    first = session(20, np.array([10.0, -5.0, 2.0]), 0)
+    second = session(20, np.array([-20.0, 3.0, 1.0]), 1)
+    truncated = first[-1][:len(first[-1]) - 12]
+    lines = first[:-1] + [truncated] + second
+    np.testing.assert_equal(simulate(lines, 256), simulate(first[:-1] + second))
+
+# A session logged the way the firmware logs it: the offsets it starts
+# with, and the readings with those offsets added up to the last of its
+# window, where it calculates new ones from the raw readings
+def firmware_log(raw, start, window):
+    new = autozero_sim.candidate_offsets(raw, [window])[0]
+    lines = ['Read from preferences:  %.2f %.2f %.2f' % tuple(start),
+             'Starting with loaded offsets:  %.2f %.2f %.2f' % tuple(start)]
+    for (i, r) in enumerate(raw):
+        if i == window - 1:
+            lines.append('Calculated new offsets:  %.2f %.2f %.2f' % tuple(new))
+        lines.append(sentences.format_raw_airdata(
+            i, 101325.0, 15.0, *(r + (start if i < window - 1 else new))))
+        if i == window - 1:
+            lines.append('Wrote to preferences:  %.2f %.2f %.2f' % tuple(new))
+    return lines
+
+def simulate_lines(lines, windows, reference):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'log.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return autozero_sim.simulate_log(path, windows, thresholds, reference)
+
+def test_logged_offsets_are_taken_out():
+    (window, _) = autozero_sim.firmware_settings()
+    (windows, reference) = ([window // 2, window * 2], window * 3)
+    rng = np.random.default_rng(2)
+    raw = [np.array([10.0, -5.0, 2.0]) + rng.normal(0, 0.5, (reference + 20, 3)),
+           np.array([-3.0, 4.0, 0.5]) + rng.normal(0, 0.5, (reference + 20, 3))]
+    lines = (firmware_log(raw[0], np.array([-9.5, 4.25, -2.0]), window) +
+             firmware_log(raw[1], np.array([0.0, 0.0, 0.0]), window))
+    tally = simulate_lines(lines, windows, reference)
+    expected = autozero_sim.Tally(windows, thresholds, reference)
+    for r in raw:
+        expected.add(np.round(r, 6)[:expected.needed()])
+    assert tally.offsets_unknown == 0 and tally.warning() is None
+    for (got, want) in zip(tally.summary(), expected.summary()):
+        assert got['accepted'] == want['accepted'] and got['rejected'] == want['rejected']
+        for k in ['rms_error', 'max_error']:
+            np.testing.assert_allclose(
+                [got[k][c] for c in autozero_sim.CHANNELS],
+                [want[k][c] for c in autozero_sim.CHANNELS], atol=0.01)
+    # Offsets around 10 Pa are rejected at 1 Pa and accepted at 100 Pa
+    assert [r['accepted'] for r in tally.summary()] == [0, 2, 0, 2]
+
+def test_unknown_offsets_keep_the_reference_before_the_switch():
+    (window, _) = autozero_sim.firmware_settings()
+    (windows, reference) = ([window // 2, window * 2], window * 3)
+    rng = np.random.default_rng(3)
+    raw = np.array([10.0, -5.0, 2.0]) + rng.normal(0, 0.5, (reference + 20, 3))
+    lines = [l for l in firmware_log(raw, np.array([-9.5, 4.25, -2.0]), window)
+             if l.startswith('$A,')]
+    tally = simulate_lines(lines, windows, reference)
+    assert tally.offsets_unknown == 1 and tally.warning() is not None
+    logged = np.array([[float(v) for v in l.split(',')[4:7]] for l in lines])
+    expected = autozero_sim.Tally(windows, thresholds, reference)
+    expected.add(logged[:expected.needed()], window - 1)
+    np.testing.assert_equal(tally.summary(), expected.summary())
@@ -0,0 +1,236 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+from calibration import Calibration
+import raw_data
+import sweep
+
+########################################################################
+
+# Benchmarks of the calibration pipeline on synthetic tunnel sweeps.
+#
+# A synthetic sweep is a CSV in the same alpha,beta,<8 counts> format as
+# the files in raw_data/. Hole pressures come from potential flow around
+# a sphere, the center hole on the probe axis and the d/u/r/l holes at
+# HOLE_ANGLE from it, with a static port that reads lower as the flow
+# angle grows. Channel 0 is tunnel q, channels 1..6 the d/u/r/l/c/s
+# holes and channel 7 is unused, as in the tunnel data. Pressures are
+# turned into counts by inverting the esp32_scanner.cal sensor fits, and
+# Gaussian count noise is added.
+#
+# Rows are spread evenly over an alpha/beta grid. The parse stage scales
+# with rows; the stages after it scale with grid points, so both can be
+# varied.
+#
+# Each stage is timed on its own, taking the best of --repeat runs:
+#
+#   generate   write the synthetic CSV (skipped if already there)
+#   parse      sweep.read_channels, all in memory
+#   stream     sweep.read_channels_streaming
+#   derive     raw_data dataset and all its derived columns
+#   fit        generate_calibrations.fit_models
+#   tables     generate_calibrations.generate_tables
+#   render     generate_calibrations.write_file (template rendering)
+#   verify     verify_calibrations.derive + summarize
+#
+# Results can be saved as JSON and compared against a saved baseline,
+# flagging stages that got slower by more than --tolerance.
+
+HOLE_ANGLE = math.radians(42)
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+STAGES = ['generate', 'parse', 'stream', 'derive', 'fit', 'tables', 'render', 'verify']
+
+bench_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'bench')
+
+cal_file = raw_data.cal_file
+
+########################################################################
+
+def sphere_cp(cos_theta):
+    return 1 - 9.0 / 4.0 * (1 - np.square(cos_theta))
+
+# Pressure coefficients (d, u, r, l, c, s) for flow at alpha, beta (deg)
+def pressure_coefficients(alpha, beta):
+    a = np.radians(alpha)
+    b = np.radians(beta)
+    # Unit vector toward where the flow comes from; x forward, y right, z down
+    w = np.stack((np.cos(a) * np.cos(b), np.sin(b), np.sin(a) * np.cos(b)))
+    (ch, sh) = (math.cos(HOLE_ANGLE), math.sin(HOLE_ANGLE))
+    holes = {
+        'd': (ch, 0, sh),
+        'u': (ch, 0, -sh),
+        'r': (ch, sh, 0),
+        'l': (ch, -sh, 0),
+        'c': (1, 0, 0),
+    }
+    cp = {k: sphere_cp(np.tensordot(n, w, axes=1)) for (k, n) in holes.items()}
+    cp['s'] = -0.45 - 0.6 * (1 - w[0])
+    return np.column_stack([cp[k] for k in raw_data.raw_pressures])
+
+def grid(step):
+    values = np.arange(-45, 45 + step / 2, step)
+    (alpha, beta) = np.meshgrid(values, values, indexing='ij')
+    return (alpha.ravel(), beta.ravel())
+
+def synthetic_samples(rows, cal, step=5, q=150.0, noise=3.0, seed=0):
+    rng = np.random.default_rng(seed)
+    (alpha, beta) = grid(step)
+    point = np.arange(rows) * len(alpha) // rows
+    pressures = np.zeros((rows, sweep.NUM_CHANNELS))
+    pressures[:, 0] = q
+    pressures[:, 1:7] = q * pressure_coefficients(alpha, beta)[point]
+    counts = (pressures - cal.offsets) / cal.gains
+    counts = np.rint(counts + rng.normal(0, noise, counts.shape))
+    return np.column_stack((alpha[point], beta[point], counts)).astype(np.int64)
+
+def write_sweep(path, samples, block=1000000):
+    with open(path, 'w') as f:
+        for i in range(0, len(samples), block):
+            np.savetxt(f, samples[i:i + block], fmt='%d', delimiter=',')
+
+def sweep_path(rows, step, seed):
+    return os.path.join(bench_dir, 'sweep_%d_s%g_%d.csv' % (rows, step, seed))
+
+########################################################################
+
+# The first call of a stage loads templates and libraries, so stages
+# after parse get one untimed run first.
+def best_time(fn, repeat, warmup=True):
+    if warmup:
+        fn()
+    best = float('inf')
+    for i in range(0, repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return (best, result)
+
+def run_size(rows, step=5, seed=0, repeat=3):
+    import generate_calibrations
+    import verify_calibrations
+
+    cal = Calibration(cal_file)
+    path = sweep_path(rows, step, seed)
+    t = {}
+
+    if os.path.exists(path):
+        t['generate'] = None
+    else:
+        os.makedirs(bench_dir, exist_ok=True)
+        start = time.perf_counter()
+        write_sweep(path, synthetic_samples(rows, cal, step, seed=seed))
+        t['generate'] = time.perf_counter() - start
+
+    (t['parse'], (data, _)) = best_time(
+        lambda: sweep.read_channels(path, cal, stream=False), repeat, warmup=False)
+    (t['stream'], _) = best_time(
+        lambda: sweep.read_channels_streaming(path, cal), repeat, warmup=False)
+
+    def derive():
+        dataset = raw_data.from_channels(data)
+        views = raw_data.views(dataset)
+        for v in views.values():
+            for k in v:
+                v[k]
+        return views
+    (t['derive'], views) = best_time(derive, repeat)
+
+    (t['fit'], model) = best_time(
+        lambda: generate_calibrations.fit_models(views['ratios_pos']), repeat)
+
+    raw2data = generate_calibrations.make_raw2data(model)
+    (t['tables'], structs) = best_time(
+        lambda: generate_calibrations.generate_tables(raw2data), repeat)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        (t['render'], _) = best_time(
+            lambda: generate_calibrations.write_file(
+                structs, os.path.join(tmp, 'probe_calibration.h')),
+            repeat)
+
+    (t['verify'], summary) = best_time(
+        lambda: verify_calibrations.summarize(
+            views, verify_calibrations.derive(views['deltas'])),
+        repeat)
+
+    return {
+        'rows': rows,
+        'points': len(data.alpha),
+        'seconds': t,
+        'verify': summary,
+    }
+
+########################################################################
+
+def print_results(results, out=sys.stdout):
+    out.write('%10s %8s' % ('rows', 'points') +
+              ''.join(' %10s' % s for s in STAGES) + '\n')
+    for r in results:
+        out.write('%10d %8d' % (r['rows'], r['points']))
+        for s in STAGES:
+            v = r['seconds'][s]
+            out.write(' %10s' % ('-' if v is None else '%.4f' % v))
+        out.write('\n')
+    out.flush()
+
+# Stages of the results that are slower than in the baseline, for the
+# sizes (rows and grid points) in both, as (rows, stage, baseline seconds, seconds)
+def regressions(results, baseline, tolerance=0.25, min_seconds=0.01):
+    base = {(r['rows'], r['points']): r['seconds'] for r in baseline}
+    slower = []
+    for r in results:
+        key = (r['rows'], r['points'])
+        if key not in base:
+            continue
+        for s in STAGES:
+            (b, v) = (base[key].get(s), r['seconds'][s])
+            if b is None or v is None or s == 'generate':
+                continue
+            if v > max(b, min_seconds) * (1 + tolerance):
+                slower.append((r['rows'], s, b, v))
+    return slower
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the calibration pipeline')
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+        help='synthetic sweep sizes in rows (default: %s)' % ' '.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--step', type=float, default=5, help='alpha/beta grid step (deg)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage; the best is kept')
+    parser.add_argument('--output', default=None, help='save the results as JSON')
+    parser.add_argument('--baseline', default=None, help='compare against results saved earlier')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='fraction by which a stage may be slower than the baseline')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    results = [run_size(n, args.step, args.seed, args.repeat) for n in args.sizes]
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for (rows, stage, b, v) in slower:
+            print('REGRESSION %d rows %s: %.4f s -> %.4f s' % (rows, stage, b, v))
+        if slower:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
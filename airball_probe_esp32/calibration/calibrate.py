@@ -0,0 +1,438 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import os
+import sys
+import instrument
+import raw_data
+
+########################################################################
+
+# Staged command line for the calibration pipeline. Each stage computes
+# only what it needs:
+#
+#   load    parse (or load from cache) the tunnel sweeps
+#   fit     fit the probe models and report their residuals
+#   tables  regenerate probe_calibration.h
+#   plots   render the calibration plots
+#   verify  run the raw data through the firmware math and compare
+#   resample  bootstrap and leave-one-run-out cross-validation of the
+#           models (see resampling.py)
+#   accuracy  map the table error against the fitted models over the
+#           whole table domain (see accuracy_map.py)
+#   noise   propagate sensor noise through the firmware math over the
+#           tunnel points (see uncertainty.py)
+#   build   bring the header, verification and plots up to date,
+#           redoing only the steps whose inputs changed (see pipeline.py)
+#
+# generate_calibrations.py and verify_calibrations.py still run the full
+# pipeline end to end when invoked directly.
+#
+# --report writes the timing and memory of each step (see instrument.py)
+# as JSON, and --profile runs the named steps under cProfile.
+
+def load(args):
+    return raw_data.views(raw_data.load(args.files, workers=args.jobs))
+
+def fit(args):
+    import generate_calibrations
+    views = load(args)
+    return (views, generate_calibrations.fit_models(views['ratios_pos']))
+
+########################################################################
+
+def stage_load(args):
+    dataset = raw_data.load(args.files, workers=args.jobs)
+    print('%d points from %d files' % (len(dataset), len(args.files or raw_data.raw_data_files)))
+
+def stage_fit(args):
+    import generate_calibrations
+    import fitting
+    if not args.orders:
+        (views, model) = fit(args)
+        for k in model:
+            print('%-18s rms %.6f  cond %10.4g  terms %d' % (
+                k, model[k].rms, model[k].cond, model[k].model.n))
+        return
+    r = load(args)['ratios_pos']
+    for k in generate_calibrations.model_families:
+        fits = fitting.sweep_orders(
+            generate_calibrations.model_families[k],
+            args.orders,
+            r['dpa_over_dp0'],
+            r['dpb_over_dp0'],
+            r[k])
+        for (order, f) in fits:
+            print('%-18s order %2d  rms %.6f  cond %10.4g  terms %d' % (
+                k, order, f.rms, f.cond, f.model.n))
+
+def stage_tables(args):
+    import generate_calibrations
+    (views, model) = fit(args)
+    structs = generate_calibrations.generate_tables(
+        generate_calibrations.make_raw2data(model),
+        dp_step=args.step)
+    output = args.output or generate_calibrations.output_file
+    report = generate_calibrations.export_tables(
+        structs, output, args.format, args.encoding)
+    for k in report or {}:
+        r = report[k]
+        print('%-18s %-7s max error %.3g rms %.3g (range %.4g) %8d bytes, float32 %8d' % (
+            k, r['encoding'], r['max_abs_error'], r['rms_error'], r['range'],
+            r['bytes'], r['float32_bytes']))
+    print('wrote ' + output)
+
+def stage_plan(args):
+    import generate_calibrations
+    import grid_planner
+    (views, model) = fit(args)
+    max_error = dict(grid_planner.default_max_error)
+    for spec in args.max_error or []:
+        (k, v) = spec.split('=')
+        max_error[k] = float(v)
+    (x_extent, y_extent) = grid_planner.coverage(views['ratios_pos'], args.coverage)
+    print('covering dpa/dp0 <= %g, dpb/dp0 <= %g' % (x_extent, y_extent))
+    plan = grid_planner.plan(model, max_error, x_extent, y_extent)
+    for k in plan:
+        p = plan[k]
+        print('%-18s x %4d x %-6g y %4d x %-6g max error %.5f (<= %g) rms %.5f %8d bytes' % (
+            k, p['x']['size'], p['x']['step'], p['y']['size'], p['y']['step'],
+            p['max_error'], max_error[k], p['rms_error'], p['bytes']))
+    print('total %d bytes' % grid_planner.total_bytes(plan))
+    if args.output:
+        generate_calibrations.write_file(
+            generate_calibrations.generate_planned_tables(model, plan), args.output)
+        print('wrote ' + args.output)
+
+def stage_plots(args):
+    import generate_calibrations
+    from plotting import PlotQueue
+    (views, model) = fit(args)
+    with PlotQueue(args.jobs, preview=args.preview) as queue:
+        generate_calibrations.plot_raw_data(views, queue)
+        generate_calibrations.plot_curve_fits(views['ratios_pos'], model, queue)
+        generate_calibrations.plot_tables(
+            generate_calibrations.generate_tables(
+                generate_calibrations.make_raw2data(model)),
+            queue)
+
+def stage_verify(args):
+    import verify_calibrations
+    views = load(args)
+    cal_derived = verify_calibrations.derive(views['deltas'])
+    summary = verify_calibrations.summarize(views, cal_derived)
+    for k in summary:
+        print('%-16s %s' % (k, summary[k]))
+    if args.plots:
+        from plotting import PlotQueue
+        with PlotQueue(args.jobs, preview=args.preview) as queue:
+            verify_calibrations.plot_verification(views, cal_derived, queue)
+
+def stage_resample(args):
+    import json
+    import numpy as np
+    import fitting
+    import generate_calibrations
+    import resampling
+    from plotting import PlotQueue
+    dataset = raw_data.load(args.files, workers=args.jobs)
+    r = raw_data.views(dataset)['ratios_pos']
+    (x, y) = (r['dpa_over_dp0'], r['dpb_over_dp0'])
+    if args.orders:
+        models = {
+            '%s@%d' % (k, order): family(order)
+            for (k, family) in generate_calibrations.model_families.items()
+            for order in args.orders
+        }
+        targets = {m: r[m.split('@')[0]] for m in models}
+    else:
+        models = dict(generate_calibrations.model_functions)
+        targets = {k: r[k] for k in models}
+    fits = fitting.fit_models(models, x, y, targets)
+
+    report = {'rows': len(x), 'runs': dataset.run_names}
+    if len(dataset.run_names) > 1:
+        with instrument.stage('cross-validate', rows=len(x)):
+            cv = resampling.cross_validate(
+                models, x, y, targets, dataset.run, dataset.run_names)
+        report['cross_validation'] = cv
+        print('leave one run out: rms error on the held out run')
+        print('%-20s %10s %10s' % ('model', 'train', 'cv') +
+              ''.join(' %12s' % n for n in dataset.run_names))
+        for k in cv:
+            print('%-20s %10.4g %10.4g' % (k, cv[k]['train_rms'], cv[k]['cv_rms']) +
+                  ''.join(' %12.4g' % cv[k]['runs'][n]['rms_error'] for n in dataset.run_names))
+
+    if args.replicates:
+        with instrument.stage('bootstrap', rows=args.replicates * len(models)):
+            coefs = resampling.bootstrap(
+                models, x, y, targets, args.replicates, args.seed,
+                dataset.run if args.by == 'runs' else None, args.jobs)
+        (gx, gy) = np.meshgrid(
+            np.arange(0, args.x_extent + args.step / 2, args.step),
+            np.arange(0, args.y_extent + args.step / 2, args.step),
+            indexing='ij')
+        b = resampling.bands(models, coefs, gx, gy, args.level, fits)
+        report['bootstrap'] = {
+            'replicates': args.replicates,
+            'by': args.by,
+            'level': args.level,
+            'models': {
+                k: {
+                    'surface': resampling.band_summary(b[k]),
+                    'coefficients': resampling.coefficient_summary(models[k], coefs[k], fits[k]),
+                }
+                for k in models
+            },
+        }
+        print('%d bootstrap replicates by %s: %g%% band half width over the table domain' % (
+            args.replicates, args.by, 100 * args.level))
+        for k in models:
+            m = report['bootstrap']['models'][k]['surface']
+            (i, j) = m['max_at']
+            print('%-20s mean %10.4g  max %10.4g at (%.2f, %.2f)' % (
+                k, m['mean_half_width'], m['max_half_width'], gx[i, j], gy[i, j]))
+        if not args.no_plots:
+            with PlotQueue(args.jobs) as queue:
+                resampling.plot_bands(gx, gy, b, args.level, queue, args.output_dir)
+            print('wrote ' + args.output_dir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('wrote ' + args.output)
+
+def stage_accuracy(args):
+    import accuracy_map
+    import calibration_surface
+    import generate_calibrations
+    from plotting import PlotQueue
+    (views, model) = fit(args)
+    if args.tables:
+        surfaces = calibration_surface.read_tables(args.tables)
+    else:
+        surfaces = generate_calibrations.generate_tables(
+            generate_calibrations.make_raw2data(model), dp_step=args.step)
+    with instrument.stage('accuracy') as s:
+        maps = accuracy_map.accuracy_map(
+            model, surfaces, args.subdivisions, args.outside)
+        s['rows'] = sum(maps[k]['points'] for k in maps)
+    rows = accuracy_map.summary(maps)
+    sys.stdout.write(accuracy_map.summary_table(rows))
+    if not args.no_plots:
+        with PlotQueue(args.jobs) as queue:
+            accuracy_map.plot_maps(maps, queue, args.output_dir)
+        accuracy_map.write_summary(rows, os.path.join(args.output_dir, 'accuracy_summary.txt'))
+        print('wrote ' + args.output_dir)
+
+def stage_noise(args):
+    import json
+    import airdata_engine
+    import generate_calibrations
+    import uncertainty
+    from plotting import PlotQueue
+    if args.tables:
+        engine = airdata_engine.Engine.from_file(args.tables)
+    else:
+        (views, model) = fit(args)
+        engine = airdata_engine.Engine.from_structs(
+            generate_calibrations.generate_tables(
+                generate_calibrations.make_raw2data(model), dp_step=args.step),
+            args.encoding)
+    points = uncertainty.read_points(args.files)
+    cases = uncertainty.noise_cases(points, args.model, args.counts_rms, args.q)
+    results = []
+    report = []
+    for case in cases:
+        (name, q, sigma) = case
+        with instrument.stage('noise', rows=len(q) * args.samples):
+            stats = uncertainty.propagate(
+                engine, points['pressures'], sigma, args.samples, args.level, args.seed)
+        rows = uncertainty.summary(points, stats)
+        print('%s: %d points x %d samples, %g%% intervals' % (
+            name, len(q), args.samples, 100 * args.level))
+        sys.stdout.write(uncertainty.summary_table(rows))
+        results.append((name, stats))
+        report.append(uncertainty.to_dict(points, case, stats, rows))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f)
+        print('wrote ' + args.output)
+    if not args.no_plots:
+        with PlotQueue(args.jobs) as queue:
+            uncertainty.plot_cases(points, results, queue, args.output_dir)
+        print('wrote ' + args.output_dir)
+
+def stage_build(args):
+    import pipeline
+    (g, output, written, plots) = pipeline.build(
+        args.output,
+        args.files,
+        args.step,
+        args.format,
+        args.encoding,
+        plots=not args.no_plots,
+        verify_plots=args.verify_plots,
+        preview=args.preview,
+        workers=args.jobs)
+    for name in g:
+        print('%-8s %-8s %s' % (
+            name, 'rebuilt' if g[name].computed else 'reused', g[name].key()[:12]))
+    print('%s %s' % ('wrote' if written else 'unchanged', output))
+    if plots:
+        print('plots    %d rendered, %d up to date' % (plots.rendered, plots.skipped))
+    summary = g['verify'].value()['summary']
+    for k in summary:
+        print('%-16s %s' % (k, summary[k]))
+
+########################################################################
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Probe calibration pipeline')
+    parser.add_argument(
+        '--file', dest='files', action='append', default=None,
+        help='sweep file in raw_data to use; may be repeated (default: all known runs)')
+    parser.add_argument(
+        '--jobs', type=int, default=None,
+        help='worker processes for parsing sweep files and rendering plots (default: one per core)')
+    parser.add_argument(
+        '--report', default=None,
+        help='write a JSON report of the time and memory used by each step')
+    parser.add_argument(
+        '--profile', action='append', default=[], metavar='STEP',
+        help='run a step (parse, load, fit, tables, render, plots, verify) '
+             'under cProfile; may be repeated')
+    parser.add_argument(
+        '--profile-dir', default='profiles',
+        help='where --profile writes its .prof and .txt files (default: profiles)')
+    stages = parser.add_subparsers(dest='stage', required=True)
+
+    stages.add_parser('load', help='load the tunnel sweeps').set_defaults(run=stage_load)
+    p = stages.add_parser('fit', help='fit the probe models')
+    p.add_argument(
+        '--orders', type=int, nargs='+', default=None,
+        help='instead, fit symmetric polynomial families at these orders')
+    p.set_defaults(run=stage_fit)
+
+    p = stages.add_parser('tables', help='regenerate the calibration header')
+    p.add_argument('--output', default=None, help='header to write')
+    p.add_argument('--step', type=float, default=0.1, help='table grid step in dp/dp0')
+    p.add_argument(
+        '--format', choices=['header', 'blob'], default='header',
+        help='C header to compile in, or binary blob (see calibration_blob.h)')
+    p.add_argument(
+        '--encoding', choices=['float32', 'int16', 'float16'], default='float32',
+        help='how table values are stored; int16 and float16 use a scale and offset per table')
+    p.set_defaults(run=stage_tables)
+
+    p = stages.add_parser('plan', help='choose table grids for an error budget')
+    p.add_argument(
+        '--max-error', nargs='+', metavar='SURFACE=ERROR',
+        help='maximum interpolation error per surface, e.g. alpha=0.05')
+    p.add_argument(
+        '--coverage', type=float, default=100.0,
+        help='percentile of the observed ratios the tables must cover')
+    p.add_argument('--output', default=None, help='also write a header with the plan')
+    p.set_defaults(run=stage_plan)
+
+    preview_help = 'quick low resolution plots of binned data, under preview/'
+    p = stages.add_parser('plots', help='render calibration plots')
+    p.add_argument('--preview', action='store_true', help=preview_help)
+    p.set_defaults(run=stage_plots)
+
+    p = stages.add_parser('verify', help='check the firmware tables against the data')
+    p.add_argument('--plots', action='store_true', help='also render verification plots')
+    p.add_argument('--preview', action='store_true', help=preview_help)
+    p.set_defaults(run=stage_verify)
+
+    p = stages.add_parser(
+        'resample', help='bootstrap and cross-validate the probe models')
+    p.add_argument(
+        '--replicates', type=int, default=2000,
+        help='bootstrap replicates; 0 to only cross-validate (default: 2000)')
+    p.add_argument(
+        '--by', choices=['rows', 'runs'], default='rows',
+        help='resample single rows or whole tunnel runs')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--level', type=float, default=0.95, help='confidence level of the bands')
+    p.add_argument(
+        '--orders', type=int, nargs='+', default=None,
+        help='instead, resample symmetric polynomial families at these orders')
+    p.add_argument('--step', type=float, default=0.1, help='grid step of the bands in dp/dp0')
+    p.add_argument('--x-extent', type=float, default=3.0, help='dpa/dp0 extent of the bands')
+    p.add_argument('--y-extent', type=float, default=2.5, help='dpb/dp0 extent of the bands')
+    p.add_argument('--output', default=None, help='write the full report as JSON')
+    p.add_argument('--output-dir', default='resampling_plots', help='where to write band heatmaps')
+    p.add_argument('--no-plots', action='store_true')
+    p.set_defaults(run=stage_resample)
+
+    p = stages.add_parser(
+        'accuracy', help='map the table error against the fitted models')
+    p.add_argument(
+        '--tables', default=None,
+        help='header or blob to check (default: tables generated from the fit)')
+    p.add_argument('--step', type=float, default=0.1, help='table grid step of generated tables')
+    p.add_argument(
+        '--subdivisions', type=int, default=32,
+        help='points per table cell along each axis (default: 32)')
+    p.add_argument(
+        '--outside', type=int, default=2,
+        help='cells beyond the table edge to include (default: 2)')
+    p.add_argument('--output-dir', default='accuracy_plots', help='where to write the heatmaps and summary')
+    p.add_argument('--no-plots', action='store_true', help='only print the summary')
+    p.set_defaults(run=stage_accuracy)
+
+    p = stages.add_parser(
+        'noise', help='propagate sensor noise through the firmware math')
+    p.add_argument(
+        '--model', choices=['measured', 'trustability'], default='measured',
+        help='per-point sigmas from the sweeps, or a TruStability noise model')
+    p.add_argument(
+        '--counts-rms', type=float, default=1.0,
+        help='TruStability noise in counts RMS, before quantization (default: 1)')
+    p.add_argument(
+        '--q', type=float, nargs='+', default=None,
+        help='dynamic pressures to run the TruStability model at, in .cal units '
+             '(default: the tunnel q of each point)')
+    p.add_argument(
+        '--samples', type=int, default=4096, help='perturbed samples per point (default: 4096)')
+    p.add_argument('--level', type=float, default=0.95, help='coverage of the reported intervals')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument(
+        '--tables', default=None,
+        help='header or blob to use (default: tables generated from the fit)')
+    p.add_argument('--step', type=float, default=0.1, help='table grid step of generated tables')
+    p.add_argument(
+        '--encoding', choices=['float32', 'int16', 'float16'], default='float32',
+        help='encoding of generated tables')
+    p.add_argument('--output', default=None, help='write the per-point results as JSON')
+    p.add_argument('--output-dir', default='noise_plots', help='where to write the plots')
+    p.add_argument('--no-plots', action='store_true', help='only print the summary')
+    p.set_defaults(run=stage_noise)
+
+    p = stages.add_parser(
+        'build', help='bring everything up to date, redoing only what changed')
+    p.add_argument('--output', default=None, help='header (or blob) to write')
+    p.add_argument('--step', type=float, default=0.1, help='table grid step in dp/dp0')
+    p.add_argument('--format', choices=['header', 'blob'], default='header')
+    p.add_argument('--encoding', choices=['float32', 'int16', 'float16'], default='float32')
+    p.add_argument('--no-plots', action='store_true', help='skip the calibration plots')
+    p.add_argument('--verify-plots', action='store_true', help='also render verification plots')
+    p.add_argument('--preview', action='store_true', help=preview_help)
+    p.set_defaults(run=stage_build)
+
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    instrument.begin_run()
+    instrument.profile(args.profile, args.profile_dir)
+    with instrument.stage('calibrate ' + args.stage):
+        args.run(args)
+    if args.report:
+        instrument.write_report(args.report)
+        instrument.print_summary()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
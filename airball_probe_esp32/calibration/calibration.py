@@ -1,8 +1,6 @@
 import sys
 from numpy.polynomial.polynomial import Polynomial
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.lines as lines
 
 NUMSENSORS = 8
 
@@ -29,6 +27,8 @@ class Calibration:
                 self.__sensors__[i]['reading'],
                 self.__sensors__[i]['pressure'],                
                 1).convert().coef
+        self.offsets = np.array([s['fit'][0] for s in self.__sensors__])
+        self.gains = np.array([s['fit'][1] for s in self.__sensors__])
 
     def apply(self, readings):
         return [
@@ -36,6 +36,10 @@ class Calibration:
             for i in range(0, NUMSENSORS)
         ]
 
+    # Apply the calibration to an N x NUMSENSORS array of readings in one go
+    def apply_array(self, readings):
+        return self.offsets + self.gains * np.asarray(readings, dtype=np.float64)
+
     def sensor(self, i):
         return self.__sensors__[i]
 
@@ -65,6 +69,7 @@ def theoretical_output(reading, diff_range):
     return diff_range * (2.5 * (reading / pow(2, 14) - 0.1) - 1)    
     
 def graph_calibration(cal, diff_range, filename):
+    import matplotlib.pyplot as plt
     all_fit_x = [
         [0 for i in range(0, NUMSENSORS)],
         [pow(2, 14) for i in range(0, NUMSENSORS)],
@@ -0,0 +1,70 @@
+#include <string.h>
+
+#include "calibration_blob.h"
+
+#define HEADER_BYTES 8
+#define ENTRY_BYTES 64
+#define NAME_BYTES 24
+
+static uint16_t u16(const uint8_t* p) {
+  return (uint16_t)(p[0] | (p[1] << 8));
+}
+
+static uint32_t u32(const uint8_t* p) {
+  return (uint32_t)p[0] | ((uint32_t)p[1] << 8) | ((uint32_t)p[2] << 16) | ((uint32_t)p[3] << 24);
+}
+
+static float f32(const uint8_t* p) {
+  uint32_t bits = u32(p);
+  float f;
+  memcpy(&f, &bits, sizeof(f));
+  return f;
+}
+
+static int value_bytes(uint8_t encoding) {
+  return encoding == CALIBRATION_FLOAT32 ? 4 : 2;
+}
+
+int calibration_blob_surface(const uint8_t* blob,
+			     uint32_t length,
+			     const char* name,
+			     calibration_surface* out) {
+  if (length < HEADER_BYTES || memcmp(blob, "ABCT", 4) != 0) { return -1; }
+  if (u16(blob + 4) != CALIBRATION_BLOB_VERSION) { return -1; }
+  uint16_t count = u16(blob + 6);
+  if (length < HEADER_BYTES + (uint32_t)count * ENTRY_BYTES) { return -1; }
+
+  for (uint16_t i = 0; i < count; i++) {
+    const uint8_t* e = blob + HEADER_BYTES + i * ENTRY_BYTES;
+    if (strncmp((const char*)e, name, NAME_BYTES) != 0) { continue; }
+
+    uint8_t encoding = e[24];
+    uint16_t x_size = u16(e + 28);
+    uint16_t y_size = u16(e + 30);
+    uint32_t offset = u32(e + 56);
+    uint32_t bytes = u32(e + 60);
+    if (encoding > CALIBRATION_FLOAT16 ||
+	bytes != (uint32_t)x_size * y_size * value_bytes(encoding) ||
+	offset % 4 != 0 || offset > length || bytes > length - offset) {
+      return -1;
+    }
+
+    memset(out, 0, sizeof(*out));
+    out->x.size = x_size;
+    out->x.step = f32(e + 32);
+    out->x.zero_offset = f32(e + 36);
+    out->y.size = y_size;
+    out->y.step = f32(e + 40);
+    out->y.zero_offset = f32(e + 44);
+    out->encoding = encoding;
+    out->scale = f32(e + 48);
+    out->offset = f32(e + 52);
+    if (encoding == CALIBRATION_FLOAT32) {
+      out->data = (float*)(blob + offset);
+    } else {
+      out->packed = blob + offset;
+    }
+    return 0;
+  }
+  return -1;
+}
@@ -0,0 +1,42 @@
+#ifndef CALIBRATION_BLOB_H
+#define CALIBRATION_BLOB_H
+
+#include <stdint.h>
+
+#include "calibration_surface.h"
+
+#if defined(__cplusplus)
+extern "C"
+{
+#endif
+
+// Calibration tables in a binary blob, as written by
+// calibration_surface.write_blob() (e.g. to be placed in a flash
+// partition rather than compiled in). All fields are little endian:
+//
+//   header  "ABCT", uint16_t version, uint16_t count
+//   count entries of 64 bytes:
+//     char name[24]  (NUL padded)
+//     uint8_t encoding, 3 bytes padding
+//     uint16_t x.size, uint16_t y.size
+//     float x.step, x.zero_offset, y.step, y.zero_offset, scale, offset
+//     uint32_t data offset (from the start of the blob), data bytes
+//   table data, each table starting on a 4 byte boundary
+//
+// calibration_blob_surface() fills in *out with the named surface, its
+// data pointing into the blob, so the blob must outlive the surface.
+// Returns 0 on success and -1 if the blob is malformed or the surface
+// is not in it.
+
+#define CALIBRATION_BLOB_VERSION 1
+
+int calibration_blob_surface(const uint8_t* blob,
+			     uint32_t length,
+			     const char* name,
+			     calibration_surface* out);
+
+#if defined(__cplusplus)
+}
+#endif
+
+#endif // CALIBRATION_BLOB_H
@@ -1,18 +1,48 @@
 #include <stdint.h>
 #include "calibration_surface.h"
+#include <math.h>
 #include <stdio.h>
 
+// Index of the grid cell containing v. Interpolation reads the points
+// at i and i + 1, so a value on the last grid point uses the last cell,
+// and values beyond the last grid point are an error.
 uint16_t idx(const axis_size *sz, const float v, int* err) {
-  int32_t i = int((v + sz->zero_offset) / sz->step);
-  if (i < 0 || i >= sz->size) { 
+  float f = (v + sz->zero_offset) / sz->step;
+  int32_t i = int(f);
+  if (i < 0 || f > sz->size - 1) {
     *err = -1;
     i = 0;
   }
+  if (i > sz->size - 2) {
+    i = sz->size - 2;
+  }
   return (uint16_t)i;
 }
 
+float half_to_float(const uint16_t h) {
+  int exponent = (h >> 10) & 0x1f;
+  float mantissa = (float)(h & 0x3ff);
+  float f;
+  if (exponent == 0) {
+    f = ldexpf(mantissa, -24);
+  } else if (exponent == 0x1f) {
+    f = (h & 0x3ff) ? NAN : INFINITY;
+  } else {
+    f = ldexpf(mantissa + 1024.0f, exponent - 25);
+  }
+  return (h & 0x8000) ? -f : f;
+}
+
 float get(const calibration_surface* c, const uint16_t idx_x, const uint16_t idx_y) {
-  return c->data[c->y.size * idx_x + idx_y];
+  uint32_t i = (uint32_t)c->y.size * idx_x + idx_y;
+  switch (c->encoding) {
+  case CALIBRATION_INT16:
+    return c->offset + c->scale * (float)((const int16_t*)c->packed)[i];
+  case CALIBRATION_FLOAT16:
+    return c->offset + c->scale * half_to_float(((const uint16_t*)c->packed)[i]);
+  default:
+    return c->data[i];
+  }
 }
 
 float lineint(float x1, float y1, float x2, float y2, float x) {
@@ -14,11 +14,25 @@ typedef struct axis_size_struct {
   float zero_offset;
 } axis_size;
 
+// Encodings of the table values. CALIBRATION_FLOAT32 tables keep their
+// values in data. Quantized tables keep them in packed instead, and a
+// value q decodes to (offset + scale * q), q being a signed 16 bit
+// integer (CALIBRATION_INT16) or an IEEE 754 half precision float
+// (CALIBRATION_FLOAT16).
+#define CALIBRATION_FLOAT32 0
+#define CALIBRATION_INT16 1
+#define CALIBRATION_FLOAT16 2
+
 typedef struct calibration_surface_struct {
   axis_size x;
   axis_size y;
   
   float* data;
+
+  uint8_t encoding;
+  float scale;
+  float offset;
+  const void* packed;
   
 } calibration_surface;
 
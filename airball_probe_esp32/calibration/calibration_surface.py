@@ -0,0 +1,328 @@
+import re
+import numpy as np
+
+########################################################################
+
+# Vectorized counterpart of calibration_surface.cpp, for evaluating
+# calibration tables over many points at once from Python.
+#
+# A surface is given as a dict of the same shape as the calibration
+# structs passed to the header template:
+#
+#   {'x': {'size': ..., 'step': ..., 'zero_offset': ...},
+#    'y': {'size': ..., 'step': ..., 'zero_offset': ...},
+#    'data': [... x.size * y.size values, x major ...]}
+#
+# Quantized surfaces (see quantize()) also have 'encoding', 'scale',
+# 'offset' and 'packed', the encoded values; 'data' then holds the
+# values the firmware decodes from them.
+
+# Bytes used by one calibration_surface struct on the ESP32: two
+# axis_size structs (uint16_t padded to 4, two floats), the data
+# pointer, the encoding (padded to 4), scale, offset and packed pointer.
+SURFACE_STRUCT_BYTES = 2 * 12 + 4 + 4 + 4 + 4 + 4
+
+# Table encodings, as the CALIBRATION_* constants in calibration_surface.h
+ENCODINGS = {
+    'float32': 0,
+    'int16': 1,
+    'float16': 2,
+}
+
+VALUE_BYTES = {
+    'float32': 4,
+    'int16': 2,
+    'float16': 2,
+}
+
+def idx(axis, v):
+    f = (np.asarray(v) + axis['zero_offset']) / axis['step']
+    err = ~(f > -1) | ~(f <= axis['size'] - 1)
+    f = np.where(err, 0, f)
+    i = np.minimum(np.trunc(f).astype(np.int64), axis['size'] - 2)
+    return (i, err)
+
+def lineint(x1, y1, x2, y2, x):
+    return y1 + (x - x1) / (x2 - x1) * (y2 - y1)
+
+# Returns (values, err), err being True where (x, y) is off the table.
+# Values are 0 where err is set, as in the firmware.
+def interpolate(surface, x, y):
+    sx = surface['x']
+    sy = surface['y']
+    data = decoded_values(surface).reshape(sx['size'], sy['size'])
+    (ix, ex) = idx(sx, x)
+    (iy, ey) = idx(sy, y)
+    err = ex | ey
+
+    x1 = sx['step'] * ix - sx['zero_offset']
+    x2 = sx['step'] * (ix + 1) - sx['zero_offset']
+    y1 = sy['step'] * iy - sy['zero_offset']
+    y2 = sy['step'] * (iy + 1) - sy['zero_offset']
+
+    at_y0 = lineint(x1, data[ix, iy], x2, data[ix + 1, iy], x)
+    at_y1 = lineint(x1, data[ix, iy + 1], x2, data[ix + 1, iy + 1], x)
+    at_md = lineint(y1, at_y0, y2, at_y1, y)
+
+    return (np.where(err, 0.0, at_md), err)
+
+def table_bytes(surface, value_bytes=None):
+    if value_bytes is None:
+        value_bytes = VALUE_BYTES[surface.get('encoding', 'float32')]
+    return (surface['x']['size'] * surface['y']['size'] * value_bytes +
+            SURFACE_STRUCT_BYTES)
+
+########################################################################
+
+# Quantized tables. Values are stored as offset + scale * q, with offset
+# the middle of the value range. For int16 the range is spread over
+# -32767..32767; for float16 it is mapped onto -1..1, so the precision
+# is finest near the middle of the range.
+
+def decode(encoding, scale, offset, packed):
+    if encoding == 'float32':
+        return np.asarray(packed, dtype=np.float32)
+    q = np.asarray(packed).astype(np.float32)
+    return np.float32(offset) + np.float32(scale) * q
+
+def quantize(surface, encoding):
+    values = np.asarray(surface['data'], dtype=np.float64)
+    r = dict(surface, encoding=encoding)
+    if encoding == 'float32':
+        packed = values.astype(np.float32)
+        r.update({
+            'scale': 1.0,
+            'offset': 0.0,
+            'packed': packed,
+            'data': packed.astype(np.float64),
+        })
+        return r
+    finite = values[np.isfinite(values)]
+    (lo, hi) = (finite.min(), finite.max()) if len(finite) else (0.0, 0.0)
+    offset = float(np.float32((lo + hi) / 2))
+    half_range = max(hi - offset, offset - lo)
+    if encoding == 'int16':
+        scale = float(np.float32(half_range / 32767)) or 1.0
+        q = np.clip(np.rint((values - offset) / scale), -32767, 32767)
+        packed = np.nan_to_num(q).astype(np.int16)
+    elif encoding == 'float16':
+        scale = float(np.float32(half_range)) or 1.0
+        packed = ((values - offset) / scale).astype(np.float16)
+    else:
+        raise ValueError('unknown table encoding ' + encoding)
+    r.update({
+        'scale': scale,
+        'offset': offset,
+        'packed': packed,
+        'data': decode(encoding, scale, offset, packed).astype(np.float64),
+    })
+    return r
+
+def quantization_error(surface, quantized):
+    values = np.asarray(surface['data'], dtype=np.float64)
+    err = quantized['data'] - values
+    err = err[np.isfinite(err)]
+    value_range = float(np.nanmax(values) - np.nanmin(values)) if len(values) else 0.0
+    return {
+        'encoding': quantized['encoding'],
+        'max_abs_error': float(np.max(np.abs(err))) if len(err) else 0.0,
+        'rms_error': float(np.sqrt(np.mean(np.square(err)))) if len(err) else 0.0,
+        'range': value_range,
+        'bytes': table_bytes(quantized),
+        'float32_bytes': table_bytes(surface, VALUE_BYTES['float32']),
+    }
+
+def decoded_values(surface):
+    if 'packed' not in surface:
+        return np.asarray(surface['data'], dtype=np.float64)
+    return decode(
+        surface['encoding'], surface['scale'], surface['offset'],
+        surface['packed']).astype(np.float64)
+
+########################################################################
+
+# Read the surfaces from a calibration header as written by
+# generate_calibrations.write_file() (e.g. probe_calibration.h). Returns
+# a dict from surface name, without the file prefix, to surface.
+
+_surface_re = re.compile(
+    r'const\s+calibration_surface\s+(\w+)\s*=\s*\{\s*'
+    r'\.x\s*=\s*\{(?P<x>[^}]*)\}\s*,\s*'
+    r'\.y\s*=\s*\{(?P<y>[^}]*)\}\s*,\s*'
+    r'(?:\.data\s*=\s*\(float\[\]\)\s*\{(?P<data>[^}]*)\}'
+    r'|\.encoding\s*=\s*CALIBRATION_(?P<encoding>\w+)\s*,\s*'
+    r'\.scale\s*=\s*(?P<scale>[-+.\w]+)\s*,\s*'
+    r'\.offset\s*=\s*(?P<offset>[-+.\w]+)\s*,\s*'
+    r'\.packed\s*=\s*\(const\s+u?int16_t\[\]\)\s*\{(?P<packed>[^}]*)\})',
+    re.S)
+
+def _axis(text):
+    fields = dict(re.findall(r'\.(\w+)\s*=\s*([-+.\w]+)', text))
+    return {
+        'size': int(fields['size']),
+        'step': float(fields['step'].rstrip('f')),
+        'zero_offset': float(fields['zero_offset'].rstrip('f')),
+    }
+
+def _numbers(text, parse):
+    return [parse(v.strip()) for v in text.split(',') if v.strip()]
+
+def read_header(path, prefix='probe_'):
+    with open(path, 'r') as f:
+        text = f.read()
+    surfaces = {}
+    for m in _surface_re.finditer(text):
+        name = m.group(1)
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+        s = {
+            'x': _axis(m.group('x')),
+            'y': _axis(m.group('y')),
+        }
+        if m.group('data') is not None:
+            s['data'] = np.array(_numbers(m.group('data'), lambda v: float(v.rstrip('f'))))
+        else:
+            encoding = m.group('encoding').lower()
+            packed = np.array(_numbers(m.group('packed'), lambda v: int(v, 0)))
+            packed = packed.astype(np.int16) if encoding == 'int16' else \
+                packed.astype(np.uint16).view(np.float16)
+            s.update({
+                'encoding': encoding,
+                'scale': float(m.group('scale').rstrip('f')),
+                'offset': float(m.group('offset').rstrip('f')),
+                'packed': packed,
+            })
+            s['data'] = decoded_values(s)
+        surfaces[name] = s
+    return surfaces
+
+########################################################################
+
+# Binary blob of surfaces, laid out as described in calibration_blob.h
+
+BLOB_MAGIC = b'ABCT'
+BLOB_VERSION = 1
+
+blob_header_dtype = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('count', '<u2'),
+])
+
+blob_entry_dtype = np.dtype([
+    ('name', 'S24'),
+    ('encoding', 'u1'),
+    ('pad', 'V3'),
+    ('x_size', '<u2'),
+    ('y_size', '<u2'),
+    ('x_step', '<f4'),
+    ('x_zero_offset', '<f4'),
+    ('y_step', '<f4'),
+    ('y_zero_offset', '<f4'),
+    ('scale', '<f4'),
+    ('offset', '<f4'),
+    ('data_offset', '<u4'),
+    ('data_bytes', '<u4'),
+])
+
+_blob_value_dtype = {
+    'float32': np.dtype('<f4'),
+    'int16': np.dtype('<i2'),
+    'float16': np.dtype('<f2'),
+}
+
+def blob_bytes(surfaces):
+    names = list(surfaces)
+    header = np.zeros(1, blob_header_dtype)
+    header[0] = (BLOB_MAGIC, BLOB_VERSION, len(names))
+    entries = np.zeros(len(names), blob_entry_dtype)
+    chunks = []
+    offset = blob_header_dtype.itemsize + entries.nbytes
+    for (i, name) in enumerate(names):
+        s = surfaces[name]
+        encoding = s.get('encoding', 'float32')
+        packed = s['packed'] if 'packed' in s else s['data']
+        data = np.asarray(packed).astype(_blob_value_dtype[encoding]).tobytes()
+        entries[i] = (
+            name.encode('ascii'), ENCODINGS[encoding], b'\0' * 3,
+            s['x']['size'], s['y']['size'],
+            s['x']['step'], s['x']['zero_offset'],
+            s['y']['step'], s['y']['zero_offset'],
+            s.get('scale', 1.0), s.get('offset', 0.0),
+            offset, len(data))
+        pad = -len(data) % 4
+        chunks.append(data + b'\0' * pad)
+        offset += len(data) + pad
+    return header.tobytes() + entries.tobytes() + b''.join(chunks)
+
+def write_blob(surfaces, path):
+    with open(path, 'wb') as f:
+        f.write(blob_bytes(surfaces))
+
+def parse_blob(blob):
+    header = np.frombuffer(blob, blob_header_dtype, count=1)[0]
+    if header['magic'] != BLOB_MAGIC or header['version'] != BLOB_VERSION:
+        raise ValueError('not a version %d calibration blob' % BLOB_VERSION)
+    entries = np.frombuffer(
+        blob, blob_entry_dtype, count=int(header['count']),
+        offset=blob_header_dtype.itemsize)
+    encodings = {v: k for (k, v) in ENCODINGS.items()}
+    surfaces = {}
+    for e in entries:
+        encoding = encodings[int(e['encoding'])]
+        dtype = _blob_value_dtype[encoding]
+        packed = np.frombuffer(
+            blob, dtype, count=int(e['data_bytes']) // dtype.itemsize,
+            offset=int(e['data_offset']))
+        s = {
+            'x': {'size': int(e['x_size']), 'step': float(e['x_step']),
+                  'zero_offset': float(e['x_zero_offset'])},
+            'y': {'size': int(e['y_size']), 'step': float(e['y_step']),
+                  'zero_offset': float(e['y_zero_offset'])},
+            'encoding': encoding,
+            'scale': float(e['scale']),
+            'offset': float(e['offset']),
+            'packed': packed,
+        }
+        s['data'] = decoded_values(s)
+        surfaces[e['name'].decode('ascii')] = s
+    return surfaces
+
+def read_blob(path):
+    with open(path, 'rb') as f:
+        return parse_blob(f.read())
+
+# Surfaces from either a generated header or a blob
+def read_tables(path, prefix='probe_'):
+    if path.endswith('.bin'):
+        return read_blob(path)
+    return read_header(path, prefix)
+
+########################################################################
+
+# Vectorized counterpart of pressures_to_airdata.cpp. Ratios are folded
+# into the positive quadrant for lookup and the signs of alpha and beta
+# restored afterwards. err is True where any of the lookups failed.
+
+def pressures_to_airdata(surfaces, dp0, dpa, dpb, raw_baro):
+    dp0 = np.asarray(dp0, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rpa = np.asarray(dpa) / dp0
+        rpb = np.asarray(dpb) / dp0
+    sign_a = np.where(rpa < 0, -1.0, 1.0)
+    sign_b = np.where(rpb < 0, -1.0, 1.0)
+    rpa = np.abs(rpa)
+    rpb = np.abs(rpb)
+
+    (alpha, e0) = interpolate(surfaces['alpha'], rpa, rpb)
+    (beta, e1) = interpolate(surfaces['beta'], rpa, rpb)
+    (q_over_dp0, e2) = interpolate(surfaces['q_over_dp0'], rpa, rpb)
+    (minus_s_over_dp0, e3) = interpolate(surfaces['minus_s_over_dp0'], rpa, rpb)
+
+    return {
+        'alpha': alpha * sign_a,
+        'beta': beta * sign_b,
+        'q': dp0 * q_over_dp0,
+        'p': raw_baro + minus_s_over_dp0 * dp0,
+        'err': e0 | e1 | e2 | e3,
+    }
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+
+import calibration_surface
+
+########################################################################
+
+# Quantized tables and blobs, on the tables of probe_calibration.h.
+
+header = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'probe_calibration.h')
+
+def surfaces():
+    return calibration_surface.read_header(header)
+
+# Largest error quantize() may add: half a step of the int16 lattice, or
+# half the float16 spacing just below 1 times the scale; plus float32
+# rounding of the decoded value
+def bound(q, values):
+    step = q['scale'] if q['encoding'] == 'int16' else q['scale'] * 2.0 ** -11
+    return step / 2 + np.abs(values) * np.finfo(np.float32).eps
+
+def test_quantization_bound():
+    for (name, s) in surfaces().items():
+        values = np.asarray(s['data'], dtype=np.float64)
+        for encoding in ['int16', 'float16']:
+            q = calibration_surface.quantize(s, encoding)
+            err = np.abs(q['data'] - values)
+            assert np.all(err <= bound(q, values)), (name, encoding, err.max())
+            e = calibration_surface.quantization_error(s, q)
+            assert e['max_abs_error'] == err.max()
+            assert e['bytes'] < e['float32_bytes']
+        q = calibration_surface.quantize(s, 'float32')
+        np.testing.assert_equal(q['data'], values.astype(np.float32))
+
+def test_blob_round_trip():
+    for encoding in ['float32', 'int16', 'float16']:
+        tables = {
+            name: calibration_surface.quantize(s, encoding)
+            for (name, s) in surfaces().items()
+        }
+        parsed = calibration_surface.parse_blob(calibration_surface.blob_bytes(tables))
+        assert list(parsed) == list(tables)
+        for (name, s) in tables.items():
+            p = parsed[name]
+            assert p['encoding'] == encoding
+            for axis in ['x', 'y']:
+                assert p[axis]['size'] == s[axis]['size']
+                assert np.float32(p[axis]['step']) == np.float32(s[axis]['step'])
+                assert np.float32(p[axis]['zero_offset']) == np.float32(s[axis]['zero_offset'])
+            np.testing.assert_equal(p['packed'], s['packed'])
+            np.testing.assert_equal(p['data'], s['data'])
+
+def test_blob_of_header_tables():
+    tables = surfaces()
+    parsed = calibration_surface.parse_blob(calibration_surface.blob_bytes(tables))
+    for (name, s) in tables.items():
+        np.testing.assert_equal(parsed[name]['data'], np.float32(s['data']))
+
+def test_bad_blob():
+    blob = bytearray(calibration_surface.blob_bytes(surfaces()))
+    blob[0:4] = b'XXXX'
+    try:
+        calibration_surface.parse_blob(bytes(blob))
+    except ValueError:
+        return
+    assert False, 'parse_blob accepted a bad magic number'
@@ -2,6 +2,7 @@
 #include <stdio.h>
 
 #include "calibration_surface.h"
+#include "pressures_to_airdata.h"
 
 //         X | Y:  -5.0f [0]    -3.0f [1]    -1.0f [2]
 // -----------------------------------------------------------
@@ -31,6 +32,91 @@ const calibration_surface s0 = {
   },
 };
 
+// The same table, quantized as offset + scale * q
+
+const calibration_surface s0_int16 = {
+  .x = {
+    .size = 5,
+    .step = 1.0f,
+    .zero_offset = 2.0f,
+  },
+  .y = {
+    .size = 3,
+    .step = 2.0f,
+    .zero_offset = 5.0f,
+  },
+  .encoding = CALIBRATION_INT16,
+  .scale = 0.5f,
+  .offset = 8.0f,
+  .packed = (const int16_t[]){
+    -14, -12, -10,
+     -8,  -6,  -4,
+     -2,   0,   2,
+      4,   6,   8,
+     10,  12,  14,
+  },
+};
+
+const calibration_surface s0_float16 = {
+  .x = {
+    .size = 5,
+    .step = 1.0f,
+    .zero_offset = 2.0f,
+  },
+  .y = {
+    .size = 3,
+    .step = 2.0f,
+    .zero_offset = 5.0f,
+  },
+  .encoding = CALIBRATION_FLOAT16,
+  .scale = 1.0f,
+  .offset = 0.0f,
+  .packed = (const uint16_t[]){
+    0x3c00, 0x4000, 0x4200,
+    0x4400, 0x4500, 0x4600,
+    0x4700, 0x4800, 0x4880,
+    0x4900, 0x4980, 0x4a00,
+    0x4a80, 0x4b00, 0x4b80,
+  },
+};
+
+// Two tables of x + y, over [0, 2] x [0, 2] and over [0, 1] x [0, 1]
+
+const calibration_surface wide = {
+  .x = {
+    .size = 3,
+    .step = 1.0f,
+    .zero_offset = 0.0f,
+  },
+  .y = {
+    .size = 3,
+    .step = 1.0f,
+    .zero_offset = 0.0f,
+  },
+  .data = (float[]){
+    0.0f, 1.0f, 2.0f,
+    1.0f, 2.0f, 3.0f,
+    2.0f, 3.0f, 4.0f,
+  },
+};
+
+const calibration_surface narrow = {
+  .x = {
+    .size = 2,
+    .step = 1.0f,
+    .zero_offset = 0.0f,
+  },
+  .y = {
+    .size = 2,
+    .step = 1.0f,
+    .zero_offset = 0.0f,
+  },
+  .data = (float[]){
+    0.0f, 1.0f,
+    1.0f, 2.0f,
+  },
+};
+
 #define TOLERANCE 0.0005f
 
 void check_near(float x, float y) {
@@ -41,18 +127,52 @@ void check_near(float x, float y) {
   }
 }
 
-void check(const float x, const float y, const float z) {
+void check(const calibration_surface* s, const float x, const float y, const float z) {
   int err = 0;
-  float zo = interpolate(&s0, x, y, &err);
+  float zo = interpolate(s, x, y, &err);
   if (err != 0) { printf("ERROR: %10.6f %10.6f caused error\n", x, y); }
   check_near(zo, z);
 }
 
+void check_error(const calibration_surface* s, const float x, const float y) {
+  int err = 0;
+  interpolate(s, x, y, &err);
+  if (err == 0) { printf("ERROR: %10.6f %10.6f did not cause error\n", x, y); }
+}
+
+// pressures_to_airdata with dp0 = 1, so the ratios are dpa and dpb
+void check_airdata(const calibration_surface* a, const calibration_surface* b,
+                   const calibration_surface* q, const calibration_surface* s,
+                   const float dpa, const float dpb, const int expect_err) {
+  int err = 0;
+  pressures_to_airdata(a, b, q, s, 1.0f, dpa, dpb, 0.0f, &err);
+  if ((err != 0) != (expect_err != 0)) {
+    printf("ERROR: airdata at %10.6f %10.6f gave err %d\n", dpa, dpb, err);
+  }
+}
+
 int main(int argc, char**argv) {
-  check(-2.0f, -5.0f,  1.00f);
-  check(-1.0f, -3.0f,  5.00f);
-  check( 2.0f, -3.0f, 14.00f);
-  check(-1.5f, -4.0f,  3.00f);
-  check( 2.0f, -1.0f, 15.00f);
-  check( 1.5f, -2.0f, 13.00f);  
+  const calibration_surface* surfaces[] = { &s0, &s0_int16, &s0_float16 };
+  for (int i = 0; i < 3; i++) {
+    const calibration_surface* s = surfaces[i];
+    check(s, -2.0f, -5.0f,  1.00f);
+    check(s, -1.0f, -3.0f,  5.00f);
+    check(s,  2.0f, -3.0f, 14.00f);
+    check(s, -1.5f, -4.0f,  3.00f);
+    check(s,  2.0f, -1.0f, 15.00f);
+    check(s,  1.5f, -2.0f, 13.00f);
+    // On the last grid line of an axis, the last cell is used
+    check(s,  2.0f, -4.0f, 13.50f);
+    check(s,  0.5f, -1.0f, 10.50f);
+    // Just past the last grid line is off the table
+    check_error(s,  2.001f, -3.0f);
+    check_error(s,  0.0f,   -0.999f);
+  }
+
+  // Every lookup counts, not only the last one
+  check_airdata(&wide,   &wide,   &wide, &wide,   1.5f, 0.5f, 0);
+  check_airdata(&narrow, &wide,   &wide, &wide,   1.5f, 0.5f, 1);
+  check_airdata(&wide,   &narrow, &wide, &wide,   0.5f, 1.5f, 1);
+  check_airdata(&wide,   &wide,   &wide, &narrow, 1.5f, 0.5f, 1);
+  check_airdata(&narrow, &narrow, &wide, &wide,   1.0f, 1.0f, 0);
 }
@@ -0,0 +1,168 @@
+import numpy as np
+
+########################################################################
+
+# Linear least squares fitting of the probe models.
+#
+# All our probe models are polynomials in (x, y) = (dpa/dp0, dpb/dp0)
+# that are linear in their coefficients, so they are described by a
+# list of terms, each term (i, j) being the monomial x^i * y^j. Fitting
+# is then a direct least squares solve of the design matrix, with no
+# iteration or starting guess.
+
+class LinearModel:
+
+    def __init__(self, terms):
+        self.terms = [tuple(t) for t in terms]
+        self.n = len(self.terms)
+
+    # Design matrix with one column per term, evaluated at (x, y).
+    # Powers are built up by repeated multiplication, once per power.
+    def design(self, x, y):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        x, y = np.broadcast_arrays(x, y)
+        px = _powers(x, max(i for (i, j) in self.terms))
+        py = _powers(y, max(j for (i, j) in self.terms))
+        return np.stack([px[i] * py[j] for (i, j) in self.terms], axis=-1)
+
+    # Swap the roles of x and y, e.g. to get the beta model from alpha
+    def transposed(self):
+        return LinearModel([(j, i) for (i, j) in self.terms])
+
+    # Evaluate with the given coefficients. The signature is that of the
+    # model functions formerly passed to scipy.optimize.curve_fit.
+    def __call__(self, xvalues, *p):
+        return self.design(xvalues[0], xvalues[1]) @ np.asarray(p)
+
+    def __repr__(self):
+        return 'LinearModel(%r)' % (self.terms,)
+
+def _powers(v, n):
+    p = [np.ones_like(v)]
+    for k in range(0, n):
+        p.append(p[-1] * v)
+    return p
+
+# All terms x^i * y^j with i + j <= order, optionally restricted to even
+# powers of x or y (a surface symmetric about the y or x axis), to terms
+# that vanish on the y or x axis, or to terms without cross products.
+def monomials(order,
+              even_x=False, even_y=False,
+              zero_on_y_axis=False, zero_on_x_axis=False,
+              cross=True):
+    terms = []
+    for total in range(0, order + 1):
+        for j in range(0, total + 1):
+            i = total - j
+            if even_x and i % 2: continue
+            if even_y and j % 2: continue
+            if zero_on_y_axis and i == 0: continue
+            if zero_on_x_axis and j == 0: continue
+            if not cross and i and j: continue
+            terms.append((i, j))
+    return LinearModel(terms)
+
+########################################################################
+
+# A fitted model. Calling it evaluates the surface at (x, y).
+
+class Fit:
+
+    def __init__(self, model, coef, rms, cond, rank):
+        self.model = model
+        self.coef = coef
+        self.rms = rms
+        self.cond = cond
+        self.rank = rank
+
+    def __call__(self, x, y):
+        return self.model.design(x, y) @ self.coef
+
+    # Plain lists and numbers, e.g. for saving as JSON
+    def to_dict(self):
+        return {
+            'terms': [list(t) for t in self.model.terms],
+            'coef': [float(c) for c in self.coef],
+            'rms': self.rms,
+            'cond': self.cond,
+            'rank': self.rank,
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            LinearModel(d['terms']),
+            np.asarray(d['coef'], dtype=np.float64),
+            d['rms'],
+            d['cond'],
+            d['rank'])
+
+# Fit several models to the same (x, y) points in one batched solve.
+#
+# models maps a name to a LinearModel, and targets maps the same name to
+# the values to fit. Design matrices are zero padded to a common width
+# and stacked, so a single batched SVD solves every model; the padding
+# columns contribute zero singular values and get zero coefficients.
+# Each Fit reports its RMS residual, the condition number of its design
+# matrix and its numerical rank.
+def fit_models(models, x, y, targets):
+    names = list(models)
+    width = max(models[k].n for k in names)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    A = np.zeros((len(names), len(x), width))
+    b = np.empty((len(names), len(x)))
+    for (k, name) in enumerate(names):
+        A[k, :, :models[name].n] = models[name].design(x, y)
+        b[k] = targets[name]
+
+    (u, s, vt) = np.linalg.svd(A, full_matrices=False)
+    tol = s[:, :1] * max(A.shape[1:]) * np.finfo(np.float64).eps
+    s_inv = np.where(s > tol, 1 / np.where(s > tol, s, 1), 0)
+    utb = np.einsum('knj,kn->kj', u, b)
+    coef = np.einsum('kji,kj->ki', vt, s_inv * utb)
+    residual = np.einsum('kni,ki->kn', A, coef) - b
+
+    fits = {}
+    for (k, name) in enumerate(names):
+        n = models[name].n
+        sk = s[k, :n]
+        fits[name] = Fit(
+            models[name],
+            coef[k, :n],
+            float(np.sqrt(np.mean(np.square(residual[k])))),
+            float(sk[0] / sk[-1]) if sk[-1] > 0 else float('inf'),
+            int(np.sum(s[k] > tol[k])))
+    return fits
+
+# Fit one model many times over with different row weights, e.g. for
+# resampling: weights is (fits, rows), a bootstrap replicate being the
+# number of times each row was drawn and a cross-validation fold being 0
+# for held out rows and 1 otherwise. Rows are scaled by the square roots
+# of their weights and all the fits solved in one batched SVD. Returns
+# the coefficients, (fits, terms).
+def fit_weighted(model, x, y, z, weights):
+    A = model.design(x, y)
+    w = np.sqrt(np.asarray(weights, dtype=np.float64))
+    Aw = w[:, :, None] * A[None, :, :]
+    bw = w * np.asarray(z, dtype=np.float64)[None, :]
+    (u, s, vt) = np.linalg.svd(Aw, full_matrices=False)
+    tol = s[:, :1] * max(A.shape) * np.finfo(np.float64).eps
+    s_inv = np.where(s > tol, 1 / np.where(s > tol, s, 1), 0)
+    utb = np.einsum('knj,kn->kj', u, bw)
+    return np.einsum('kji,kj->ki', vt, s_inv * utb)
+
+def make_fit(model, x, y, z):
+    return fit_models({'z': model}, x, y, {'z': z})['z']
+
+########################################################################
+
+# Fit a family of models (a function from polynomial order to a
+# LinearModel) at several orders at once, e.g. to choose an order.
+# Returns a list of (order, Fit).
+def sweep_orders(family, orders, x, y, z):
+    models = {order: family(order) for order in orders}
+    fits = fit_models(models, x, y, {order: z for order in orders})
+    return [(order, fits[order]) for order in orders]
@@ -1,25 +1,29 @@
 #!/usr/bin/python
 # coding=utf-8
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import scipy.optimize as spo
-import jinja2
 import os
+import sys
 
 import raw_data
+import fitting
+import instrument
+import grid_planner
+import calibration_surface
+from plotting import pyplot, ensure_dir, PlotQueue, full_style, style_dir, style_dpi
 
 ########################################################################
 
-plots_dir = 'calibration_plots'
+calibration_dir = os.path.dirname(os.path.abspath(__file__))
 
-if not os.path.isdir(plots_dir):
-    os.mkdir(plots_dir)
+plots_dir = os.path.join(calibration_dir, 'calibration_plots')
+
+output_file = os.path.join(calibration_dir, 'probe_calibration.h')
 
 ########################################################################
 
-def plot_alphabeta(data, name, variable, zlim, wait=False):
+def plot_alphabeta(data, name, variable, zlim, wait=False, style=full_style):
+    plt = pyplot()
     fig = plt.figure(figsize=(11, 8.5))
     ax = plt.axes(projection='3d')
     ax.set_xlabel('alpha (degrees)')
@@ -29,164 +33,185 @@ def plot_alphabeta(data, name, variable, zlim, wait=False):
     ax.scatter3D(
         data['alpha'],
         data['beta'],
-        data[variable])
+        data[variable],
+        rasterized=style.get('rasterized', False))
     if wait: plt.show()
-    plt.savefig(
-        os.path.join(
-            plots_dir,
-            'alpha_beta_to_' + name + '_' + variable + '.png'),
-        dpi=300)
+    path = os.path.join(
+        style_dir(plots_dir, style),
+        'alpha_beta_to_' + name + '_' + variable + '.png')
+    plt.savefig(path, dpi=style_dpi(300, style))
     plt.close()
+    return path
 
-for p in raw_data.pressure_channel_names:
-    plot_alphabeta(raw_data.pressures, 'pressures', p, [-1, 1])
-
-plot_alphabeta(raw_data.deltas, 'deltas', 'dp0', [-1, 1])
-plot_alphabeta(raw_data.deltas, 'deltas', 'dpa', [-1, 1])
-plot_alphabeta(raw_data.deltas, 'deltas', 'dpb', [-1, 1])
-plot_alphabeta(raw_data.deltas, 'deltas', 'minus_s', [-1, 1])
-
-plot_alphabeta(raw_data.ratios, 'ratios', 'q_over_dp0', [0, 5])
-plot_alphabeta(raw_data.ratios, 'ratios', 'dpa_over_dp0', [-2, 2])
-plot_alphabeta(raw_data.ratios, 'ratios', 'dpb_over_dp0', [-2, 2])
-plot_alphabeta(raw_data.ratios, 'ratios', 'minus_s_over_dp0', [0, 1])
-
-plot_alphabeta(raw_data.ratios_pos, 'ratios_pos', 'q_over_dp0', [0, 5])
-plot_alphabeta(raw_data.ratios_pos, 'ratios_pos', 'dpa_over_dp0', [0, 2])
-plot_alphabeta(raw_data.ratios_pos, 'ratios_pos', 'dpb_over_dp0', [0, 2])
-plot_alphabeta(raw_data.ratios_pos, 'ratios_pos', 'minus_s_over_dp0', [0, 1])
-               
-########################################################################
-
-def plot_scatter(data, variable, xylim, wait=False):
+def plot_scatter(data, variable, xylim, wait=False, style=full_style):
+    plt = pyplot()
     fig = plt.figure(figsize=(11, 8.5))
     ax = plt.axes(projection='3d')
     ax.set_xlabel('dpa_over_dp0')
     ax.set_ylabel('dpb_over_dp0')
     ax.set_zlabel(variable)
     ax.set_xlim(xylim[0], xylim[1])
-    ax.set_ylim(xylim[0], xylim[1])    
+    ax.set_ylim(xylim[0], xylim[1])
     ax.scatter3D(
         data['dpa_over_dp0'],
         data['dpb_over_dp0'],
-        data[variable])
+        data[variable],
+        rasterized=style.get('rasterized', False))
     if wait: plt.show()
-    plt.savefig(
-        os.path.join(
-            plots_dir,
-            'pressure_ratios_to_' + variable + '.png'),
-        dpi=300)
+    path = os.path.join(
+        style_dir(plots_dir, style),
+        'pressure_ratios_to_' + variable + '.png')
+    plt.savefig(path, dpi=style_dpi(300, style))
     plt.close()
-    
-plot_scatter(raw_data.ratios_pos, 'alpha', [0, 5])
-plot_scatter(raw_data.ratios_pos, 'beta', [0, 5])
-plot_scatter(raw_data.ratios_pos, 'q_over_dp0', [0, 5])
-plot_scatter(raw_data.ratios_pos, 'minus_s_over_dp0', [0, 5])
+    return path
+
+def plot_raw_data(views, queue):
+    ensure_dir(style_dir(plots_dir, queue.style))
+
+    pressures = queue.share_table(queue.reduce(views['pressures']))
+    deltas = queue.share_table(queue.reduce(views['deltas']))
+    ratios = queue.share_table(queue.reduce(views['ratios']))
+    ratios_pos = queue.share_table(queue.reduce(views['ratios_pos']))
+    # The scatter plots are against the ratios, so previews bin those in
+    # ratio space
+    ratio_cells = ratios_pos
+    if queue.style.get('preview'):
+        ratio_cells = queue.share_table(queue.reduce(views['ratios_pos'], ratios=True))
+    style = queue.style
+
+    for p in raw_data.pressure_channel_names:
+        queue.submit(plot_alphabeta, pressures, 'pressures', p, [-1, 1], style=style)
+
+    queue.submit(plot_alphabeta, deltas, 'deltas', 'dp0', [-1, 1], style=style)
+    queue.submit(plot_alphabeta, deltas, 'deltas', 'dpa', [-1, 1], style=style)
+    queue.submit(plot_alphabeta, deltas, 'deltas', 'dpb', [-1, 1], style=style)
+    queue.submit(plot_alphabeta, deltas, 'deltas', 'minus_s', [-1, 1], style=style)
+
+    queue.submit(plot_alphabeta, ratios, 'ratios', 'q_over_dp0', [0, 5], style=style)
+    queue.submit(plot_alphabeta, ratios, 'ratios', 'dpa_over_dp0', [-2, 2], style=style)
+    queue.submit(plot_alphabeta, ratios, 'ratios', 'dpb_over_dp0', [-2, 2], style=style)
+    queue.submit(plot_alphabeta, ratios, 'ratios', 'minus_s_over_dp0', [0, 1], style=style)
+
+    queue.submit(plot_alphabeta, ratios_pos, 'ratios_pos', 'q_over_dp0', [0, 5], style=style)
+    queue.submit(plot_alphabeta, ratios_pos, 'ratios_pos', 'dpa_over_dp0', [0, 2], style=style)
+    queue.submit(plot_alphabeta, ratios_pos, 'ratios_pos', 'dpb_over_dp0', [0, 2], style=style)
+    queue.submit(plot_alphabeta, ratios_pos, 'ratios_pos', 'minus_s_over_dp0', [0, 1], style=style)
+
+    queue.submit(plot_scatter, ratio_cells, 'alpha', [0, 5], style=style)
+    queue.submit(plot_scatter, ratio_cells, 'beta', [0, 5], style=style)
+    queue.submit(plot_scatter, ratio_cells, 'q_over_dp0', [0, 5], style=style)
+    queue.submit(plot_scatter, ratio_cells, 'minus_s_over_dp0', [0, 5], style=style)
 
 ########################################################################
 
-def poly_thru_yaxis_sym_xaxis(xvalues, *p):
-    x = xvalues[0]
-    y = xvalues[1]
-    return (p[0] * np.power(x, 1) +
-            p[1] * np.power(x, 2) +
-            p[2] * np.power(x, 3) +
-            p[3] * np.power(x, 1) * np.power(y, 2) +
-            p[4] * np.power(x, 1) * np.power(y, 4) +
-            p[5] * np.power(x, 1) * np.power(y, 6))
-poly_thru_yaxis_sym_xaxis.n = 6
-
-def poly_thru_xaxis_sym_yaxis(xvalues, *p):
-    return poly_thru_yaxis_sym_xaxis([xvalues[1], xvalues[0]], *p)
-poly_thru_xaxis_sym_yaxis.n = poly_thru_yaxis_sym_xaxis.n
-
-def poly_sym_xaxis_yaxis(xvalues, *p):
-    x = xvalues[0]
-    y = xvalues[1]
-    return (p[0] +
-            p[1] * np.power(x, 2) +
-            p[2] * np.power(x, 4) +
-            p[3] * np.power(x, 6) +
-            p[4] * np.power(y, 2) +
-            p[5] * np.power(y, 4) +
-            p[6] * np.power(y, 6))
-poly_sym_xaxis_yaxis.n = 7
-
-def make_fit(fn, x, y, z):
-
-    popt, pcov = spo.curve_fit(
-        fn,
-        [x, y],
-        z,
-        [1 for i in range(0, fn.n)])
-
-    def result_function(x, y):
-        return fn([x, y], *popt)
-
-    return result_function
+# Probe models, as polynomials in (dpa/dp0, dpb/dp0) = (x, y)
+
+# Through the y axis and symmetric about the x axis
+poly_thru_yaxis_sym_xaxis = fitting.LinearModel([
+    (1, 0),
+    (2, 0),
+    (3, 0),
+    (1, 2),
+    (1, 4),
+    (1, 6),
+])
+
+poly_thru_xaxis_sym_yaxis = poly_thru_yaxis_sym_xaxis.transposed()
+
+# Symmetric about both axes
+poly_sym_xaxis_yaxis = fitting.LinearModel([
+    (0, 0),
+    (2, 0),
+    (4, 0),
+    (6, 0),
+    (0, 2),
+    (0, 4),
+    (0, 6),
+])
+
+make_fit = fitting.make_fit
 
 ########################################################################
 
-model = {
-    'alpha': make_fit(
-        poly_thru_yaxis_sym_xaxis,
-        raw_data.ratios_pos['dpa_over_dp0'],
-        raw_data.ratios_pos['dpb_over_dp0'],
-        raw_data.ratios_pos['alpha']),
-    'beta': make_fit(
-        poly_thru_xaxis_sym_yaxis,
-        raw_data.ratios_pos['dpa_over_dp0'],
-        raw_data.ratios_pos['dpb_over_dp0'],
-        raw_data.ratios_pos['beta']),
-    'q_over_dp0': make_fit(
-        poly_sym_xaxis_yaxis,
-        raw_data.ratios_pos['dpa_over_dp0'],
-        raw_data.ratios_pos['dpb_over_dp0'],
-        raw_data.ratios_pos['q_over_dp0']),
-    'minus_s_over_dp0': make_fit(
-        poly_sym_xaxis_yaxis,
-        raw_data.ratios_pos['dpa_over_dp0'],
-        raw_data.ratios_pos['dpb_over_dp0'],
-        raw_data.ratios_pos['minus_s_over_dp0']),
+model_functions = {
+    'alpha': poly_thru_yaxis_sym_xaxis,
+    'beta': poly_thru_xaxis_sym_yaxis,
+    'q_over_dp0': poly_sym_xaxis_yaxis,
+    'minus_s_over_dp0': poly_sym_xaxis_yaxis,
 }
 
-def plot_curve_fit(data, model, variable, wait=False):
+# Families of the above shapes by polynomial order, for choosing orders
+model_families = {
+    'alpha': lambda order: fitting.monomials(
+        order, even_y=True, zero_on_y_axis=True),
+    'beta': lambda order: fitting.monomials(
+        order, even_x=True, zero_on_x_axis=True),
+    'q_over_dp0': lambda order: fitting.monomials(
+        order, even_x=True, even_y=True),
+    'minus_s_over_dp0': lambda order: fitting.monomials(
+        order, even_x=True, even_y=True),
+}
+
+def fit_models(ratios_pos, models=model_functions):
+    with instrument.stage('fit', rows=len(ratios_pos['dpa_over_dp0'])):
+        return fitting.fit_models(
+            models,
+            ratios_pos['dpa_over_dp0'],
+            ratios_pos['dpb_over_dp0'],
+            ratios_pos)
+
+def curve_fit_surface(model, variable):
     X, Y = np.meshgrid(
         np.arange(0, 3.0, 0.1),
         np.arange(0, 2.5, 0.1))
-    Z = model[variable](X, Y)
+    return (X, Y, model[variable](X, Y))
+
+def plot_curve_fit(data, model, variable, wait=False):
+    plot_curve_fit_surface(data, curve_fit_surface(model, variable), variable, wait)
+
+def plot_curve_fit_surface(data, surface, variable, wait=False, style=full_style):
+    plt = pyplot()
+    (X, Y, Z) = surface
     fig = plt.figure(figsize=(11, 8.5))
     ax = plt.axes(projection='3d')
     ax.set_xlabel('dpa_over_dp0')
     ax.set_ylabel('dpb_over_dp0')
     ax.set_xlim(0, 5)
-    ax.set_ylim(0, 5)    
+    ax.set_ylim(0, 5)
     ax.set_zlabel(variable)
     ax.scatter3D(
         data['dpa_over_dp0'],
         data['dpb_over_dp0'],
         data[variable],
-        color='blue')
+        color='blue',
+        rasterized=style.get('rasterized', False))
     ax.plot_surface(X, Y, Z, color='yellow')
     if wait: plt.show()
-    plt.savefig(
-        os.path.join(
-            plots_dir,
-            'curve_fit_' + variable + '.png'),
-        dpi=300)
+    path = os.path.join(
+        style_dir(plots_dir, style),
+        'curve_fit_' + variable + '.png')
+    plt.savefig(path, dpi=style_dpi(300, style))
     plt.close()
-             
-plot_curve_fit(raw_data.ratios_pos, model, 'alpha', False)
-plot_curve_fit(raw_data.ratios_pos, model, 'beta', False)
-plot_curve_fit(raw_data.ratios_pos, model, 'q_over_dp0', False)
-plot_curve_fit(raw_data.ratios_pos, model, 'minus_s_over_dp0', False)
+    return path
+
+def plot_curve_fits(ratios_pos, model, queue):
+    ensure_dir(style_dir(plots_dir, queue.style))
+    data = queue.share_table(queue.reduce(ratios_pos, ratios=True))
+    for variable in model_functions:
+        queue.submit(
+            plot_curve_fit_surface,
+            data,
+            curve_fit_surface(model, variable),
+            variable,
+            style=queue.style)
 
 ########################################################################
 
 # Load the calibration data template
 
 def load_template():
-    templateLoader = jinja2.FileSystemLoader(searchpath="./")
+    import jinja2
+    templateLoader = jinja2.FileSystemLoader(searchpath=calibration_dir)
     templateEnv = jinja2.Environment(loader=templateLoader)
     return templateEnv.get_template("calibration_data.jinja")
 
@@ -194,141 +219,200 @@ def load_template():
 
 # Plot raw calibration data for quality control
 
-def plot_calibration(var_name, nx, ny, linear_data):
+def plot_calibration(var_name, nx, ny, linear_data, style=full_style):
+    plt = pyplot()
+    import matplotlib.lines
     xx, yy = np.meshgrid(range(0, nx), range(0, ny))
-    f = lambda ix, iy: linear_data[iy + ny * ix]
-    zz = np.vectorize(f)(xx, yy)
+    zz = np.asarray(linear_data).reshape(nx, ny).T
+    # Keep fine grids to about 100 x 100 drawn facets
+    stride = max(1, max(nx, ny) // 100)
 
     title = 'probe_calibration_' + var_name
-        
+
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     ax.set_xlabel('x index')
     ax.set_ylabel('y index')
     ax.set_zlabel(var_name)
-    ax.plot_surface(xx, yy, zz, rstride=1, cstride=1)
+    ax.plot_surface(xx, yy, zz, rstride=stride, cstride=stride)
     fake2Dline = matplotlib.lines.Line2D([0],[0], linestyle="none", c='b', marker = 'o')
     ax.legend([fake2Dline], [title], numpoints = 1)
-    plt.savefig(
-        os.path.join(
-            plots_dir,
-            title + '.png'),
-        dpi=600)
+    path = os.path.join(
+        style_dir(plots_dir, style),
+        title + '.png')
+    plt.savefig(path, dpi=style_dpi(600, style))
     plt.close()
+    return path
 
 ########################################################################
 
-# Generate a calibration data file for a given probe design
+# Generate calibration tables for a given probe design
 
-def generate_file(raw2data):
+table_comments = {
+    'alpha': 'Alpha as a function of (dpa/dp0, dpb/dp0)',
+    'beta': 'Beta as a function of (dpa/dp0, dpb/dp0)',
+    'q_over_dp0': 'q/dp0 as a function of (dpa/dp0, dpb/dp0)',
+    'minus_s_over_dp0': '-s/dp0 as a function of (dpa/dp0, dpb/dp0)',
+}
 
-    data_alpha = []
-    data_beta = []
-    data_q_over_dp0 = []
-    data_minus_s_over_dp0 = []    
+# The whole grid is evaluated in one vectorized pass, so dp_step can be
+# made much finer than the default. Tables are laid out x major, as read
+# by get() in calibration_surface.cpp: data[y.size * ix + iy].
+
+def generate_tables(raw2data,
+                    dp_step=0.1,
+                    dp_alpha_max=3.0,
+                    dp_beta_max=2.5):
 
-    dp_step = 0.1
-    
     dp_alpha_min = 0
-    dp_alpha_max = 3.0
     dp_alpha_zero_offset = 0.0
     n_alpha = int(round((dp_alpha_max - dp_alpha_min) / dp_step) + 1)
-    
+
     dp_beta_min = 0
-    dp_beta_max = 2.5
     dp_beta_zero_offset = 0.0
-    n_beta = int(round((dp_beta_max - dp_beta_min) / dp_step) + 1)    
-
-    for i in range(0, n_alpha):
-        dpa = dp_alpha_min + dp_step * i
-        for j in range(0, n_beta):
-            dpb = dp_beta_min + dp_step * j
-            d = raw2data(dpa, dpb)
-            data_alpha.append(d[0]);
-            data_beta.append(d[1]);
-            data_q_over_dp0.append(d[2])
-            data_minus_s_over_dp0.append(d[3])
-
-    plot_calibration('alpha', n_alpha, n_beta, data_alpha)
-    plot_calibration('beta', n_alpha, n_beta, data_beta)
-    plot_calibration('q_over_dp0', n_alpha, n_beta, data_q_over_dp0)    
-    plot_calibration('minus_s_over_dp0', n_alpha, n_beta, data_minus_s_over_dp0)
-            
-    outfile = open('probe_calibration.h', 'w')
-            
-    outfile.write(load_template().render(
-        fileprefix = 'probe',
-        structs = {
-            'alpha': {
-                'comment': 'Alpha as a function of (dpa/dp0, dpb/dp0)',
-                'x': {
-                    'size': n_alpha,
-                    'step': dp_step,
-                    'zero_offset': dp_alpha_zero_offset,
-                },
-                'y': {
-                    'size': n_beta,
-                    'step': dp_step,
-                    'zero_offset': dp_beta_zero_offset,
-                },
-                'data': data_alpha,
-            },
-            'beta': {
-                'comment': 'Beta as a function of (dpa/dp0, dpb/dp0)',
-                'x': {
-                    'size': n_alpha,
-                    'step': dp_step,
-                    'zero_offset': dp_alpha_zero_offset,
-                },
-                'y': {
-                    'size': n_beta,
-                    'step': dp_step,
-                    'zero_offset': dp_beta_zero_offset,
-                },
-                'data': data_beta,
+    n_beta = int(round((dp_beta_max - dp_beta_min) / dp_step) + 1)
+
+    dpa, dpb = np.meshgrid(
+        dp_alpha_min + dp_step * np.arange(0, n_alpha),
+        dp_beta_min + dp_step * np.arange(0, n_beta),
+        indexing='ij')
+
+    with instrument.stage('tables', rows=dpa.size):
+        d = raw2data(dpa, dpb)
+
+    data = {
+        'alpha': d[0],
+        'beta': d[1],
+        'q_over_dp0': d[2],
+        'minus_s_over_dp0': d[3],
+    }
+
+    return {
+        name: {
+            'comment': table_comments[name],
+            'x': {
+                'size': n_alpha,
+                'step': dp_step,
+                'zero_offset': dp_alpha_zero_offset,
             },
-            'q_over_dp0': {
-                'comment': 'q/dp0 as a function of (dpa/dp0, dpb/dp0)',
-                'x': {
-                    'size': n_alpha,
-                    'step': dp_step,
-                    'zero_offset': dp_alpha_zero_offset,
-                },
-                'y': {
-                    'size': n_beta,
-                    'step': dp_step,
-                    'zero_offset': dp_beta_zero_offset,
-                },
-                'data': data_q_over_dp0,
+            'y': {
+                'size': n_beta,
+                'step': dp_step,
+                'zero_offset': dp_beta_zero_offset,
             },
-            'minus_s_over_dp0': {
-                'comment': '-s/dp0 as a function of (dpa/dp0, dpb/dp0)',
-                'x': {
-                    'size': n_alpha,
-                    'step': dp_step,
-                    'zero_offset': dp_alpha_zero_offset,
-                },
-                'y': {
-                    'size': n_beta,
-                    'step': dp_step,
-                    'zero_offset': dp_beta_zero_offset,
-                },
-                'data': data_minus_s_over_dp0,
-            },
-        }))
-    
-    outfile.close();
+            'data': np.asarray(data[name], dtype=np.float64).ravel(),
+        }
+        for name in table_comments
+    }
+
+# Tables on per-surface grids, e.g. as chosen by grid_planner.plan()
+def generate_planned_tables(model, plan):
+    structs = {}
+    for name in plan:
+        s = grid_planner.surface(model[name], plan[name]['x'], plan[name]['y'])
+        s['comment'] = table_comments[name]
+        structs[name] = s
+    return structs
+
+def plot_tables(structs, queue):
+    ensure_dir(style_dir(plots_dir, queue.style))
+    for name in structs:
+        s = structs[name]
+        queue.submit(
+            plot_calibration,
+            name, s['x']['size'], s['y']['size'], queue.share(s['data']),
+            style=queue.style)
+
+# Table values are formatted here in one pass rather than one by one in
+# the template, which is much faster for fine grids.
+def format_data(values):
+    return ''.join([repr(v) + 'f, ' for v in np.asarray(values).tolist()])
+
+def format_packed(encoding, packed):
+    if encoding == 'float16':
+        return ''.join(['0x%04x, ' % v for v in np.asarray(packed).view(np.uint16).tolist()])
+    return ''.join(['%d, ' % v for v in np.asarray(packed).tolist()])
+
+packed_types = {
+    'int16': 'const int16_t',
+    'float16': 'const uint16_t',
+}
+
+def _template_struct(s):
+    encoding = s.get('encoding', 'float32')
+    if encoding == 'float32':
+        return dict(s, encoding=encoding, data_literal=format_data(s['data']))
+    return dict(
+        s,
+        packed_type=packed_types[encoding],
+        data_literal=format_packed(encoding, s['packed']))
+
+def write_file(structs, path=output_file):
+    structs = {name: _template_struct(structs[name]) for name in structs}
+    with instrument.stage('render'):
+        outfile = open(path, 'w')
+        outfile.write(load_template().render(
+            fileprefix = 'probe',
+            structs = structs))
+        outfile.close();
+
+def write_blob(structs, path):
+    with instrument.stage('render'):
+        calibration_surface.write_blob(structs, path)
+
+# Ways of exporting the tables: a C header to compile in, or a little
+# endian binary blob (see calibration_blob.h), either of them with any
+# of the table encodings in calibration_surface.ENCODINGS.
+export_backends = {
+    'header': write_file,
+    'blob': write_blob,
+}
+
+# Tables in the given encoding, and a report of the error that encoding
+# adds to each table
+def encode_tables(structs, encoding='float32'):
+    encoded = {}
+    report = {}
+    for name in structs:
+        encoded[name] = calibration_surface.quantize(structs[name], encoding)
+        report[name] = calibration_surface.quantization_error(
+            structs[name], encoded[name])
+    return (encoded, report)
+
+def export_tables(structs, path=output_file, backend='header', encoding='float32'):
+    if backend == 'header' and encoding == 'float32':
+        write_file(structs, path)
+        return None
+    (encoded, report) = encode_tables(structs, encoding)
+    export_backends[backend](encoded, path)
+    return report
+
+def generate_file(raw2data, queue, path=output_file, backend='header', encoding='float32'):
+    structs = generate_tables(raw2data)
+    plot_tables(structs, queue)
+    return export_tables(structs, path, backend, encoding)
 
 ########################################################################
 
 # Generate calibration files for our two known probe designs
 
-def probe_raw2data(dpa_over_dp0, dpb_over_dp0):
-    return [
-        model['alpha'](dpa_over_dp0, dpb_over_dp0),
-        model['beta'](dpa_over_dp0, dpb_over_dp0),
-        model['q_over_dp0'](dpa_over_dp0, dpb_over_dp0),
-        model['minus_s_over_dp0'](dpa_over_dp0, dpb_over_dp0),        
-    ]
-
-generate_file(probe_raw2data)
+def make_raw2data(model):
+    def probe_raw2data(dpa_over_dp0, dpb_over_dp0):
+        return [
+            model['alpha'](dpa_over_dp0, dpb_over_dp0),
+            model['beta'](dpa_over_dp0, dpb_over_dp0),
+            model['q_over_dp0'](dpa_over_dp0, dpb_over_dp0),
+            model['minus_s_over_dp0'](dpa_over_dp0, dpb_over_dp0),
+        ]
+    return probe_raw2data
+
+def main(workers=None):
+    views = raw_data.views(raw_data.load())
+    with PlotQueue(workers) as queue:
+        plot_raw_data(views, queue)
+        model = fit_models(views['ratios_pos'])
+        plot_curve_fits(views['ratios_pos'], model, queue)
+        generate_file(make_raw2data(model), queue)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,96 @@
+import math
+import numpy as np
+
+import calibration_surface
+
+########################################################################
+
+# Choose calibration table grids against an interpolation error budget.
+#
+# For each surface, candidate grids (an x step and a y step from
+# candidate_steps, each axis extended to cover the required domain) are
+# tried from the smallest table up. Each candidate is filled from the
+# fitted model, then bilinear interpolation over it is compared against
+# the model at several points inside every grid cell. The first, and so
+# smallest, grid whose maximum error is within budget is chosen.
+
+candidate_steps = [0.5, 0.25, 0.2, 0.1, 0.05, 0.04, 0.025, 0.02, 0.01, 0.005]
+
+# Default error budgets: degrees for alpha and beta, and dimensionless
+# ratios for q/dp0 and -s/dp0
+default_max_error = {
+    'alpha': 0.1,
+    'beta': 0.1,
+    'q_over_dp0': 0.002,
+    'minus_s_over_dp0': 0.002,
+}
+
+# Interior points per cell and axis at which errors are checked
+subdivisions = 4
+
+def axis(step, extent):
+    return {
+        'size': int(math.ceil(extent / step - 1e-9)) + 1,
+        'step': step,
+        'zero_offset': 0.0,
+    }
+
+def surface(fn, x_axis, y_axis):
+    x, y = np.meshgrid(
+        x_axis['step'] * np.arange(0, x_axis['size']) - x_axis['zero_offset'],
+        y_axis['step'] * np.arange(0, y_axis['size']) - y_axis['zero_offset'],
+        indexing='ij')
+    return {
+        'x': x_axis,
+        'y': y_axis,
+        'data': np.asarray(fn(x, y), dtype=np.float64).ravel(),
+    }
+
+def _dense(a, extent):
+    v = a['step'] * np.arange(0, (a['size'] - 1) * subdivisions + 1) / subdivisions
+    return v[v <= extent]
+
+# Maximum and RMS difference between the table and the model over the
+# domain [0, x_extent] x [0, y_extent]
+def error(fn, s, x_extent, y_extent):
+    x, y = np.meshgrid(
+        _dense(s['x'], x_extent), _dense(s['y'], y_extent), indexing='ij')
+    (z, err) = calibration_surface.interpolate(s, x, y)
+    d = np.abs(z - fn(x, y))
+    if err.any():
+        return (float('inf'), float('inf'))
+    return (float(np.max(d)), float(np.sqrt(np.mean(np.square(d)))))
+
+def plan_surface(fn, max_error, x_extent, y_extent, steps=candidate_steps):
+    candidates = sorted(
+        [(axis(sx, x_extent), axis(sy, y_extent)) for sx in steps for sy in steps],
+        key=lambda c: c[0]['size'] * c[1]['size'])
+    for (x_axis, y_axis) in candidates:
+        s = surface(fn, x_axis, y_axis)
+        (e_max, e_rms) = error(fn, s, x_extent, y_extent)
+        if e_max <= max_error:
+            return {
+                'x': x_axis,
+                'y': y_axis,
+                'max_error': e_max,
+                'rms_error': e_rms,
+                'bytes': calibration_surface.table_bytes(s),
+            }
+    raise ValueError(
+        'No candidate grid meets a maximum error of %g' % max_error)
+
+# The (dpa/dp0, dpb/dp0) domain the tables must cover: the given
+# percentile of the observed (positive quadrant) ratios, rounded up.
+def coverage(ratios_pos, percentile=100.0, resolution=0.1):
+    def extent(v):
+        return resolution * math.ceil(np.percentile(v, percentile) / resolution - 1e-9)
+    return (extent(ratios_pos['dpa_over_dp0']), extent(ratios_pos['dpb_over_dp0']))
+
+def plan(model, max_error, x_extent, y_extent, steps=candidate_steps):
+    return {
+        k: plan_surface(model[k], max_error[k], x_extent, y_extent, steps)
+        for k in max_error
+    }
+
+def total_bytes(p):
+    return sum(p[k]['bytes'] for k in p)
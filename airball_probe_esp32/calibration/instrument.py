@@ -0,0 +1,161 @@
+import cProfile
+import datetime
+import json
+import os
+import platform
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+########################################################################
+
+# Timing and memory instrumentation of the pipeline stages.
+#
+# Code wraps a stage in
+#
+#   with instrument.stage('fit') as s:
+#       ...
+#       s['rows'] = n
+#
+# which records wall time, CPU time (this process plus any worker
+# processes that finished during the stage), the peak RSS of the process
+# at the end of the stage and how much the stage raised it. Stages may
+# nest; each record names its parent, and records are listed in the
+# order the stages started. A stage that runs more than once under the
+# same parents (one per file, per plot, ...) has one record: its calls,
+# total times and rows, and the largest peak RSS and growth. So the
+# records stay bounded however long the run, and the cost when nobody
+# asks for a report is a few system calls.
+#
+# begin_run() starts a new run, dropping the records of the last one.
+#
+# write_report() saves the records of the run as JSON. Stages named in
+# profile(...) are also run under cProfile, the statistics going to
+# <name>.prof and a text summary to <name>.txt in the profile directory.
+
+# Records by the names of the stage and its parents, in order of first start
+_records = {}
+_stack = []
+_profile_stages = set()
+_profile_dir = '.'
+_started = datetime.datetime.now().isoformat(timespec='seconds')
+
+def begin_run():
+    global _started
+    _records.clear()
+    _started = datetime.datetime.now().isoformat(timespec='seconds')
+
+def _rss_mb(who):
+    r = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes elsewhere
+    return r / (1 << 20) if sys.platform == 'darwin' else r / 1024.0
+
+def _cpu_s():
+    own = time.process_time()
+    c = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (own, c.ru_utime + c.ru_stime)
+
+def profile(stages, directory='.'):
+    global _profile_dir
+    _profile_stages.update(stages)
+    _profile_dir = directory
+
+def _dump_profile(name, profiler):
+    os.makedirs(_profile_dir, exist_ok=True)
+    base = os.path.join(_profile_dir, name.replace('/', '_'))
+    profiler.dump_stats(base + '.prof')
+    with open(base + '.txt', 'w') as f:
+        pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(40)
+
+def _aggregate(key, record):
+    if key not in _records:
+        _records[key] = {
+            'stage': record['stage'],
+            'parent': record['parent'],
+            'depth': record['depth'],
+            'calls': 0,
+            'rows': None,
+            'wall_s': 0.0,
+            'cpu_s': 0.0,
+            'workers_cpu_s': 0.0,
+            'peak_rss_mb': 0.0,
+            'peak_rss_growth_mb': 0.0,
+            'workers_peak_rss_mb': 0.0,
+        }
+    return _records[key]
+
+def _merge(total, record):
+    total['calls'] += 1
+    if record['rows'] is not None:
+        total['rows'] = (total['rows'] or 0) + record['rows']
+    for k in ('wall_s', 'cpu_s', 'workers_cpu_s'):
+        total[k] += record[k]
+    for k in ('peak_rss_mb', 'peak_rss_growth_mb', 'workers_peak_rss_mb'):
+        total[k] = max(total[k], record[k])
+
+@contextmanager
+def stage(name, rows=None):
+    record = {
+        'stage': name,
+        'parent': _stack[-1]['stage'] if _stack else None,
+        'depth': len(_stack),
+        'rows': rows,
+        'key': (_stack[-1]['key'] if _stack else ()) + (name,),
+    }
+    _stack.append(record)
+    total = _aggregate(record['key'], record)
+    profiler = cProfile.Profile() if name in _profile_stages else None
+    rss_before = _rss_mb(resource.RUSAGE_SELF)
+    (cpu_before, children_before) = _cpu_s()
+    wall_before = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - wall_before
+        (cpu, children) = _cpu_s()
+        rss = _rss_mb(resource.RUSAGE_SELF)
+        record.update({
+            'wall_s': wall,
+            'cpu_s': cpu - cpu_before,
+            'workers_cpu_s': children - children_before,
+            'peak_rss_mb': rss,
+            'peak_rss_growth_mb': rss - rss_before,
+            'workers_peak_rss_mb': _rss_mb(resource.RUSAGE_CHILDREN),
+        })
+        _stack.pop()
+        _merge(total, record)
+        if profiler:
+            _dump_profile(name, profiler)
+
+def records():
+    return [dict(r) for r in _records.values() if r['calls']]
+
+def report():
+    return {
+        'started': _started,
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'cpus': os.cpu_count(),
+        'peak_rss_mb': _rss_mb(resource.RUSAGE_SELF),
+        'stages': records(),
+    }
+
+def write_report(path):
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+
+def print_summary(out=sys.stderr):
+    for r in records():
+        out.write('%-24s %9.3f s wall %9.3f s cpu %9.3f s workers %8.1f MB peak%s%s\n' % (
+            '  ' * r['depth'] + r['stage'],
+            r['wall_s'], r['cpu_s'], r['workers_cpu_s'], r['peak_rss_mb'],
+            '' if r['rows'] is None else '  %d rows' % r['rows'],
+            '' if r['calls'] == 1 else '  %d calls' % r['calls']))
+    out.flush()
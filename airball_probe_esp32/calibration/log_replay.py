@@ -0,0 +1,319 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import functools
+import json
+import mmap
+import os
+import re
+import sys
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import airdata_engine
+import calibration_surface
+import sentences
+
+########################################################################
+
+# Re-run recorded flight logs through candidate calibration tables.
+#
+# Logs are memory-mapped and processed in chunks that end on a line
+# boundary. The $A (raw airdata) and $AR (on-board airdata) lines of each
+# chunk are picked out with one regular expression search per sentence
+# and parsed into arrays in bulk, dropping malformed lines. The $A
+# samples are run through the old and the new calibration surfaces with
+# the float32 firmware math of airdata_engine, and running statistics of
+# the differences are kept:
+#
+#   new - old      what changes between the two sets of tables
+#   new - flown    against the $AR airdata the probe computed in flight
+#   old - flown    (a sanity check that "old" is what flew)
+#
+# $A and $AR lines of a measurement cycle share a count and are matched
+# on it, within a session: the count starts again from 0 when the probe
+# restarts, so each chunk is split into sessions wherever the count of a
+# sentence does not go up, and a $A is only matched with the $AR of the
+# same session. The sessions of the two sentences line up as long as
+# each restart leaves both in the chunk. A cycle split across a chunk
+# boundary is not matched.
+#
+# Chunks are independent, so they are spread over a process pool; each
+# worker maps the log itself and sends back only its statistics.
+
+OUTPUTS = ['alpha', 'beta', 'q', 'p']
+
+COMPARISONS = [
+    ('new', 'old'),
+    ('new', 'flown'),
+    ('old', 'flown'),
+]
+
+DEFAULT_CHUNK_BYTES = 64 << 20
+
+########################################################################
+
+# The text after the prefix (including its comma) of every line of a
+# chunk that starts with it, found in one pass over the chunk
+def select_lines(chunk, prefix):
+    bodies = _line_pattern(prefix).findall(chunk)
+    if chunk.startswith(prefix):
+        end = chunk.find(b'\n')
+        bodies.insert(0, chunk[len(prefix):end if end >= 0 else len(chunk)])
+    return bodies
+
+@functools.lru_cache()
+def _line_pattern(prefix):
+    return re.compile(b'\n' + re.escape(prefix) + b'([^\n]*)')
+
+# Parse line bodies of nfields comma separated numbers into an array.
+# Returns the array and the indices of the bodies it holds. The bodies
+# are parsed in one call; if that fails they are split in halves and
+# tried again, down to single malformed bodies (e.g. truncated by a reset
+# or garbled), which are dropped. A few bad lines in a chunk only cost
+# about one more pass over it.
+def parse_fields(bodies, nfields):
+    parts = list(_parse_fields(bodies, nfields, 0))
+    if not parts:
+        return (np.empty((0, nfields)), np.empty(0, np.int64))
+    return (np.concatenate([v for (v, i) in parts]), np.concatenate([i for (v, i) in parts]))
+
+def _parse_fields(bodies, nfields, first):
+    if not bodies:
+        return
+    text = b','.join(bodies)
+    if text.count(b',') == len(bodies) * nfields - 1:
+        try:
+            with warnings.catch_warnings():
+                # Older NumPy warns instead of raising on a bad field
+                warnings.simplefilter('error', DeprecationWarning)
+                values = np.fromstring(text, dtype=np.float64, sep=',')
+            if len(values) == len(bodies) * nfields:
+                yield (values.reshape(len(bodies), nfields), np.arange(first, first + len(bodies)))
+                return
+        except (ValueError, DeprecationWarning):
+            pass
+    if len(bodies) > 1:
+        half = len(bodies) // 2
+        yield from _parse_fields(bodies[:half], nfields, first)
+        yield from _parse_fields(bodies[half:], nfields, first + half)
+
+# The well formed lines of a chunk that start with prefix, as an array
+def parse_lines(chunk, prefix, nfields):
+    return parse_fields(select_lines(chunk, prefix), nfields)[0]
+
+def parse_chunk(chunk):
+    raw = parse_lines(chunk, b'$A,', len(sentences.raw_airdata_dtype))
+    flown = parse_lines(chunk, b'$AR,', len(sentences.airdata_dtype))
+    return (raw, flown)
+
+# Split a log into (path, start, end) byte ranges ending on line boundaries
+def chunk_ranges(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    ranges = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return ranges
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            start = 0
+            while start < size:
+                end = min(size, start + chunk_bytes)
+                if end < size:
+                    nl = m.rfind(b'\n', start, end)
+                    end = nl + 1 if nl >= start else size
+                ranges.append((path, start, end))
+                start = end
+    return ranges
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[start:end]
+
+########################################################################
+
+# Running count / mean / M2 / min / max of a stream of differences,
+# merged one array at a time.
+class Stats:
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def add(self, x):
+        x = x[np.isfinite(x)]
+        if not len(x):
+            return
+        n = len(x)
+        mean = float(np.mean(x))
+        m2 = float(np.sum(np.square(x - mean)))
+        delta = mean - self.mean
+        total = self.n + n
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+        self.min = min(self.min, float(np.min(x)))
+        self.max = max(self.max, float(np.max(x)))
+
+    def merge(self, other):
+        if not other.n:
+            return
+        delta = other.mean - self.mean
+        total = self.n + other.n
+        self.m2 += other.m2 + delta * delta * self.n * other.n / total
+        self.mean += delta * other.n / total
+        self.n = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        if not self.n:
+            return {'n': 0}
+        return {
+            'n': self.n,
+            'mean': self.mean,
+            'std': (self.m2 / self.n) ** 0.5,
+            'rms': (self.m2 / self.n + self.mean ** 2) ** 0.5,
+            'min': self.min,
+            'max': self.max,
+        }
+
+# Session number of each line of a count column, from 0 in each chunk:
+# a new session starts wherever the count does not go up
+def sessions(count):
+    s = np.zeros(len(count), np.int64)
+    s[1:] = np.cumsum(count[1:] <= count[:-1])
+    return s
+
+# Indices (ia, ir) of the raw and flown lines of the same session and count
+def match_cycles(raw_count, flown_count):
+    keys = [
+        (sessions(c) << 32) | c.astype(np.int64)
+        for c in (raw_count.astype(np.int64), flown_count.astype(np.int64))
+    ]
+    (_, ia, ir) = np.intersect1d(keys[0], keys[1], return_indices=True)
+    return (ia, ir)
+
+class Replay:
+
+    def __init__(self, old, new):
+        self.engines = {
+            'old': airdata_engine.Engine(old),
+            'new': airdata_engine.Engine(new),
+        }
+        self.stats = {
+            '%s-%s' % c: {k: Stats() for k in OUTPUTS} for c in COMPARISONS
+        }
+        self.samples = 0
+        self.errors = {'old': 0, 'new': 0}
+        self.unmatched = 0
+
+    def evaluate(self, raw):
+        r = {}
+        for (name, engine) in self.engines.items():
+            d = engine(raw[:, 3], raw[:, 4], raw[:, 5], raw[:, 1])
+            # The probe reports negative q as zero
+            d['q'] = np.maximum(d['q'], 0)
+            self.errors[name] += int(np.sum(d['err']))
+            r[name] = d
+        return r
+
+    def add_chunk(self, chunk):
+        (raw, flown) = parse_chunk(chunk)
+        self.samples += len(raw)
+        if not len(raw):
+            return
+        r = self.evaluate(raw)
+
+        # Pair $A samples with the $AR sentence of the same cycle
+        (ia, ir) = match_cycles(raw[:, 0], flown[:, 0])
+        self.unmatched += len(raw) - len(ia)
+        r['flown'] = {
+            k: np.full(len(raw), np.nan) for k in OUTPUTS
+        }
+        for (i, k) in enumerate(OUTPUTS):
+            r['flown'][k][ia] = flown[ir, i + 1]
+
+        for (a, b) in COMPARISONS:
+            ok = ~r['new']['err'] if 'new' in (a, b) else np.ones(len(raw), bool)
+            if 'old' in (a, b):
+                ok &= ~r['old']['err']
+            for k in OUTPUTS:
+                self.stats['%s-%s' % (a, b)][k].add((r[a][k] - r[b][k])[ok])
+
+    def merge(self, other):
+        self.samples += other.samples
+        self.unmatched += other.unmatched
+        for k in self.errors:
+            self.errors[k] += other.errors[k]
+        for (c, d) in self.stats.items():
+            for (k, s) in d.items():
+                s.merge(other.stats[c][k])
+
+    def summary(self):
+        return {
+            'samples': self.samples,
+            'lookup_errors': self.errors,
+            'unmatched': self.unmatched,
+            'differences': {
+                c: {k: s.summary() for (k, s) in d.items()}
+                for (c, d) in self.stats.items()
+            },
+        }
+
+def replay_ranges(old, new, ranges):
+    r = Replay(old, new)
+    for (path, start, end) in ranges:
+        r.add_chunk(read_range(path, start, end))
+    return r
+
+def replay(logs, old_header, new_header, chunk_bytes=DEFAULT_CHUNK_BYTES, workers=None):
+    old = calibration_surface.read_tables(old_header)
+    new = calibration_surface.read_tables(new_header)
+    ranges = [r for path in logs for r in chunk_ranges(path, chunk_bytes)]
+    workers = min(workers or os.cpu_count() or 1, max(1, len(ranges)))
+    if workers == 1:
+        return replay_ranges(old, new, ranges).summary()
+    r = Replay(old, new)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(replay_ranges, [old] * len(ranges), [new] * len(ranges),
+                             [[c] for c in ranges]):
+            r.merge(part)
+    return r.summary()
+
+########################################################################
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Replay $A flight log samples through old and new calibration tables')
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--old', required=True, help='calibration header (or .bin blob) that flew')
+    parser.add_argument('--new', default='probe_calibration.h', help='candidate calibration header (or .bin blob)')
+    parser.add_argument('--chunk-mb', type=int, default=DEFAULT_CHUNK_BYTES >> 20)
+    parser.add_argument('--output', default=None, help='write the summary as JSON here')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: one per core)')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    start = time.monotonic()
+    summary = replay(args.logs, args.old, args.new, args.chunk_mb << 20, args.jobs)
+    elapsed = time.monotonic() - start
+    summary['seconds'] = elapsed
+    text = json.dumps(summary, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    sys.stderr.write('%d samples in %.2f s (%.2f M samples/s)\n' % (
+        summary['samples'], elapsed, summary['samples'] / max(elapsed, 1e-9) / 1e6))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,101 @@
+import os
+import numpy as np
+
+import calibration_surface
+import log_replay
+
+########################################################################
+
+# Parsing of log chunks with malformed lines among the good ones.
+
+good = [
+    b'$A,1,1013.250000,20.100000,0.500000,0.300000,0.100000',
+    b'$AR,1,2.000000,-1.000000,50.000000,101325.000000,20.100000,1000',
+    b'$A,2,1013.250000,20.100000,0.600000,0.300000,0.100000',
+    b'$M,name,looptime,n,10,min,1.000000,max,2.000000,avg,1.500000,lat,1.000000',
+    b'$A,3,1013.250000,20.100000,0.700000,0.300000,0.100000',
+    b'$AR,3,2.100000,-1.000000,50.000000,101325.000000,20.100000,1100',
+]
+
+corrupt = [
+    # Truncated by a reset, after and before the last comma
+    b'$A,4,1013.250000,20.100000,0.500000,0.300000,',
+    b'$A,5,1013.250000,20.100000,0.500000,0.3',
+    # Garbled field
+    b'$A,6,1013.250000,2x.100000,0.500000,0.300000,0.100000',
+    # Two lines run together
+    b'$A,7,1013.250000,20.100000,$A,8,1013.250000,20.100000,0.500000',
+    b'$AR,9,2.000000,-1.000000,50.0$A,10,1013.250000',
+]
+
+def parse(lines, prefix=b'$A,', nfields=6):
+    return log_replay.parse_lines(b'\n'.join(lines) + b'\n', prefix, nfields)
+
+def test_good_lines():
+    raw = parse(good)
+    assert raw.shape == (3, 6)
+    assert list(raw[:, 0]) == [1, 2, 3]
+    assert list(raw[:, 3]) == [0.5, 0.6, 0.7]
+    flown = parse(good, b'$AR,', 7)
+    assert list(flown[:, 0]) == [1, 3]
+    assert list(flown[:, 6]) == [1000, 1100]
+
+def test_corrupt_lines_are_dropped():
+    for bad in corrupt:
+        for at in [0, 2, len(good)]:
+            lines = good[:at] + [bad] + good[at:]
+            assert np.array_equal(parse(lines), parse(good)), (bad, at)
+            assert np.array_equal(parse(lines, b'$AR,', 7), parse(good, b'$AR,', 7)), (bad, at)
+
+def test_all_corrupt():
+    assert parse(corrupt).shape == (0, 6)
+    assert parse([]).shape == (0, 6)
+
+def test_last_line_without_newline():
+    raw = log_replay.parse_lines(b'\n'.join(good), b'$AR,', 7)
+    assert list(raw[:, 0]) == [1, 3]
+
+def test_kept_indices():
+    bodies = [b'1,2', b'3,', b'5,6', b'x,8', b'9,10']
+    (values, kept) = log_replay.parse_fields(bodies, 2)
+    assert list(kept) == [0, 2, 4]
+    assert values.tolist() == [[1, 2], [5, 6], [9, 10]]
+
+def test_chunk():
+    lines = good + corrupt + good
+    (raw, flown) = log_replay.parse_chunk(b'\n'.join(lines))
+    assert list(raw[:, 0]) == [1, 2, 3] * 2
+    assert list(flown[:, 0]) == [1, 3] * 2
+
+def test_restart_in_a_chunk():
+    raw = np.array([0, 1, 2, 0, 1, 2], dtype=float)
+    flown = np.array([0, 2, 0, 1, 2], dtype=float)
+    assert list(log_replay.sessions(raw)) == [0, 0, 0, 1, 1, 1]
+    (ia, ir) = log_replay.match_cycles(raw, flown)
+    # raw[1] has no $AR; raw[4] goes with flown[3], not raw[1]
+    assert list(ia) == [0, 2, 3, 4, 5]
+    assert list(ir) == [0, 1, 2, 3, 4]
+    # A restart where the count does not go down
+    assert list(log_replay.sessions(np.array([0.0, 0.0, 1.0]))) == [0, 1, 1]
+    assert log_replay.match_cycles(np.empty(0), flown)[0].shape == (0,)
+
+def test_replay_pairs_within_sessions():
+    header = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'probe_calibration.h')
+    tables = calibration_surface.read_tables(header)
+    r = log_replay.Replay(tables, tables)
+    lines = []
+    for (session, counts) in enumerate([range(0, 5), range(0, 3)]):
+        for i in counts:
+            lines.append(good[0].replace(b'$A,1,', b'$A,%d,' % i))
+            # Session 0 flew alpha 2, session 1 alpha 100
+            if i != 1:
+                lines.append(b'$AR,%d,%f,-1.0,50.0,101325.0,20.1,%d' % (
+                    i, 2.0 + 98.0 * session, 1000 + i))
+    r.add_chunk(b'\n'.join(lines) + b'\n')
+    assert r.samples == 8 and r.unmatched == 2
+    flown = r.stats['new-flown']['alpha'].summary()
+    assert flown['n'] == 6
+    # Each $A is compared with its own session's $AR: three with each
+    new = log_replay.Replay(tables, tables).evaluate(
+        log_replay.parse_lines(good[0] + b'\n', b'$A,', 6))['new']['alpha'][0]
+    assert np.isclose(flown['mean'], new - (2.0 * 4 + 100.0 * 2) / 6)
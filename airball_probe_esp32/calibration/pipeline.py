@@ -0,0 +1,184 @@
+import os
+import tempfile
+
+import artifacts
+import calibration_surface
+import fitting
+import generate_calibrations
+import raw_data
+import verify_calibrations
+from plotting import PlotQueue
+
+########################################################################
+
+# The calibration pipeline as a graph of artifacts (see artifacts.py):
+#
+#   runs, cal           the sweep CSVs and esp32_scanner.cal
+#   dataset             the sweeps parsed and converted to pressures
+#   fit                 model coefficients, from dataset and the model terms
+#   tables              calibration tables, from fit and the grid step
+#   output              probe_calibration.h (or a blob), from tables and
+#                       the template, in the chosen encoding
+#   verify              the firmware math, run on dataset with tables
+#
+# and the calibration and verification plots, each of them a plot job
+# keyed on its own inputs. build() brings everything up to date,
+# recomputing only what depends on something that changed, and writes
+# the output file only if its contents changed. The fitted coefficients
+# are kept as JSON, with the provenance of the fit in the meta.json next
+# to them.
+
+template_file = os.path.join(generate_calibrations.calibration_dir, 'calibration_data.jinja')
+
+# Sources of the library verify_calibrations runs the tables through
+firmware_files = [
+    os.path.join(generate_calibrations.calibration_dir, f)
+    for f in [
+        'calibration_surface.cpp',
+        'calibration_surface.h',
+        'calibration_blob.cpp',
+        'calibration_blob.h',
+        'pressures_to_airdata.cpp',
+        'probe_calibration_lib.cpp',
+    ]
+]
+
+########################################################################
+
+# cal is raw_data.cal_file, which read_files uses; it is an input for
+# the sake of its contents.
+def read_dataset(runs, cal, workers=None):
+    d = raw_data.read_files([os.path.basename(r) for r in runs], workers=workers)
+    return {k: d[k] for k in d}
+
+def _views(dataset):
+    return raw_data.views(raw_data.SweepDataset.from_columns(dataset))
+
+def fit_dataset(dataset, models):
+    fits = generate_calibrations.fit_models(
+        _views(dataset)['ratios_pos'],
+        {k: fitting.LinearModel(models[k]) for k in models})
+    return {k: fits[k].to_dict() for k in fits}
+
+def _model(fit):
+    return {k: fitting.Fit.from_dict(fit[k]) for k in fit}
+
+def make_tables(fit, dp_step):
+    return generate_calibrations.generate_tables(
+        generate_calibrations.make_raw2data(_model(fit)), dp_step=dp_step)
+
+# The file contents, and the encoding error report of export_tables
+def export(tables, template, backend, encoding):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'output')
+        report = generate_calibrations.export_tables(tables, path, backend, encoding)
+        with open(path, 'rb') as f:
+            return (f.read(), report)
+
+# firmware is the library sources, an input for the sake of their contents
+def verify(dataset, tables, firmware, encoding):
+    (encoded, _) = generate_calibrations.encode_tables(tables, encoding)
+    views = _views(dataset)
+    derived = verify_calibrations.derive(
+        views['deltas'], calibration_surface.blob_bytes(encoded))
+    return {
+        'summary': verify_calibrations.summarize(views, derived),
+        'derived': derived,
+    }
+
+########################################################################
+
+def graph(files=None, dp_step=0.1, backend='header', encoding='float32', workers=None):
+    runs = [
+        artifacts.File(os.path.join(raw_data.raw_data_dir, f))
+        for f in files or raw_data.raw_data_files
+    ]
+    g = {}
+    g['dataset'] = artifacts.Task(
+        'dataset', read_dataset,
+        inputs={'runs': runs, 'cal': artifacts.File(raw_data.cal_file)},
+        code=['raw_data', 'sweep', 'sweep_cache', 'calibration'],
+        codec=artifacts.NpzCodec(),
+        options={'workers': workers})
+    g['fit'] = artifacts.Task(
+        'fit', fit_dataset,
+        inputs={'dataset': g['dataset']},
+        params={'models': {
+            k: [list(t) for t in m.terms]
+            for (k, m) in generate_calibrations.model_functions.items()
+        }},
+        code=['raw_data', 'fitting', generate_calibrations.fit_models],
+        codec=artifacts.JsonCodec())
+    g['tables'] = artifacts.Task(
+        'tables', make_tables,
+        inputs={'fit': g['fit']},
+        params={'dp_step': dp_step},
+        code=[
+            'fitting',
+            generate_calibrations.generate_tables,
+            generate_calibrations.make_raw2data,
+            generate_calibrations.table_comments,
+        ])
+    g['output'] = artifacts.Task(
+        'output', export,
+        inputs={'tables': g['tables'], 'template': artifacts.File(template_file)},
+        params={'backend': backend, 'encoding': encoding},
+        code=[
+            'calibration_surface',
+            generate_calibrations.export_tables,
+            generate_calibrations.encode_tables,
+            generate_calibrations.write_file,
+            generate_calibrations.write_blob,
+            generate_calibrations._template_struct,
+            generate_calibrations.format_data,
+            generate_calibrations.format_packed,
+            generate_calibrations.packed_types,
+            generate_calibrations.load_template,
+        ])
+    g['verify'] = artifacts.Task(
+        'verify', verify,
+        inputs={
+            'dataset': g['dataset'],
+            'tables': g['tables'],
+            'firmware': [artifacts.File(f) for f in firmware_files],
+        },
+        params={'encoding': encoding},
+        code=[
+            'raw_data',
+            'calibration_surface',
+            'probe_calibration_lib',
+            'verify_calibrations',
+            generate_calibrations.encode_tables,
+        ])
+    return g
+
+def plot(g, queue, calibration=True, verification=False):
+    views = _views(g['dataset'].value())
+    if calibration:
+        generate_calibrations.plot_raw_data(views, queue)
+        generate_calibrations.plot_curve_fits(
+            views['ratios_pos'], _model(g['fit'].value()), queue)
+        generate_calibrations.plot_tables(g['tables'].value(), queue)
+    if verification:
+        verify_calibrations.plot_verification(views, g['verify'].value()['derived'], queue)
+
+# Bring the output file, the verification and (optionally) the plots up
+# to date, the plots in the preview style if preview is set. Returns the
+# graph, the output path, whether the output file was written and the
+# PlotCache used, if any.
+def build(output=None, files=None, dp_step=0.1, backend='header', encoding='float32',
+          plots=True, verify_plots=False, preview=False, workers=None):
+    if output is None:
+        output = generate_calibrations.output_file
+        if backend == 'blob':
+            output = os.path.splitext(output)[0] + '.bin'
+    g = graph(files, dp_step, backend, encoding, workers)
+    (content, _) = g['output'].value()
+    written = artifacts.publish(content, output)
+    g['verify'].value()
+    cache = None
+    if plots or verify_plots:
+        cache = artifacts.PlotCache()
+        with PlotQueue(workers, cache, preview) as queue:
+            plot(g, queue, plots, verify_plots)
+    return (g, output, written, cache)
@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import artifacts
+import instrument
+
+########################################################################
+
+# matplotlib is only needed by the plotting stages, and it is slow to
+# import, so modules get pyplot from here when they actually draw.
+
+def pyplot():
+    import matplotlib.pyplot as plt
+    import mpl_toolkits.mplot3d
+    return plt
+
+def ensure_dir(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+########################################################################
+
+# Plot styles. The full style is the publication render: every point,
+# at the dpi each plot asks for. The preview style is for a quick look:
+# the data are reduced before they are plotted (see binned), scatter
+# layers are rasterized and figures rendered at low dpi, into a preview/
+# directory beside the full plots so as not to replace them.
+
+full_style = {}
+
+preview_style = {
+    'preview': True,
+    'dpi': 72,
+    'rasterized': True,
+    # Cell size of the binning in ratio space, in dp/dp0
+    'ratio_cell': 0.05,
+}
+
+def style_dir(directory, style):
+    return os.path.join(directory, 'preview') if style.get('preview') else directory
+
+def style_dpi(dpi, style):
+    return style.get('dpi', dpi)
+
+# Mean of every column over the rows sharing the same values of the key
+# columns `by`, or, with cell given, falling in the same cell of a grid
+# of that size over them. The key columns come out as the means of
+# their rows, i.e. the centroid of each cell.
+def binned(table, by, cell=None):
+    columns = {k: np.asarray(table[k], dtype=np.float64) for k in table}
+    key = np.column_stack([
+        columns[k] if cell is None else np.floor(columns[k] / cell) for k in by])
+    (_, inverse, counts) = np.unique(
+        key, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    return {
+        k: np.bincount(inverse, weights=v, minlength=len(counts)) / counts
+        for (k, v) in columns.items()
+    }
+
+########################################################################
+
+# Plot job queue. Figures are independent of one another, so they are
+# rendered in a pool of worker processes on the Agg backend.
+#
+# Input arrays are shared with the workers rather than pickled into
+# every job: share() writes an array once to a scratch directory and
+# returns a small SharedArray handle, which workers open memory-mapped.
+# Jobs must be module level functions so they can be sent to a worker.
+# With workers=1 jobs run in this process, in order.
+#
+# With a cache (an artifacts.PlotCache), jobs return the path of the
+# file they wrote, and a job whose function, arguments and output file
+# are unchanged since it last ran is skipped. Shared arrays take part in
+# that by the hash of their contents.
+#
+# With preview=True, queue.style is preview_style and queue.reduce()
+# bins the tables it is given; plotting code passes queue.style on to
+# its jobs.
+
+class SharedArray:
+
+    def __init__(self, path, digest=None):
+        self.path = path
+        self.digest = digest
+
+    def resolve(self):
+        return np.load(self.path, mmap_mode='r')
+
+def _resolve(v):
+    if isinstance(v, SharedArray):
+        return v.resolve()
+    if isinstance(v, dict):
+        return {k: _resolve(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return type(v)(_resolve(x) for x in v)
+    return v
+
+# Plots are only written to files, in the workers and in this process
+# alike, so no display or GUI toolkit is needed
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _run_job(fn, args, kwargs):
+    return fn(*_resolve(args), **_resolve(kwargs))
+
+class PlotQueue:
+
+    def __init__(self, workers=None, cache=None, preview=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.cache = cache
+        self.style = preview_style if preview else full_style
+        self._jobs = []
+        self._dir = None
+        self._count = 0
+
+    def share(self, array):
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix='plots-')
+        path = os.path.join(self._dir, '%d.npy' % self._count)
+        self._count += 1
+        array = np.ascontiguousarray(array)
+        np.save(path, array)
+        return SharedArray(path, artifacts.digest(array) if self.cache else None)
+
+    # Share every column of a table (e.g. one of the raw_data views)
+    def share_table(self, table):
+        return {k: self.share(table[k]) for k in table}
+
+    # A table to plot, binned by (alpha, beta) in preview, or, with
+    # ratios=True, by cells of the ratio space
+    def reduce(self, table, ratios=False):
+        if not self.style.get('preview'):
+            return table
+        if ratios:
+            return binned(table, ['dpa_over_dp0', 'dpb_over_dp0'], self.style['ratio_cell'])
+        return binned(table, ['alpha', 'beta'])
+
+    def submit(self, fn, *args, **kwargs):
+        self._jobs.append((fn, args, kwargs))
+
+    def run(self):
+        jobs, self._jobs = self._jobs, []
+        keys = [None] * len(jobs)
+        if self.cache:
+            keys = [self.cache.key(*job) for job in jobs]
+            stale = [i for i in range(0, len(jobs)) if not self.cache.fresh(keys[i])]
+            self.cache.skipped += len(jobs) - len(stale)
+            (jobs, keys) = ([jobs[i] for i in stale], [keys[i] for i in stale])
+        try:
+            with instrument.stage('plots', rows=len(jobs)):
+                if self.workers == 1 or len(jobs) <= 1:
+                    if jobs:
+                        _use_agg()
+                    paths = [_run_job(*job) for job in jobs]
+                else:
+                    with ProcessPoolExecutor(
+                            max_workers=min(self.workers, len(jobs)),
+                            initializer=_use_agg) as pool:
+                        futures = [pool.submit(_run_job, *job) for job in jobs]
+                        paths = [f.result() for f in futures]
+            if self.cache:
+                for (key, path) in zip(keys, paths):
+                    self.cache.record(key, [path])
+                self.cache.rendered += len(jobs)
+                self.cache.save()
+        finally:
+            self.close()
+
+    def close(self):
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.run()
+        self.close()
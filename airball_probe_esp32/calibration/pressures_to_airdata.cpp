@@ -27,17 +27,22 @@ struct airdata_struct pressures_to_airdata(const calibration_surface* cs_alpha,
   abs_sign rpa = get(dpa / dp0);
   abs_sign rpb = get(dpb / dp0);
   
-  r.alpha = interpolate(cs_alpha, rpa.abs, rpb.abs, err);
+  // Each surface may have its own grid, so check every lookup.
+  int e[4];
+
+  r.alpha = interpolate(cs_alpha, rpa.abs, rpb.abs, &e[0]);
   r.alpha *= rpa.sign;
   
-  r.beta = interpolate(cs_beta, rpa.abs, rpb.abs, err);
+  r.beta = interpolate(cs_beta, rpa.abs, rpb.abs, &e[1]);
   r.beta *= rpb.sign;
 
-  float q_over_dp0 = interpolate(cs_q_over_dp0, rpa.abs, rpb.abs, err);  
+  float q_over_dp0 = interpolate(cs_q_over_dp0, rpa.abs, rpb.abs, &e[2]);
   r.q = dp0 * q_over_dp0;
 
-  float minus_s_over_dp0 = interpolate(cs_minus_s_over_dp0, rpa.abs, rpb.abs, err);
+  float minus_s_over_dp0 = interpolate(cs_minus_s_over_dp0, rpa.abs, rpb.abs, &e[3]);
   r.p = raw_baro + minus_s_over_dp0 * dp0;
 
+  *err = (e[0] || e[1] || e[2] || e[3]) ? -1 : 0;
+
   return r;  
 }
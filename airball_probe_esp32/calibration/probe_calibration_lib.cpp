@@ -0,0 +1,109 @@
+#include <stddef.h>
+
+#include "probe_calibration.h"
+#include "pressures_to_airdata.h"
+#include "calibration_blob.h"
+
+// Array entry points for calling the firmware airdata math in-process
+// (e.g. via ctypes from verify_calibrations.py). Each sample is run
+// through exactly the same pressures_to_airdata() the probe uses, with
+// the compiled-in tables or with tables read from a blob.
+
+extern "C"
+{
+
+void pressures_to_airdata_array(const calibration_surface* cs_alpha,
+				const calibration_surface* cs_beta,
+				const calibration_surface* cs_q_over_dp0,
+				const calibration_surface* cs_minus_s_over_dp0,
+				const float* dp0,
+				const float* dpa,
+				const float* dpb,
+				const float* raw_baro,
+				size_t n,
+				float* alpha,
+				float* beta,
+				float* q,
+				float* p,
+				int* err) {
+  for (size_t i = 0; i < n; i++) {
+    airdata d = pressures_to_airdata(cs_alpha,
+				     cs_beta,
+				     cs_q_over_dp0,
+				     cs_minus_s_over_dp0,
+				     dp0[i],
+				     dpa[i],
+				     dpb[i],
+				     raw_baro[i],
+				     &err[i]);
+    alpha[i] = d.alpha;
+    beta[i] = d.beta;
+    q[i] = d.q;
+    p[i] = d.p;
+  }
+}
+
+void probe_pressures_to_airdata_array(const float* dp0,
+				      const float* dpa,
+				      const float* dpb,
+				      const float* raw_baro,
+				      size_t n,
+				      float* alpha,
+				      float* beta,
+				      float* q,
+				      float* p,
+				      int* err) {
+  pressures_to_airdata_array(&probe_alpha,
+			     &probe_beta,
+			     &probe_q_over_dp0,
+			     &probe_minus_s_over_dp0,
+			     dp0,
+			     dpa,
+			     dpb,
+			     raw_baro,
+			     n,
+			     alpha,
+			     beta,
+			     q,
+			     p,
+			     err);
+}
+
+// Returns -1, leaving the outputs alone, if the blob lacks a surface
+int blob_pressures_to_airdata_array(const uint8_t* blob,
+				    uint32_t length,
+				    const float* dp0,
+				    const float* dpa,
+				    const float* dpb,
+				    const float* raw_baro,
+				    size_t n,
+				    float* alpha,
+				    float* beta,
+				    float* q,
+				    float* p,
+				    int* err) {
+  calibration_surface cs[4];
+  const char* names[] = { "alpha", "beta", "q_over_dp0", "minus_s_over_dp0" };
+  for (int i = 0; i < 4; i++) {
+    if (calibration_blob_surface(blob, length, names[i], &cs[i]) != 0) {
+      return -1;
+    }
+  }
+  pressures_to_airdata_array(&cs[0],
+			     &cs[1],
+			     &cs[2],
+			     &cs[3],
+			     dp0,
+			     dpa,
+			     dpb,
+			     raw_baro,
+			     n,
+			     alpha,
+			     beta,
+			     q,
+			     p,
+			     err);
+  return 0;
+}
+
+}
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import ctypes
+import os
+import subprocess
+import numpy as np
+
+########################################################################
+
+# In-process binding to the firmware airdata math. The shared library
+# is built by the Makefile from the same calibration_surface.cpp and
+# pressures_to_airdata.cpp the probe runs, with the tables compiled in
+# from probe_calibration.h, so results are those the probe would compute.
+
+lib_name = 'libprobe_calibration.so'
+lib_dir = os.path.dirname(os.path.abspath(__file__))
+
+_lib = None
+
+def _float_p():
+    return np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS')
+
+def _int_p():
+    return np.ctypeslib.ndpointer(dtype=np.intc, flags='C_CONTIGUOUS')
+
+def load_library():
+    global _lib
+    if _lib is not None:
+        return _lib
+
+    # Let make decide whether the library is stale with respect to
+    # probe_calibration.h, so we never verify against old tables.
+    subprocess.check_call(['make', '-s', lib_name], cwd=lib_dir)
+
+    lib = ctypes.CDLL(os.path.join(lib_dir, lib_name))
+    lib.probe_pressures_to_airdata_array.restype = None
+    lib.probe_pressures_to_airdata_array.argtypes = [
+        _float_p(), # dp0
+        _float_p(), # dpa
+        _float_p(), # dpb
+        _float_p(), # raw_baro
+        ctypes.c_size_t,
+        _float_p(), # alpha
+        _float_p(), # beta
+        _float_p(), # q
+        _float_p(), # p
+        _int_p(),   # err
+    ]
+    lib.blob_pressures_to_airdata_array.restype = ctypes.c_int
+    lib.blob_pressures_to_airdata_array.argtypes = [
+        ctypes.c_char_p,
+        ctypes.c_uint32,
+    ] + lib.probe_pressures_to_airdata_array.argtypes
+    _lib = lib
+    return _lib
+
+########################################################################
+
+# With blob (the bytes of a calibration blob, see calibration_blob.h)
+# the tables are read from it instead of the compiled-in ones.
+def pressures_to_airdata(dp0, dpa, dpb, raw_baro, blob=None):
+    dp0, dpa, dpb, raw_baro = np.broadcast_arrays(
+        *[np.asarray(v, dtype=np.float32) for v in (dp0, dpa, dpb, raw_baro)])
+    shape = dp0.shape
+    inputs = [np.ascontiguousarray(v.ravel()) for v in (dp0, dpa, dpb, raw_baro)]
+    n = inputs[0].size
+
+    r = {k: np.empty(n, dtype=np.float32) for k in ('alpha', 'beta', 'q', 'p')}
+    r['err'] = np.empty(n, dtype=np.intc)
+
+    outputs = (r['alpha'], r['beta'], r['q'], r['p'], r['err'])
+    if blob is None:
+        load_library().probe_pressures_to_airdata_array(*inputs, n, *outputs)
+    elif load_library().blob_pressures_to_airdata_array(
+            blob, len(blob), *inputs, n, *outputs) != 0:
+        raise ValueError('calibration blob is malformed or lacks a surface')
+
+    return {k: v.reshape(shape) for k, v in r.items()}
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import asyncio
+import json
+import mmap
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import log_replay
+import probe_receiver
+import sentences
+
+########################################################################
+
+# Host side collector of the probe's $M metric summaries (see metric.h).
+#
+# Every $M sentence summarizes `n` timings of one metric, in
+# microseconds, by their min, max, average and latest value. Summaries
+# are merged per probe and metric into time buckets of a fixed length.
+# Each bucket keeps the totals (summaries, timings, min, max, and the
+# timing-weighted average) and two histograms on fixed log spaced bins:
+# of the summary averages, weighted by n, and of the summary maxima.
+# Because the bins are fixed, buckets from different streams, logs or
+# runs merge by adding.
+#
+# Summaries of the loop metrics whose max is over budget are flagged:
+# looptime (the work done per measurement) over the measurement timer
+# period, and loopint (the time between measurements) over the period
+# plus a tolerance, i.e. a late or missed timer tick.
+#
+# The probe prints $M sentences on Serial and sends them over UDP with
+# its $A and $AR sentences. Summaries come from recorded logs or live
+# from probe_receiver, timed by the host clock. A log with $AR sentences
+# (a UDP capture) is timed by the millis() of the last $AR before each
+# summary. A Serial log has none, so it is timed by position: every
+# metric is recorded once per measurement, so the summaries of a metric
+# up to and including one cover as many timer periods as their n add up
+# to. export() writes the buckets as compact arrays, tagged with a
+# firmware label, for comparing timings across firmware versions.
+
+firmware_file = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'airball_probe_esp32.ino')
+
+DEFAULT_BUCKET_SECONDS = 60.0
+
+# Histogram bin edges in microseconds, 20 per decade from 1 us to 10 s.
+# Bin 0 is below the first edge and the last bin above the last.
+bin_edges = 10 ** np.arange(0, 7.01, 0.05)
+
+default_tolerance = 0.05
+
+series_dtype = np.dtype([
+    ('t', np.float64),
+    ('summaries', np.int32),
+    ('n', np.int64),
+    ('min', np.float32),
+    ('max', np.float32),
+    ('avg', np.float32),
+    ('p50', np.float32),
+    ('p99', np.float32),
+    ('over_budget', np.int32),
+])
+
+########################################################################
+
+# The measurement timer period of the firmware, in microseconds
+def measurement_interval(path=firmware_file):
+    with open(path) as f:
+        m = re.search(r'#define\s+MEASUREMENT_INTERVAL_US\s+(\d+)', f.read())
+    return int(m.group(1))
+
+def budgets(period, tolerance=default_tolerance):
+    return {
+        'looptime': float(period),
+        'loopint': period * (1 + tolerance),
+    }
+
+def _bin(v):
+    return int(np.searchsorted(bin_edges, v, side='right'))
+
+# Value below which the given fraction of a histogram's weight lies,
+# taking the upper edge of the bin it falls in
+def histogram_percentile(hist, fraction):
+    total = hist.sum()
+    if not total:
+        return float('nan')
+    i = int(np.searchsorted(np.cumsum(hist), fraction * total))
+    return float(bin_edges[min(i, len(bin_edges) - 1)])
+
+class Bucket:
+
+    def __init__(self):
+        self.summaries = 0
+        self.n = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.total = 0.0
+        self.over_budget = 0
+        self.avg_hist = np.zeros(len(bin_edges) + 1, np.int64)
+        self.max_hist = np.zeros(len(bin_edges) + 1, np.int64)
+
+    def add(self, record, over):
+        (n, mn, mx, avg, lat) = record
+        self.summaries += 1
+        self.n += n
+        self.min = min(self.min, mn)
+        self.max = max(self.max, mx)
+        self.total += avg * n
+        self.over_budget += over
+        self.avg_hist[_bin(avg)] += n
+        self.max_hist[_bin(mx)] += 1
+
+    def merge(self, other):
+        self.summaries += other.summaries
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total += other.total
+        self.over_budget += other.over_budget
+        self.avg_hist += other.avg_hist
+        self.max_hist += other.max_hist
+
+    def avg(self):
+        return self.total / self.n if self.n else float('nan')
+
+class MetricsCollector:
+
+    def __init__(self, bucket_seconds=DEFAULT_BUCKET_SECONDS, budgets=None):
+        self.bucket_seconds = bucket_seconds
+        self.budgets = budgets or {}
+        # (probe, metric) -> {bucket index: Bucket}
+        self.buckets = {}
+        # (probe, metric, t, max, n) of each summary over budget
+        self.flagged = []
+
+    # Add one summary, a sentences.metric_dtype record, at time t (s)
+    def add(self, probe, name, record, t):
+        over = name in self.budgets and record[2] > self.budgets[name]
+        if over:
+            self.flagged.append((probe, name, t, float(record[2]), int(record[0])))
+        b = self.buckets.setdefault((probe, name), {})
+        k = int(t // self.bucket_seconds)
+        if k not in b:
+            b[k] = Bucket()
+        b[k].add(record, over)
+
+    def merge(self, other):
+        self.flagged += other.flagged
+        for (key, buckets) in other.buckets.items():
+            mine = self.buckets.setdefault(key, {})
+            for (k, b) in buckets.items():
+                if k in mine:
+                    mine[k].merge(b)
+                else:
+                    mine[k] = b
+
+    def keys(self):
+        return sorted(self.buckets)
+
+    # The buckets of one probe and metric, in time order, as an array of
+    # series_dtype records, and their two histograms as (buckets, bins)
+    def series(self, probe, name):
+        buckets = self.buckets[(probe, name)]
+        ks = sorted(buckets)
+        s = np.zeros(len(ks), series_dtype)
+        for (i, k) in enumerate(ks):
+            b = buckets[k]
+            s[i] = (
+                k * self.bucket_seconds, b.summaries, b.n, b.min, b.max, b.avg(),
+                histogram_percentile(b.avg_hist, 0.5),
+                histogram_percentile(b.avg_hist, 0.99),
+                b.over_budget)
+        avg_hist = np.array([buckets[k].avg_hist for k in ks])
+        max_hist = np.array([buckets[k].max_hist for k in ks])
+        return (s, avg_hist, max_hist)
+
+    # Totals over all buckets of one probe and metric
+    def total(self, probe, name):
+        t = Bucket()
+        for b in self.buckets[(probe, name)].values():
+            t.merge(b)
+        return t
+
+    def summary(self):
+        rows = []
+        for (probe, name) in self.keys():
+            t = self.total(probe, name)
+            rows.append({
+                'probe': probe,
+                'metric': name,
+                'buckets': len(self.buckets[(probe, name)]),
+                'summaries': t.summaries,
+                'n': t.n,
+                'min': t.min,
+                'max': t.max,
+                'avg': t.avg(),
+                'p99': histogram_percentile(t.avg_hist, 0.99),
+                'max_p99': histogram_percentile(t.max_hist, 0.99),
+                'over_budget': t.over_budget,
+            })
+        return rows
+
+    # Write every series, with its histograms, to a compressed .npz. Keys
+    # are '<probe>/<metric>', '<probe>/<metric>/avg_hist' and
+    # '<probe>/<metric>/max_hist'; 'meta' holds the settings as JSON.
+    def export(self, path, firmware=None):
+        arrays = {}
+        for (probe, name) in self.keys():
+            (s, avg_hist, max_hist) = self.series(probe, name)
+            key = '%s/%s' % (probe, name)
+            arrays[key] = s
+            # Counts per bucket and bin are small; int32 keeps the file small
+            arrays[key + '/avg_hist'] = avg_hist.astype(np.int32)
+            arrays[key + '/max_hist'] = max_hist.astype(np.int32)
+        arrays['bin_edges'] = bin_edges
+        arrays['meta'] = np.array(json.dumps({
+            'firmware': firmware,
+            'bucket_seconds': self.bucket_seconds,
+            'budgets': self.budgets,
+            'flagged': self.flagged,
+        }))
+        np.savez_compressed(path, **arrays)
+
+########################################################################
+
+# Times in seconds of a run of millis() values, continuing a clock that
+# has reached `last`: where millis() goes back (the probe restarted) the
+# clock carries on from the time before. Returns (times, base, last) for
+# the next run, base being what is added to millis() / 1000.
+def _clock(millis, base, last):
+    s = np.asarray(millis, dtype=np.float64) / 1000.0
+    if not len(s):
+        return (s, base, last)
+    previous = np.concatenate(([last - base], s[:-1]))
+    restart = s < previous
+    times = s + base + np.cumsum(np.where(restart, previous, 0.0))
+    return (times, times[-1] - s[-1], float(times[-1]))
+
+# Offsets and text of the $M lines of a chunk
+def _metric_lines(chunk):
+    lines = [(m.start() + 1, m.group(1)) for m in metric_pattern.finditer(chunk)]
+    if chunk.startswith(b'$M,'):
+        lines.insert(0, (0, chunk.split(b'\n', 1)[0]))
+    return lines
+
+metric_pattern = re.compile(rb'\n(\$M,[^\n]*)')
+
+def _has_airdata(path):
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return m[:4] == b'$AR,' or m.find(b'\n$AR,') >= 0
+
+# Read the $M summaries of a log into a collector. If the log has $AR
+# sentences, each summary is timed by the millis() of the last well
+# formed one before it (0 before the first one); if not, by its position,
+# period being the measurement timer period in microseconds.
+def read_log(path, collector, probe=None, chunk_bytes=log_replay.DEFAULT_CHUNK_BYTES,
+             period=None):
+    probe = probe or os.path.splitext(os.path.basename(path))[0]
+    if not _has_airdata(path):
+        return _read_serial_log(path, collector, probe, chunk_bytes, period)
+    (base, last) = (0.0, 0.0)
+    for (_, start, end) in log_replay.chunk_ranges(path, chunk_bytes):
+        chunk = log_replay.read_range(path, start, end)
+        (flown, kept) = log_replay.parse_fields(
+            log_replay.select_lines(chunk, b'$AR,'), len(sentences.airdata_dtype))
+        (times, base, t0) = _clock(flown[:, -1], base, last)
+        # $AR lines before each $M line, counted from the previous one
+        (ar, previous) = (int(chunk.startswith(b'$AR,')), 0)
+        for (at, line) in _metric_lines(chunk):
+            ar += chunk.count(b'\n$AR,', previous, at)
+            previous = at
+            j = int(np.searchsorted(kept, ar - 1, side='right')) - 1
+            s = sentences.parse(line)
+            if s is not None:
+                (name, record) = s[1]
+                collector.add(probe, name, record, times[j] if j >= 0 else last)
+        last = t0
+    return collector
+
+def _read_serial_log(path, collector, probe, chunk_bytes, period):
+    seconds = (period or measurement_interval()) / 1e6
+    # Timings of each metric so far
+    counts = {}
+    for (_, start, end) in log_replay.chunk_ranges(path, chunk_bytes):
+        chunk = log_replay.read_range(path, start, end)
+        for (_, line) in _metric_lines(chunk):
+            s = sentences.parse(line)
+            if s is not None:
+                (name, record) = s[1]
+                counts[name] = counts.get(name, 0) + int(record[0])
+                collector.add(probe, name, record, counts[name] * seconds)
+    return collector
+
+def read_logs(logs, bucket_seconds=DEFAULT_BUCKET_SECONDS, budgets=None, workers=None,
+              period=None):
+    workers = min(workers or os.cpu_count() or 1, max(1, len(logs)))
+    collector = MetricsCollector(bucket_seconds, budgets)
+    if workers == 1:
+        for path in logs:
+            read_log(path, collector, period=period)
+        return collector
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        n = len(logs)
+        for part in pool.map(
+                read_log, logs,
+                [MetricsCollector(bucket_seconds, budgets) for l in logs],
+                [None] * n, [log_replay.DEFAULT_CHUNK_BYTES] * n, [period] * n):
+            collector.merge(part)
+    return collector
+
+########################################################################
+
+# Live collection: the probe receiver, feeding every $M sentence it
+# parses to a collector, timed by the host clock
+async def collect(args, collector):
+    (receiver, transports) = await probe_receiver.listen(
+        args.port, args.host, args.capacity, not args.by_port,
+        on_metric=lambda probe, name, record: collector.add(probe, name, record, time.time()))
+    start = time.monotonic()
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            await asyncio.sleep(args.interval)
+            print_summary(collector)
+    finally:
+        for t in transports:
+            t.close()
+    return collector
+
+def print_summary(collector, out=sys.stdout, flagged=10):
+    out.write('%-16s %-10s %7s %9s %10s %10s %10s %10s %10s %8s\n' % (
+        'probe', 'metric', 'buckets', 'summaries', 'min', 'avg', 'p99 avg', 'p99 max', 'max', 'over'))
+    for r in collector.summary():
+        out.write('%-16s %-10s %7d %9d %10.1f %10.1f %10.1f %10.1f %10.1f %8d\n' % (
+            r['probe'], r['metric'], r['buckets'], r['summaries'], r['min'], r['avg'],
+            r['p99'], r['max_p99'], r['max'], r['over_budget']))
+    for (probe, name, t, mx, n) in collector.flagged[:flagged]:
+        out.write('over budget: %s %s at %.3f s, max %.0f us over %d\n' % (probe, name, t, mx, n))
+    if len(collector.flagged) > flagged:
+        out.write('... %d more over budget\n' % (len(collector.flagged) - flagged))
+    out.flush()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Collect $M probe metrics from logs or live into time-bucketed histograms')
+    parser.add_argument('logs', nargs='*', help='recorded logs, one probe each')
+    parser.add_argument('--listen', action='store_true', help='collect live from UDP instead')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument(
+        '--port', type=int, nargs='+', default=[probe_receiver.WIFI_UDP_PORT],
+        help='UDP port(s) to listen on (default: %d)' % probe_receiver.WIFI_UDP_PORT)
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between live reports')
+    parser.add_argument('--duration', type=float, default=None, help='stop listening after this many seconds')
+    parser.add_argument('--capacity', type=int, default=probe_receiver.DEFAULT_CAPACITY)
+    parser.add_argument('--by-port', action='store_true', help='tell probes apart by source port too')
+    parser.add_argument(
+        '--bucket', type=float, default=DEFAULT_BUCKET_SECONDS,
+        help='bucket length in seconds (default: %g)' % DEFAULT_BUCKET_SECONDS)
+    parser.add_argument(
+        '--period', type=float, default=None,
+        help='measurement timer period in us (default: MEASUREMENT_INTERVAL_US of the firmware)')
+    parser.add_argument(
+        '--tolerance', type=float, default=default_tolerance,
+        help='fraction loopint may exceed the period before it is flagged (default: %g)' % default_tolerance)
+    parser.add_argument('--firmware', default=None, help='firmware version to tag the export with')
+    parser.add_argument('--output', default=None, help='write the time series as .npz here')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes for logs (default: one per core)')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    period = args.period or measurement_interval()
+    b = budgets(period, args.tolerance)
+    if args.listen:
+        collector = asyncio.run(collect(args, MetricsCollector(args.bucket, b)))
+    elif args.logs:
+        collector = read_logs(args.logs, args.bucket, b, args.jobs, period)
+        print_summary(collector)
+    else:
+        sys.exit('Nothing to collect: give log files or --listen')
+    if args.output:
+        collector.export(args.output, args.firmware)
+        print('wrote ' + args.output)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import numpy as np
+
+import probe_metrics
+import sentences
+
+########################################################################
+
+# Clock, buckets, histograms and budgets of the $M collector, and the
+# timing of logs with and without $AR sentences.
+
+period = 50000
+
+def record(n, mn, mx, avg):
+    return np.array((n, mn, mx, avg, avg), dtype=sentences.metric_dtype)[()]
+
+def write_log(d, name, lines):
+    path = os.path.join(d, name)
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+def test_clock_carries_on_over_restarts():
+    (times, base, last) = probe_metrics._clock([1000, 2000, 500, 1500], 0.0, 0.0)
+    assert list(times) == [1.0, 2.0, 2.5, 3.5]
+    # A restart between two runs
+    (times, base, last) = probe_metrics._clock([200, 700], base, last)
+    assert list(times) == [3.7, 4.2]
+    assert last == 4.2
+    (times, _, _) = probe_metrics._clock([], base, last)
+    assert len(times) == 0
+
+def test_histogram_percentile():
+    hist = np.zeros(len(probe_metrics.bin_edges) + 1, np.int64)
+    hist[[10, 20, 30]] = [50, 49, 1]
+    assert probe_metrics.histogram_percentile(hist, 0.5) == probe_metrics.bin_edges[10]
+    assert probe_metrics.histogram_percentile(hist, 0.99) == probe_metrics.bin_edges[20]
+    assert probe_metrics.histogram_percentile(hist, 1.0) == probe_metrics.bin_edges[30]
+    assert np.isnan(probe_metrics.histogram_percentile(hist * 0, 0.5))
+
+def test_merged_buckets_add_up():
+    rng = np.random.default_rng(0)
+    # Whole averages, so that totals add up exactly in any order
+    summaries = [
+        (t, record(100, 10.0, mx, 20.0 + i % 7))
+        for (i, (t, mx)) in enumerate(zip(rng.uniform(0, 300, 50), rng.uniform(30, 1000, 50)))
+    ]
+    whole = probe_metrics.MetricsCollector(60)
+    parts = [probe_metrics.MetricsCollector(60) for i in range(3)]
+    for (i, (t, r)) in enumerate(summaries):
+        whole.add('probe', 'looptime', r, t)
+        parts[i % 3].add('probe', 'looptime', r, t)
+    merged = probe_metrics.MetricsCollector(60)
+    for p in parts:
+        merged.merge(p)
+    assert merged.summary() == whole.summary()
+    (s, avg_hist, max_hist) = merged.series('probe', 'looptime')
+    (s0, avg_hist0, max_hist0) = whole.series('probe', 'looptime')
+    assert np.array_equal(s, s0) and np.array_equal(avg_hist, avg_hist0)
+    assert np.array_equal(max_hist, max_hist0)
+    assert list(s['t']) == [0, 60, 120, 180, 240]
+    assert s['summaries'].sum() == 50 and s['n'].sum() == 5000
+
+def test_over_budget():
+    collector = probe_metrics.MetricsCollector(60, probe_metrics.budgets(period, 0.05))
+    collector.add('probe', 'looptime', record(100, 1.0, period + 1.0, 10.0), 1.0)
+    collector.add('probe', 'looptime', record(100, 1.0, period, 10.0), 2.0)
+    collector.add('probe', 'loopint', record(100, 1.0, period * 1.04, period), 3.0)
+    collector.add('probe', 'loopint', record(100, 1.0, period * 1.06, period), 4.0)
+    collector.add('probe', 'dp0_time', record(100, 1.0, period * 2, 10.0), 5.0)
+    assert [(name, t) for (_, name, t, _, _) in collector.flagged] == [
+        ('looptime', 1.0), ('loopint', 4.0)]
+    over = {r['metric']: r['over_budget'] for r in collector.summary()}
+    assert over == {'dp0_time': 0, 'loopint': 1, 'looptime': 1}
+
+def test_serial_log_is_timed_by_position():
+    lines = ['Starting with loaded offsets:  1.00 2.00 3.00']
+    for i in range(5):
+        lines.append(sentences.format_metric('looptime', 100, 1.0, 2.0, 1.5, 1.5))
+        lines.append(sentences.format_metric('loopint', 100, 1.0, 2.0, 1.5, 1.5))
+    with tempfile.TemporaryDirectory() as d:
+        path = write_log(d, 'serial.log', lines)
+        collector = probe_metrics.read_log(path, probe_metrics.MetricsCollector(1), period=period)
+    # 100 measurements of 50 ms each, i.e. 5 s per summary
+    for name in ['looptime', 'loopint']:
+        (s, _, _) = collector.series('serial', name)
+        assert list(s['t']) == [5, 10, 15, 20, 25]
+
+def test_udp_log_is_timed_by_millis():
+    lines = []
+    for i in range(5):
+        lines.append(sentences.format_airdata(i, 0, 0, 0, 0, 0, 5000 * (i + 1)))
+        lines.append(sentences.format_metric('looptime', 100, 1.0, 2.0, 1.5, 1.5))
+    with tempfile.TemporaryDirectory() as d:
+        path = write_log(d, 'udp.log', lines)
+        collector = probe_metrics.read_log(path, probe_metrics.MetricsCollector(1), period=period)
+    (s, _, _) = collector.series('udp', 'looptime')
+    assert list(s['t']) == [5, 10, 15, 20, 25]
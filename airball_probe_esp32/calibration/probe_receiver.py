@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import asyncio
+import sys
+import time
+import numpy as np
+
+import sentences
+
+########################################################################
+
+# Host side receiver for the UDP sentences broadcast by the probe.
+#
+# Every probe (source address) gets its own preallocated ring buffers of
+# $A and $AR records and $M summaries, a tracker of the airdata_count
+# sequence numbers, and latency statistics.
+#
+# Probe millis() and host clocks are not synchronized, so latency is
+# measured relative to the fastest delivery seen: for each $AR sentence
+# we take (host receive time - millis), and report how far it is above
+# the smallest such value observed from that probe. Clock drift between
+# the two is not corrected for, which is fine over runs of minutes.
+
+WIFI_UDP_PORT = 30123
+
+DEFAULT_CAPACITY = 1 << 16
+
+class RingBuffer:
+
+    def __init__(self, dtype, capacity=DEFAULT_CAPACITY):
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.capacity = capacity
+        self.total = 0
+
+    def append(self, record):
+        self.data[self.total % self.capacity] = record
+        self.total += 1
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    # The buffered records, oldest first
+    def values(self):
+        if self.total <= self.capacity:
+            return self.data[:self.total].copy()
+        start = self.total % self.capacity
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+# Tracks a sequence number stream for drops and reordering. A number
+# that skips ahead counts the skipped numbers as dropped; one of those
+# that then arrives late is counted as reordered instead. A number seen
+# before, or never skipped, is a duplicate, and is not counted as
+# received, so received + dropped is the number of distinct numbers
+# sent. A large jump back is taken as the probe restarting. Skipped
+# numbers are remembered back to restart_threshold behind the newest.
+class SequenceTracker:
+
+    def __init__(self, restart_threshold=1000):
+        self.restart_threshold = restart_threshold
+        self.expected = None
+        self.missing = set()
+        self.received = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.duplicates = 0
+        self.restarts = 0
+
+    def add(self, count):
+        if self.expected is None:
+            self.expected = count + 1
+        elif count >= self.expected:
+            self.dropped += count - self.expected
+            self.missing.update(range(max(self.expected, count - self.restart_threshold), count))
+            self.expected = count + 1
+            if len(self.missing) > self.restart_threshold:
+                oldest = self.expected - self.restart_threshold
+                self.missing = {c for c in self.missing if c >= oldest}
+        elif self.expected - count > self.restart_threshold:
+            self.restarts += 1
+            self.missing.clear()
+            self.expected = count + 1
+        elif count in self.missing:
+            self.missing.remove(count)
+            self.reordered += 1
+            self.dropped -= 1
+        else:
+            self.duplicates += 1
+            return
+        self.received += 1
+
+    def summary(self):
+        return {
+            'received': self.received,
+            'dropped': self.dropped,
+            'reordered': self.reordered,
+            'duplicates': self.duplicates,
+            'restarts': self.restarts,
+        }
+
+class ProbeState:
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.raw_airdata = RingBuffer(sentences.raw_airdata_dtype, capacity)
+        self.airdata = RingBuffer(sentences.airdata_dtype, capacity)
+        self.metrics = {}
+        self.raw_airdata_sequence = SequenceTracker()
+        self.airdata_sequence = SequenceTracker()
+        self.delay = RingBuffer(np.float64, capacity)
+        self.min_delay = float('inf')
+        self.unparsed = 0
+
+    # Returns the parsed sentence, or None
+    def add(self, line, received_ms):
+        s = sentences.parse(line)
+        if s is None:
+            self.unparsed += 1
+            return None
+        (kind, record) = s
+        if kind == sentences.AIRDATA:
+            self.airdata.append(record)
+            self.airdata_sequence.add(record[0])
+            delay = received_ms - record[-1]
+            self.min_delay = min(self.min_delay, delay)
+            self.delay.append(delay)
+        elif kind == sentences.RAW_AIRDATA:
+            self.raw_airdata.append(record)
+            self.raw_airdata_sequence.add(record[0])
+        elif kind == sentences.METRIC:
+            (name, values) = record
+            if name not in self.metrics:
+                self.metrics[name] = RingBuffer(sentences.metric_dtype, 1024)
+            self.metrics[name].append(values)
+        return s
+
+    # Latency percentiles (ms) over the buffered $AR sentences
+    def latency(self, percentiles=(50, 90, 99, 100)):
+        if not len(self.delay):
+            return {}
+        d = self.delay.values() - self.min_delay
+        return {'p%g' % p: float(v) for (p, v) in zip(percentiles, np.percentile(d, percentiles))}
+
+    def summary(self):
+        return {
+            'airdata': self.airdata_sequence.summary(),
+            'raw_airdata': self.raw_airdata_sequence.summary(),
+            'latency_ms': self.latency(),
+            'metrics': {k: v.total for (k, v) in self.metrics.items()},
+            'unparsed': self.unparsed,
+        }
+
+########################################################################
+
+# Probes are told apart by source address. A replaying sender on this
+# host sends each simulated probe from its own port, so for local tests
+# use by_host=False to tell probes apart by port as well. on_metric, if
+# given, is called with (probe, name, record) for every $M sentence.
+
+class Receiver(asyncio.DatagramProtocol):
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, by_host=True, on_metric=None):
+        self.capacity = capacity
+        self.by_host = by_host
+        self.on_metric = on_metric
+        self.probes = {}
+
+    def datagram_received(self, data, addr):
+        received_ms = time.monotonic() * 1000.0
+        probe = addr[0] if self.by_host else '%s:%d' % addr[:2]
+        if probe not in self.probes:
+            self.probes[probe] = ProbeState(self.capacity)
+        state = self.probes[probe]
+        for line in data.splitlines():
+            if line:
+                s = state.add(line, received_ms)
+                if s and s[0] == sentences.METRIC and self.on_metric:
+                    self.on_metric(probe, *s[1])
+
+    def summary(self):
+        return {str(k): v.summary() for (k, v) in self.probes.items()}
+
+async def listen(ports, host='0.0.0.0', capacity=DEFAULT_CAPACITY, by_host=True,
+                 on_metric=None):
+    loop = asyncio.get_running_loop()
+    receiver = Receiver(capacity, by_host, on_metric)
+    transports = []
+    for port in ports:
+        (transport, _) = await loop.create_datagram_endpoint(
+            lambda: receiver, local_addr=(host, port), allow_broadcast=True)
+        transports.append(transport)
+    return (receiver, transports)
+
+def print_summary(summary, out=sys.stdout):
+    for (probe, s) in summary.items():
+        a = s['airdata']
+        lat = s['latency_ms']
+        out.write('%s  $AR %d rx %d dropped %d reordered %d dup %d restarts  $A %d rx %d dropped' % (
+            probe, a['received'], a['dropped'], a['reordered'], a['duplicates'], a['restarts'],
+            s['raw_airdata']['received'], s['raw_airdata']['dropped']))
+        if lat:
+            out.write('  latency ms ' + ' '.join(
+                '%s %.1f' % (k, v) for (k, v) in lat.items()))
+        out.write('\n')
+    out.flush()
+
+async def run(args):
+    (receiver, transports) = await listen(
+        args.port, args.host, args.capacity, not args.by_port)
+    start = time.monotonic()
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            await asyncio.sleep(args.interval)
+            print_summary(receiver.summary())
+    finally:
+        for t in transports:
+            t.close()
+    return receiver
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Receive probe sentences over UDP')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument(
+        '--port', type=int, nargs='+', default=[WIFI_UDP_PORT],
+        help='UDP port(s) to listen on (default: %d)' % WIFI_UDP_PORT)
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between reports')
+    parser.add_argument('--duration', type=float, default=None, help='stop after this many seconds')
+    parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help='records kept per probe')
+    parser.add_argument(
+        '--by-port', action='store_true',
+        help='tell probes apart by source port as well as host (for local replay)')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args(sys.argv[1:])))
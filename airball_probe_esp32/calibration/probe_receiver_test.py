@@ -0,0 +1,82 @@
+import asyncio
+import numpy as np
+
+import probe_receiver
+import probe_sender
+
+########################################################################
+
+# Sequence number accounting, and sender and receiver over loopback
+# UDP.
+
+def track(counts, restart_threshold=1000):
+    t = probe_receiver.SequenceTracker(restart_threshold)
+    for c in counts:
+        t.add(c)
+    return t.summary()
+
+def test_in_order():
+    s = track(range(0, 100))
+    assert (s['received'], s['dropped'], s['reordered'], s['duplicates']) == (100, 0, 0, 0)
+
+def test_dropped_and_reordered():
+    s = track([0, 1, 3, 4, 2, 7, 8])
+    assert (s['received'], s['dropped'], s['reordered'], s['duplicates']) == (7, 2, 1, 0)
+
+def test_duplicates_do_not_hide_drops():
+    # 2 is dropped; 1 and 4 arrive twice
+    s = track([0, 1, 1, 3, 4, 4, 5])
+    assert (s['received'], s['dropped'], s['reordered'], s['duplicates']) == (5, 1, 0, 2)
+    # A skipped count arriving twice is reordered once
+    s = track([0, 2, 1, 1, 3])
+    assert (s['received'], s['dropped'], s['reordered'], s['duplicates']) == (4, 0, 1, 1)
+
+def test_restart():
+    s = track([5000, 5001, 0, 1, 2], restart_threshold=100)
+    assert (s['received'], s['dropped'], s['restarts']) == (5, 0, 1)
+
+def test_received_plus_dropped_is_sent():
+    rng = np.random.default_rng(0)
+    sent = np.arange(0, 20000)
+    kept = sent[rng.random(len(sent)) > 0.05]
+    # Swap neighbours, and send some twice
+    swap = 2 * np.flatnonzero(rng.random(len(kept) // 2) < 0.05)
+    kept[swap], kept[swap + 1] = kept[swap + 1], kept[swap].copy()
+    at = np.unique(rng.integers(10, len(kept), 300))
+    stream = np.insert(kept, at, kept[at - rng.integers(1, 10, len(at))])
+    s = track(stream.tolist(), restart_threshold=1000)
+    assert s['restarts'] == 0
+    assert s['duplicates'] == len(at)
+    assert s['received'] == len(np.unique(kept))
+    assert s['received'] + s['dropped'] == len(sent)
+
+# Sender and receiver over loopback UDP, each simulated probe told apart
+# by its port
+async def loopback(lines, probes, reorder, seed=0):
+    (receiver, transports) = await probe_receiver.listen([0], '127.0.0.1', by_host=False)
+    port = transports[0].get_extra_info('sockname')[1]
+    try:
+        await probe_sender.replay(
+            lines, ('127.0.0.1', port), 5000.0, probes,
+            reorder=reorder, seed=seed)
+        await asyncio.sleep(0.2)
+    finally:
+        for t in transports:
+            t.close()
+    return receiver.summary()
+
+def test_loopback():
+    summary = asyncio.run(loopback(probe_sender.synthetic_log(200), 2, 0.2))
+    assert len(summary) == 2
+    for s in summary.values():
+        for kind in ['airdata', 'raw_airdata']:
+            assert (s[kind]['received'], s[kind]['dropped'], s[kind]['duplicates']) == (200, 0, 0)
+        assert s['unparsed'] == 0
+
+def test_loopback_sends_the_last_held_packet():
+    # Every other packet is held back; without the last $AR, that
+    # includes the last $A
+    summary = asyncio.run(loopback(probe_sender.synthetic_log(50)[:-1], 1, 1.0))
+    (s,) = summary.values()
+    assert s['raw_airdata']['received'] == 50
+    assert s['airdata']['received'] == 49
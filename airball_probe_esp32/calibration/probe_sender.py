@@ -0,0 +1,134 @@
+#!/usr/bin/python
+# coding=utf-8
+
+import argparse
+import asyncio
+import math
+import random
+import socket
+import sys
+import time
+
+import sentences
+
+########################################################################
+
+# Local stand-in for one or more probes, for exercising probe_receiver.
+#
+# Replays the $A / $AR / $M sentences of recorded logs (or synthetic
+# ones) over UDP at a chosen rate, each simulated probe sending from its
+# own socket. By default sequence counts and millis() timestamps are
+# rewritten as a live probe would produce them, so the receiver sees a
+# continuous stream and meaningful latencies. Packets can be dropped or
+# swapped at random to check the receiver's accounting.
+
+def read_log(path):
+    with open(path, 'r', errors='replace') as f:
+        return [l.strip() for l in f if l.startswith('$')]
+
+def synthetic_log(n):
+    lines = []
+    for i in range(0, n):
+        t = i / 20.0
+        alpha = 5 + 3 * math.sin(t / 3)
+        beta = 2 * math.sin(t / 5)
+        q = 1500 + 100 * math.sin(t / 7)
+        lines.append(sentences.format_raw_airdata(
+            i, 101325.0, 15.0, q * 0.8, q * 0.03 * alpha, q * 0.03 * beta))
+        lines.append(sentences.format_airdata(
+            i, alpha, beta, q, 101325.0, 15.0, int(t * 1000)))
+    return lines
+
+# Rewrite counts and millis() of a log for replay. Sentences of one
+# measurement cycle ($A then $AR) share a count, as on the probe.
+class Restamper:
+
+    def __init__(self, start):
+        self.start = start
+        self.count = 0
+
+    def __call__(self, line):
+        s = sentences.parse(line)
+        if s is None:
+            return line
+        (kind, r) = s
+        if kind == sentences.RAW_AIRDATA:
+            return sentences.format_raw_airdata(self.count, *r[1:])
+        if kind == sentences.AIRDATA:
+            millis = int((time.monotonic() - self.start) * 1000)
+            line = sentences.format_airdata(self.count, *r[1:-1], millis)
+            self.count += 1
+        return line
+
+async def replay(lines, target, rate, probes=1, loops=1,
+                 restamp=True, drop=0.0, reorder=0.0, seed=0):
+    rng = random.Random(seed)
+    start = time.monotonic()
+    socks = []
+    for i in range(0, probes):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        s.setblocking(False)
+        socks.append(s)
+    stamps = [Restamper(start) if restamp else (lambda l: l) for s in socks]
+    held = [None] * probes
+
+    def send(i, line):
+        if rng.random() < drop:
+            return
+        if held[i] is None and rng.random() < reorder:
+            held[i] = line
+            return
+        socks[i].sendto(line.encode('ascii'), target)
+        if held[i] is not None:
+            socks[i].sendto(held[i].encode('ascii'), target)
+            held[i] = None
+
+    total = len(lines) * loops
+    sent = 0
+    try:
+        while sent < total:
+            due = min(total, int((time.monotonic() - start) * rate) + 1)
+            while sent < due:
+                line = lines[sent % len(lines)]
+                for i in range(0, probes):
+                    send(i, stamps[i](line))
+                sent += 1
+            await asyncio.sleep(min(0.01, 1.0 / rate))
+    finally:
+        # A packet still held back goes out last rather than being lost
+        for (i, s) in enumerate(socks):
+            if held[i] is not None:
+                s.sendto(held[i].encode('ascii'), target)
+            s.close()
+    return sent
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Replay probe sentences over UDP')
+    parser.add_argument('logs', nargs='*', help='recorded logs to replay')
+    parser.add_argument('--synthetic', type=int, default=0, help='also replay this many synthetic cycles')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=30123)
+    parser.add_argument('--rate', type=float, default=40.0, help='sentences per second per probe')
+    parser.add_argument('--probes', type=int, default=1, help='number of simulated probes')
+    parser.add_argument('--loops', type=int, default=1, help='times to replay the logs')
+    parser.add_argument('--no-restamp', action='store_true', help='send counts and millis as recorded')
+    parser.add_argument('--drop', type=float, default=0.0, help='probability of dropping a packet')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability of delaying a packet by one')
+    return parser.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    lines = []
+    for path in args.logs:
+        lines += read_log(path)
+    lines += synthetic_log(args.synthetic)
+    if not lines:
+        sys.exit('Nothing to send: give log files or --synthetic N')
+    sent = asyncio.run(replay(
+        lines, (args.host, args.port), args.rate, args.probes, args.loops,
+        not args.no_restamp, args.drop, args.reorder))
+    print('sent %d sentences from each of %d probes' % (sent, args.probes))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,18 +1,14 @@
 #!/usr/bin/python
 # coding=utf-8
 
-import operator
-import csv
-import matplotlib
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 import math
 import numpy as np
-import scipy.optimize as spo
-import jinja2
-import sys
+import instrument
 import sweep
+import sweep_cache
 import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 
 __all__ = [
     'pressure_channel_names',
@@ -20,6 +16,7 @@ __all__ = [
     'deltas',
     'ratios',
     'ratios_pos',
+    'SweepDataset',
 ]
 
 ########################################################################
@@ -46,7 +43,8 @@ raw_data_files = [
     'c02_10.csv',
     'c03_10.csv',
 ]
-raw_data_dir = 'raw_data'
+raw_data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'raw_data')
+cal_file = os.path.join(raw_data_dir, 'esp32_scanner.cal')
 
 ########################################################################
 
@@ -64,33 +62,179 @@ raw_pressures = [
 
 pressure_channel_names = raw_pressures
 
-def restrict(alpha, beta):
-    return abs(beta) <= 30
+restrict_limits = {
+    'max_abs_beta': 30,
+}
 
-def read_data(csv_file_name):
+restrict = sweep.alphabeta_limits(**restrict_limits)
 
-    d = {
-        'alpha': np.array([]),
-        'beta': np.array([]),
-    }
+########################################################################
+
+# Columnar storage for sweep data. Raw columns are held in preallocated
+# arrays; derived columns (deltas, ratios, and the positive quadrant
+# fold) are computed on first use from the raw columns and cached, so a
+# dataset keeps one copy of each column no matter how many views of it
+# are in use.
+
+def _sign(x):
+    return np.where(x < 0, -1, 1).astype(x.dtype)
+
+derived_columns = {
+    'dp0': lambda d: d['c'] - d['s'],
+    'dpa': lambda d: d['d'] - d['u'],
+    'dpb': lambda d: d['r'] - d['l'],
+    'minus_s': lambda d: -d['s'],
+    'dpa_over_dp0': lambda d: d['dpa'] / d['dp0'],
+    'dpb_over_dp0': lambda d: d['dpb'] / d['dp0'],
+    'q_over_dp0': lambda d: 1 / d['dp0'],
+    'minus_s_over_dp0': lambda d: d['minus_s'] / d['dp0'],
+    'abs_alpha': lambda d: np.abs(d['alpha']),
+    'abs_beta': lambda d: np.abs(d['beta']),
+    'pos_dpa_over_dp0': lambda d: d['dpa_over_dp0'] * _sign(d['alpha']),
+    'pos_dpb_over_dp0': lambda d: d['dpb_over_dp0'] * _sign(d['beta']),
+}
+
+# Rows also carry the index, into run_names, of the tunnel run (sweep
+# file) they come from, e.g. for cross-validation across runs.
+
+class SweepDataset(Mapping):
+
+    columns = ['alpha', 'beta'] + raw_pressures
+
+    def __init__(self, n, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self._raw = {k: np.empty(n, dtype=self.dtype) for k in self.columns}
+        self._derived = {}
+        self.run = np.zeros(n, dtype=np.int16)
+        self.run_names = ['']
+
+    @classmethod
+    def from_columns(cls, columns, dtype=np.float64):
+        n = len(columns[cls.columns[0]])
+        d = cls(n, dtype)
+        for k in cls.columns:
+            d._raw[k][:] = columns[k]
+        return d
+
+    @classmethod
+    def concatenate(cls, datasets):
+        datasets = list(datasets)
+        dtype = np.result_type(*[d.dtype for d in datasets])
+        r = cls(sum(len(d) for d in datasets), dtype)
+        for k in cls.columns:
+            np.concatenate([d._raw[k] for d in datasets], out=r._raw[k])
+        offsets = np.cumsum([0] + [len(d.run_names) for d in datasets])
+        np.concatenate([d.run + o for (d, o) in zip(datasets, offsets)], out=r.run)
+        r.run_names = [name for d in datasets for name in d.run_names]
+        return r
+
+    def filter(self, mask):
+        r = SweepDataset(0, self.dtype)
+        r._raw = {k: v[mask] for k, v in self._raw.items()}
+        r.run = self.run[mask]
+        r.run_names = list(self.run_names)
+        return r
+
+    def view(self, names):
+        return SweepView(self, names)
+
+    def __getitem__(self, k):
+        if k in self._raw:
+            return self._raw[k]
+        if k not in self._derived:
+            if k not in derived_columns:
+                raise KeyError(k)
+            self._derived[k] = derived_columns[k](self)
+        return self._derived[k]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self._raw[self.columns[0]])
+
+# A named subset of the columns of a dataset, optionally renamed. This
+# gives the classic pressures / deltas / ratios / ratios_pos tables
+# without copying any data.
+
+class SweepView(Mapping):
+
+    def __init__(self, dataset, names):
+        if not isinstance(names, dict):
+            names = {k: k for k in names}
+        self.dataset = dataset
+        self.names = names
 
-    for p in raw_pressures:
-        d[p] = np.array([])
+    def __getitem__(self, k):
+        return self.dataset[self.names[k]]
 
-    (data, _) = sweep.read_channels(
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+########################################################################
+
+def read_data(csv_file_name, dtype=np.float64):
+
+    (data, _) = sweep_cache.read_channels(
         os.path.join(raw_data_dir, csv_file_name),
-        os.path.join(raw_data_dir, 'esp32_scanner.cal'))
-
-    data = data.restrict_alphabeta(restrict)
-
-    for i in range(0, len(data.alpha)):
-        d['alpha'] = np.append(d['alpha'], int(data.alpha[i]))
-        d['beta'] = np.append(d['beta'], int(data.beta[i]))
-        for chan in range(0, len(raw_pressures)):
-            d[raw_pressures[chan]] = np.append(
-                d[raw_pressures[chan]],
-                float(data[chan + 1][i]))
-                
+        cal_file,
+        restrict_limits)
+
+    return from_channels(data, dtype)
+
+def _fill(d, start, data):
+    end = start + len(data.alpha)
+    d['alpha'][start:end] = np.trunc(data.alpha)
+    d['beta'][start:end] = np.trunc(data.beta)
+    for chan in range(0, len(raw_pressures)):
+        d[raw_pressures[chan]][start:end] = data[chan + 1]
+    return end
+
+# Build a dataset from the sweep.Channels of one file
+def from_channels(data, dtype=np.float64):
+    d = SweepDataset(len(data.alpha), dtype)
+    _fill(d, 0, data)
+    return d
+
+# Read several sweep files into one dataset. Files not yet in the sweep
+# cache are parsed in a process pool, one file per worker; workers write
+# the cache and return only their point counts, and the parent maps the
+# cached arrays and copies them once, into a dataset allocated at full
+# size. The parse stage is timed here, around the pool, as the workers'
+# own records never reach this process.
+def read_files(files, dtype=np.float64, workers=None):
+    paths = [os.path.join(raw_data_dir, f) for f in files]
+    entries = [sweep_cache.lookup(p, cal_file, restrict_limits) for p in paths]
+    missing = [(p, e) for (p, (e, exists)) in zip(paths, entries) if not exists]
+
+    workers = min(workers or os.cpu_count() or 1, len(missing))
+    if missing:
+        with instrument.stage('parse') as s:
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    parsed = list(pool.map(
+                        sweep_cache.build,
+                        [p for (p, e) in missing],
+                        [cal_file] * len(missing),
+                        [restrict_limits] * len(missing),
+                        [e for (p, e) in missing]))
+            else:
+                parsed = [sweep_cache.build(p, cal_file, restrict_limits, e) for (p, e) in missing]
+            s['rows'] = sum(parsed)
+
+    channels = [
+        sweep_cache.load(e, p)[0] for (p, (e, _)) in zip(paths, entries)
+    ]
+    d = SweepDataset(sum(len(c.alpha) for c in channels), dtype)
+    d.run_names = list(files)
+    start = 0
+    for (i, c) in enumerate(channels):
+        end = _fill(d, start, c)
+        d.run[start:end] = i
+        start = end
     return d
 
 ########################################################################
@@ -103,22 +247,35 @@ def tuples(data):
             t[k] = data[k][i]
         yield t
 
-def filter(data, f):
-    r = {}
-    for k in data:
-        r[k] = np.array([])
-    for t in tuples(data):
-        if f(t):
-            for k in data:
-                r[k] = np.append(r[k], t[k])
-    return r
+# The rows of data where f is true. By default f is given all the
+# columns at once and returns a boolean mask, e.g.
+# lambda d: np.abs(d['alpha']) < 10. With by='rows', f is called on each
+# row in turn (a dict of scalars, as from tuples()), which is much
+# slower; it is there for predicates that cannot work on arrays.
+def filter(data, f, by='columns'):
+    if not isinstance(data, SweepDataset):
+        data = {k: np.asarray(data[k]) for k in data}
+    n = len(data[list(data.keys())[0]])
+    if by == 'columns':
+        mask = np.asarray(f(data), dtype=bool)
+        if mask.shape != (n,):
+            raise ValueError('Filter returned shape %s for %d rows' % (mask.shape, n))
+    elif by == 'rows':
+        mask = np.fromiter((bool(f(t)) for t in tuples(data)), dtype=bool, count=n)
+    else:
+        raise ValueError('Unknown filter mode %r' % (by,))
+    if isinstance(data, SweepDataset):
+        return data.filter(mask)
+    return {k: np.asarray(data[k])[mask] for k in data}
 
 def combine(d0, d1):
-    if d0 == None: return d1
+    if d0 is None: return d1
     k0 = [k for k in d0]
     k1 = [k for k in d1]
-    if not k0 == k1: raise 'Cannot merge incompatible colums'    
-    return {k: np.append(d0[k], d1[k]) for k in d0}
+    if not k0 == k1: raise ValueError('Cannot merge incompatible colums')
+    if isinstance(d0, SweepDataset) and isinstance(d1, SweepDataset):
+        return SweepDataset.concatenate([d0, d1])
+    return {k: np.concatenate((d0[k], d1[k])) for k in d0}
 
 def distance(x, y):
     return math.sqrt(math.pow(x, 2) + math.pow(y, 2))
@@ -129,41 +286,53 @@ def sign(x):
 
 ########################################################################
 
-raw_data = None
-for f in raw_data_files:
-    raw_data = combine(raw_data, read_data(f))
-
-pressures = raw_data
-    
-deltas = {
-    'alpha': raw_data['alpha'],
-    'beta': raw_data['beta'],
-    'dp0': raw_data['c'] - raw_data['s'],
-    'dpa' : raw_data['d'] - raw_data['u'],
-    'dpb': raw_data['r'] - raw_data['l'],
-    'minus_s': raw_data['s'] * -1,
-}
-
-ratios = {
-    'alpha': deltas['alpha'],
-    'beta': deltas['beta'],
-    'dpa_over_dp0': deltas['dpa'] / deltas['dp0'],
-    'dpb_over_dp0': deltas['dpb'] / deltas['dp0'],
-    'q_over_dp0': 1 / deltas['dp0'],
-    'minus_s_over_dp0': deltas['minus_s'] / deltas['dp0'],
-}
+# Loading is done on demand: importing this module does no work. The
+# classic module attributes (raw_data.pressures, raw_data.deltas, ...)
+# are still available and trigger a load on first access.
 
-ratios_pos = {
-    'alpha': np.abs(ratios['alpha']),
-    'beta': np.abs(ratios['beta']),
-    'dpa_over_dp0': np.array([
-            ratios['dpa_over_dp0'][i] * sign(ratios['alpha'][i])
-            for i in range(0, len(ratios['alpha']))
+def views(dataset):
+    return {
+        'pressures': dataset.view(['alpha', 'beta'] + raw_pressures),
+        'deltas': dataset.view([
+            'alpha',
+            'beta',
+            'dp0',
+            'dpa',
+            'dpb',
+            'minus_s',
         ]),
-    'dpb_over_dp0': np.array([
-            ratios['dpb_over_dp0'][i] * sign(ratios['beta'][i])
-            for i in range(0, len(ratios['beta']))
+        'ratios': dataset.view([
+            'alpha',
+            'beta',
+            'dpa_over_dp0',
+            'dpb_over_dp0',
+            'q_over_dp0',
+            'minus_s_over_dp0',
         ]),
-    'q_over_dp0': ratios['q_over_dp0'],
-    'minus_s_over_dp0': ratios['minus_s_over_dp0'],
-}
+        'ratios_pos': dataset.view({
+            'alpha': 'abs_alpha',
+            'beta': 'abs_beta',
+            'dpa_over_dp0': 'pos_dpa_over_dp0',
+            'dpb_over_dp0': 'pos_dpb_over_dp0',
+            'q_over_dp0': 'q_over_dp0',
+            'minus_s_over_dp0': 'minus_s_over_dp0',
+        }),
+    }
+
+_loaded = {}
+
+def load(files=None, dtype=np.float64, workers=None):
+    files = tuple(files or raw_data_files)
+    key = (files, np.dtype(dtype))
+    if key not in _loaded:
+        with instrument.stage('load') as s:
+            _loaded[key] = read_files(files, dtype, workers)
+            s['rows'] = len(_loaded[key])
+    return _loaded[key]
+
+def __getattr__(name):
+    if name == 'raw_data':
+        return load()
+    if name in ('pressures', 'deltas', 'ratios', 'ratios_pos'):
+        return views(load())[name]
+    raise AttributeError(name)
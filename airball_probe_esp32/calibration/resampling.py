@@ -0,0 +1,174 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import fitting
+from plotting import pyplot, ensure_dir
+
+########################################################################
+
+# Stability of the probe models under resampling of the tunnel data.
+#
+# bootstrap() refits every model to many bootstrap replicates of the
+# data, drawn either row by row or, with by='runs', whole tunnel runs
+# at a time (so that run to run differences, such as a probe remounted
+# between runs, show up in the spread). Replicates are row weights, so a
+# batch of them is solved at once by fitting.fit_weighted, and batches
+# are spread over a process pool. bands() turns the refitted
+# coefficients into pointwise confidence bands of the fitted surfaces.
+#
+# cross_validate() fits each model with one run left out and measures
+# its error on the run that was left out.
+
+DEFAULT_REPLICATES = 2000
+
+# Replicates per task sent to a worker
+BATCH = 100
+
+########################################################################
+
+def _run_index(run):
+    (names, index) = np.unique(run, return_inverse=True)
+    return (len(names), index)
+
+# Row weights of count bootstrap replicates
+def bootstrap_weights(n, count, rng, run=None):
+    if run is None:
+        return rng.multinomial(n, np.full(n, 1.0 / n), size=count).astype(np.float64)
+    (runs, index) = _run_index(run)
+    drawn = rng.multinomial(runs, np.full(runs, 1.0 / runs), size=count)
+    return drawn[:, index].astype(np.float64)
+
+def _bootstrap_batch(models, x, y, targets, count, seed, run):
+    weights = bootstrap_weights(len(x), count, np.random.default_rng(seed), run)
+    return {
+        k: fitting.fit_weighted(models[k], x, y, targets[k], weights)
+        for k in models
+    }
+
+# Coefficients of each model fitted to each replicate, as a dict from
+# model name to a (replicates, terms) array
+def bootstrap(models, x, y, targets, replicates=DEFAULT_REPLICATES,
+              seed=0, run=None, workers=None):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    targets = {k: np.asarray(targets[k], dtype=np.float64) for k in models}
+    counts = [min(BATCH, replicates - i) for i in range(0, replicates, BATCH)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    args = [(models, x, y, targets, c, s, run) for (c, s) in zip(counts, seeds)]
+    workers = min(workers or os.cpu_count() or 1, len(args))
+    if workers == 1:
+        parts = [_bootstrap_batch(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_bootstrap_batch, *zip(*args)))
+    return {k: np.concatenate([p[k] for p in parts]) for k in models}
+
+########################################################################
+
+# Pointwise confidence bands of the fitted surfaces on the grid (x, y),
+# from bootstrap coefficients. For each model: the central estimate (the
+# fit to all the data, if fits are given, else the bootstrap median),
+# the lower and upper band limits, and the bootstrap standard deviation.
+def bands(models, coefs, x, y, level=0.95, fits=None):
+    r = {}
+    for k in models:
+        A = models[k].design(x, y)
+        v = A @ coefs[k].T
+        (lo, mid, hi) = np.percentile(
+            v, [50 * (1 - level), 50, 50 * (1 + level)], axis=-1)
+        r[k] = {
+            'center': fits[k](x, y) if fits else mid,
+            'lower': lo,
+            'upper': hi,
+            'std': np.std(v, axis=-1),
+        }
+    return r
+
+def band_summary(b):
+    half = (b['upper'] - b['lower']) / 2
+    i = np.unravel_index(np.argmax(half), half.shape)
+    return {
+        'mean_half_width': float(np.mean(half)),
+        'max_half_width': float(half[i]),
+        'max_at': [int(j) for j in i],
+        'max_std': float(np.max(b['std'])),
+    }
+
+def coefficient_summary(model, coef, fit=None):
+    return [
+        {
+            'term': list(t),
+            'value': float(fit.coef[j]) if fit else float(np.median(coef[:, j])),
+            'std': float(np.std(coef[:, j])),
+        }
+        for (j, t) in enumerate(model.terms)
+    ]
+
+########################################################################
+
+# Leave one run out cross-validation. For each model and each run, the
+# model is fitted to the other runs and its errors are measured on the
+# held out run. Returns, for each model, the per-run RMS and maximum
+# errors and their pooled RMS, beside the RMS residual of a fit to all
+# the data.
+def cross_validate(models, x, y, targets, run, run_names=None):
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    runs = np.unique(run)
+    if len(runs) < 2:
+        raise ValueError('cross-validation needs data from at least two runs')
+    weights = np.stack([(run != r).astype(np.float64) for r in runs] +
+                       [np.ones(len(x))])
+    result = {}
+    for k in models:
+        z = np.asarray(targets[k], dtype=np.float64)
+        coef = fitting.fit_weighted(models[k], x, y, z, weights)
+        A = models[k].design(x, y)
+        per_run = {}
+        squares = 0.0
+        for (i, r) in enumerate(runs):
+            held = run == r
+            e = A[held] @ coef[i] - z[held]
+            squares += float(np.sum(np.square(e)))
+            name = run_names[r] if run_names else str(r)
+            per_run[name] = {
+                'rows': int(np.sum(held)),
+                'rms_error': float(np.sqrt(np.mean(np.square(e)))),
+                'max_error': float(np.max(np.abs(e))),
+            }
+        result[k] = {
+            'train_rms': float(np.sqrt(np.mean(np.square(A @ coef[-1] - z)))),
+            'cv_rms': float(np.sqrt(squares / len(x))),
+            'runs': per_run,
+        }
+    return result
+
+########################################################################
+
+def plot_band(name, x, y, b, level, path):
+    plt = pyplot()
+    fig, axes = plt.subplots(1, 2, figsize=(12, 5))
+    panels = [
+        ('%s: %g%% band half width' % (name, 100 * level), (b['upper'] - b['lower']) / 2),
+        ('%s: bootstrap std' % name, b['std']),
+    ]
+    for (ax, (title, v)) in zip(axes, panels):
+        mesh = ax.pcolormesh(x, y, v, cmap='viridis', shading='nearest')
+        ax.set_title(title)
+        ax.set_xlabel('dpa_over_dp0')
+        ax.set_ylabel('dpb_over_dp0')
+        fig.colorbar(mesh, ax=ax)
+    fig.tight_layout()
+    plt.savefig(path, dpi=150)
+    plt.close()
+    return path
+
+def plot_bands(x, y, bands, level, queue, directory):
+    ensure_dir(directory)
+    (xs, ys) = (queue.share(x), queue.share(y))
+    for name in bands:
+        b = {k: queue.share(v) for (k, v) in bands[name].items()}
+        queue.submit(
+            plot_band, name, xs, ys, b, level,
+            os.path.join(directory, 'bootstrap_' + name + '.png'))
@@ -0,0 +1,67 @@
+import numpy as np
+
+import fitting
+import resampling
+
+########################################################################
+
+# Bootstrap and cross-validation on data whose answers are known.
+
+def data(seed=0, n=400, noise=0.0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-1, 1, n)
+    y = rng.uniform(-1, 1, n)
+    z = 1 + 2 * x - y + 0.5 * x * y
+    return (x, y, z + rng.normal(0, noise, n))
+
+models = {'z': fitting.LinearModel([(0, 0), (1, 0), (0, 1), (1, 1)])}
+
+def test_bootstrap_weights():
+    rng = np.random.default_rng(0)
+    w = resampling.bootstrap_weights(50, 20, rng)
+    assert w.shape == (20, 50)
+    np.testing.assert_equal(w.sum(axis=1), 50)
+    run = np.repeat([3, 1, 2], [10, 15, 25])
+    w = resampling.bootstrap_weights(50, 20, rng, run)
+    for r in [1, 2, 3]:
+        assert np.all(w[:, run == r] == w[:, run == r][:, :1])
+    # Whole runs are drawn, three of them in each replicate
+    counts = w[:, [0, 10, 25]]
+    np.testing.assert_equal(counts.sum(axis=1), 3)
+
+def test_bootstrap_of_exact_data():
+    (x, y, z) = data()
+    coefs = resampling.bootstrap(models, x, y, {'z': z}, replicates=50, workers=1)
+    np.testing.assert_allclose(coefs['z'], np.tile([1, 2, -1, 0.5], (50, 1)), atol=1e-12)
+    b = resampling.bands(models, coefs, np.array([0.0, 0.5]), np.array([0.0, -0.5]))['z']
+    np.testing.assert_allclose(b['lower'], b['upper'], atol=1e-12)
+    np.testing.assert_allclose(b['center'], [1, 1 + 1 + 0.5 - 0.125], atol=1e-12)
+
+def test_bootstrap_spread():
+    rng = np.random.default_rng(1)
+    z = rng.normal(5, 2, 1000)
+    x = np.zeros(len(z))
+    mean = {'z': fitting.LinearModel([(0, 0)])}
+    coefs = resampling.bootstrap(mean, x, x, {'z': z}, replicates=2000, seed=2, workers=1)
+    # The standard error of the mean
+    np.testing.assert_allclose(np.std(coefs['z']), np.std(z) / np.sqrt(len(z)), rtol=0.1)
+
+def test_bootstrap_does_not_depend_on_workers():
+    (x, y, z) = data(noise=0.1)
+    one = resampling.bootstrap(models, x, y, {'z': z}, replicates=250, workers=1)
+    two = resampling.bootstrap(models, x, y, {'z': z}, replicates=250, workers=2)
+    np.testing.assert_equal(one['z'], two['z'])
+
+def test_cross_validate():
+    n = 30
+    x = np.zeros(2 * n)
+    z = np.repeat([0.0, 1.0], n)
+    run = np.repeat([0, 1], n)
+    mean = {'z': fitting.LinearModel([(0, 0)])}
+    r = resampling.cross_validate(mean, x, x, {'z': z}, run, ['a', 'b'])['z']
+    # Each run is predicted by the mean of the other
+    assert r['runs'] == {
+        'a': {'rows': n, 'rms_error': 1.0, 'max_error': 1.0},
+        'b': {'rows': n, 'rms_error': 1.0, 'max_error': 1.0},
+    }
+    np.testing.assert_allclose([r['cv_rms'], r['train_rms']], [1.0, 0.5])
@@ -0,0 +1,81 @@
+import numpy as np
+
+########################################################################
+
+# Sentences sent by the probe firmware (see airball_probe_esp32.ino and
+# metric.h):
+#
+#   $A,count,baro,temp,dp0,dpa,dpb            raw airdata
+#   $AR,count,alpha,beta,q,p,temp,millis      computed airdata
+#   $M,name,<name>,n,<n>,min,<min>,max,<max>,avg,<avg>,lat,<lat>
+#                                             metric summary (microseconds)
+#
+# Each record type has a NumPy dtype, so records can be kept in arrays.
+
+raw_airdata_dtype = np.dtype([
+    ('count', np.int64),
+    ('baro', np.float64),
+    ('temp', np.float64),
+    ('dp0', np.float64),
+    ('dpa', np.float64),
+    ('dpb', np.float64),
+])
+
+airdata_dtype = np.dtype([
+    ('count', np.int64),
+    ('alpha', np.float64),
+    ('beta', np.float64),
+    ('q', np.float64),
+    ('p', np.float64),
+    ('temp', np.float64),
+    ('millis', np.int64),
+])
+
+metric_dtype = np.dtype([
+    ('n', np.int64),
+    ('min', np.float64),
+    ('max', np.float64),
+    ('avg', np.float64),
+    ('lat', np.float64),
+])
+
+RAW_AIRDATA = '$A'
+AIRDATA = '$AR'
+METRIC = '$M'
+
+def _fields(dtype, values):
+    return tuple(
+        int(v) if dtype[i].kind == 'i' else float(v)
+        for (i, v) in enumerate(values))
+
+# Parse one sentence. Returns (kind, record) for raw airdata and
+# airdata, (kind, (name, record)) for metrics, and None for anything
+# that is not a well formed probe sentence.
+def parse(line):
+    if isinstance(line, bytes):
+        line = line.decode('ascii', 'replace')
+    f = line.strip().split(',')
+    try:
+        if f[0] == AIRDATA and len(f) == 8:
+            return (AIRDATA, _fields(airdata_dtype, f[1:]))
+        if f[0] == RAW_AIRDATA and len(f) == 7:
+            return (RAW_AIRDATA, _fields(raw_airdata_dtype, f[1:]))
+        if f[0] == METRIC and len(f) == 13 and f[1] == 'name':
+            values = dict(zip(f[3::2], f[4::2]))
+            return (METRIC, (f[2], _fields(
+                metric_dtype, [values[k] for k in metric_dtype.names])))
+    except (ValueError, KeyError):
+        pass
+    return None
+
+def format_raw_airdata(count, baro, temp, dp0, dpa, dpb):
+    return '$A,%d,%10.6f,%10.6f,%10.6f,%10.6f,%10.6f' % (
+        count, baro, temp, dp0, dpa, dpb)
+
+def format_airdata(count, alpha, beta, q, p, temp, millis):
+    return '$AR,%d,%10.6f,%10.6f,%10.6f,%10.6f,%10.6f,%d' % (
+        count, alpha, beta, q, p, temp, millis)
+
+def format_metric(name, n, min, max, avg, lat):
+    return '$M,name,%s,n,%d,min,%f,max,%f,avg,%f,lat,%f' % (
+        name, n, min, max, avg, lat)
@@ -1,5 +1,7 @@
 from calibration import Calibration
 from pathlib import Path
+import os
+import warnings
 import numpy
 import pprint
 
@@ -7,112 +9,315 @@ import pprint
 NUM_CHANNELS = 8
 
 
+# Samples grouped by tunnel grid point. The samples are held sorted by
+# group, group g occupying rows offsets[g] up to offsets[g + 1], and
+# keys[g] is its (alpha, beta). Groups are numbered in order of first
+# appearance. Per-group reductions work on all channels at once.
+class GroupIndex:
+
+    def __init__(self, keys, offsets):
+        self.keys = keys
+        self.offsets = offsets
+        self._lookup = None
+
+    # Returns (index, order) such that samples[order] is sorted by group
+    @classmethod
+    def build(cls, alphabeta):
+        keys, first, inverse = numpy.unique(
+            alphabeta, axis=0, return_index=True, return_inverse=True)
+        by_appearance = numpy.argsort(first, kind='stable')
+        rank = numpy.empty_like(by_appearance)
+        rank[by_appearance] = numpy.arange(len(by_appearance))
+        group = rank[inverse.reshape(-1)]
+        order = numpy.argsort(group, kind='stable')
+        counts = numpy.bincount(group, minlength=len(keys))
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts)))
+        return (cls(keys[by_appearance], offsets), order)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def counts(self):
+        return numpy.diff(self.offsets)
+
+    def find(self, alpha, beta):
+        if self._lookup is None:
+            self._lookup = {
+                (float(k[0]), float(k[1])): g for (g, k) in enumerate(self.keys)
+            }
+        return self._lookup[(float(alpha), float(beta))]
+
+    def rows(self, g):
+        return slice(self.offsets[g], self.offsets[g + 1])
+
+    # The first sample of each group, in file order
+    def first(self, values):
+        return values[self.offsets[:-1]]
+
+    def sum(self, values):
+        return numpy.add.reduceat(values, self.offsets[:-1], axis=0)
+
+    def mean(self, values):
+        return self.sum(values) / self._column(self.counts())
+
+    # Sum of squared deviations from the group mean
+    def m2(self, values, mean=None):
+        if mean is None:
+            mean = self.mean(values)
+        residual = values - numpy.repeat(mean, self.counts(), axis=0)
+        return self.sum(residual * residual)
+
+    def std(self, values):
+        return numpy.sqrt(self.m2(values) / self._column(self.counts()))
+
+    def min(self, values):
+        return numpy.minimum.reduceat(values, self.offsets[:-1], axis=0)
+
+    def max(self, values):
+        return numpy.maximum.reduceat(values, self.offsets[:-1], axis=0)
+
+    def asymmetry(self, values):
+        return self.max(values) - self.min(values)
+
+    @staticmethod
+    def _column(x):
+        return x[:, numpy.newaxis]
+
+
+# Per-point values of all channels. Channel arrays are columns of one
+# (points x NUM_CHANNELS) array, and derived Channels (quadrant folds,
+# restrictions) share or slice it rather than copying point by point.
 class Channels(dict):
 
-    def __init__(self, label):
+    def __init__(self, label, alpha=(), beta=(), values=None):
         self.label = label
-        self.alpha = []
-        self.beta = []
+        self.alpha = numpy.asarray(alpha, dtype=numpy.float64)
+        self.beta = numpy.asarray(beta, dtype=numpy.float64)
+        if values is None:
+            values = numpy.zeros((len(self.alpha), NUM_CHANNELS))
+        self._index = None
         for chan in range(0, NUM_CHANNELS):
-            self[chan] = []
+            self[chan] = values[:, chan]
 
-    def abs_alpha(self):
-        d = Channels(self.label + '.abs_alpha')
-        d.alpha = map(abs, self.alpha)
-        d.beta = self.beta
+    # All channels as one (points x NUM_CHANNELS) array
+    def as_array(self):
+        return numpy.column_stack([self[chan] for chan in range(0, NUM_CHANNELS)])
+
+    # Channel values at one tunnel grid point
+    def point(self, alpha, beta):
+        if self._index is None:
+            self._index = {
+                (float(a), float(b)): i
+                for (i, (a, b)) in enumerate(zip(self.alpha, self.beta))
+            }
+        i = self._index[(float(alpha), float(beta))]
+        return numpy.array([self[chan][i] for chan in range(0, NUM_CHANNELS)])
+
+    def _remap(self, label, alpha, beta):
+        d = Channels(label, alpha, beta)
         for chan in range(0, NUM_CHANNELS):
             d[chan] = self[chan]
         return d
 
+    def abs_alpha(self):
+        return self._remap(self.label + '.abs_alpha', numpy.abs(self.alpha), self.beta)
+
     def abs_beta(self):
-        d = Channels(self.label + '.abs_beta')
-        d.alpha = self.alpha
-        d.beta = map(abs, self.beta)
-        for chan in range(0, NUM_CHANNELS):
-            d[chan] = self[chan]
-        return d
+        return self._remap(self.label + '.abs_beta', self.alpha, numpy.abs(self.beta))
 
+    # f is called once with the alpha and beta arrays if it accepts them
+    # (as alphabeta_limits does), else point by point.
     def restrict_alphabeta(self, f):
-        d = Channels(self.label + '.restrict')
-        for i in range(0, len(self.alpha)):
-            if f(self.alpha[i], self.beta[i]):
-                d.alpha.append(self.alpha[i])
-                d.beta.append(self.beta[i])
-                for chan in range(0, NUM_CHANNELS):
-                    d[chan].append(self[chan][i])
-        return d
-    
+        try:
+            mask = numpy.asarray(f(self.alpha, self.beta), dtype=bool)
+        except (ValueError, TypeError):
+            mask = None
+        if mask is None or mask.shape != self.alpha.shape:
+            mask = numpy.fromiter(
+                (bool(f(a, b)) for (a, b) in zip(self.alpha, self.beta)),
+                dtype=bool, count=len(self.alpha))
+        return Channels(
+            self.label + '.restrict', self.alpha[mask], self.beta[mask],
+            self.as_array()[mask])
+
     def asymmetry(self):
-        
-        m = {}
-        
-        for i in range(0, len(self.alpha)):
-            
-            alphabeta = (abs(self.alpha[i]), abs(self.beta[i]))
-            
-            if not alphabeta in m:
-                m[alphabeta] = []
-                for chan in range(0, NUM_CHANNELS):
-                  m[alphabeta].append([])
-            for chan in range(0, NUM_CHANNELS):
-                m[alphabeta][chan].append(self[chan][i])
-
-        def asymmetry(arr):
-            return max(arr) - min(arr)
-
-        d = Channels(self.label + '.asymmetry')
-                
-        for alphabeta in m:
-            d.alpha.append(alphabeta[0])
-            d.beta.append(alphabeta[1])
-            for chan in range(0, NUM_CHANNELS):
-                d[chan].append(asymmetry(m[alphabeta][chan]))
-                
-        return d
+        (index, order) = GroupIndex.build(
+            numpy.column_stack((numpy.abs(self.alpha), numpy.abs(self.beta))))
+        return Channels(
+            self.label + '.asymmetry', index.keys[:, 0], index.keys[:, 1],
+            index.asymmetry(self.as_array()[order]))
 
-    
-def read_channels(data_path, cal):
-        
-    if type(cal) == str:
-        calibration = Calibration(cal)
-        
-    data_map = {}
-        
-    with open(data_path, 'r') as f:
-            
+
+# Restrict a data set to points within given |alpha| and |beta| limits,
+# for use with Channels.restrict_alphabeta; works on scalars or arrays.
+# Keeping the limits as plain parameters (rather than an arbitrary
+# function) lets callers key cached results on them.
+def alphabeta_limits(max_abs_alpha=None, max_abs_beta=None):
+    def f(alpha, beta):
+        ok = numpy.ones(numpy.shape(alpha), dtype=bool)
+        if max_abs_alpha is not None:
+            ok &= numpy.abs(alpha) <= max_abs_alpha
+        if max_abs_beta is not None:
+            ok &= numpy.abs(beta) <= max_abs_beta
+        return ok
+    return f
+
+
+# Columns of a sweep file: alpha, beta, then one raw reading per channel
+NUM_COLUMNS = NUM_CHANNELS + 2
+
+# Streaming reads of large sweep files
+STREAM_THRESHOLD_BYTES = 256 << 20
+STREAM_CHUNK_BYTES = 4 << 20
+
+
+def read_samples(data_path):
+    return numpy.loadtxt(data_path, delimiter=',', ndmin=2).reshape(-1, NUM_COLUMNS)
+
+
+def calibrate_samples(samples, calibration):
+    pressures = calibration.apply_array(samples[:, 2:])
+    pressures[:, 1:] /= pressures[:, :1]
+    return pressures
+
+
+# Running first sample / count / mean / M2 per (alpha, beta) point,
+# updated a chunk of samples at a time by merging each chunk's own
+# per-point statistics (Chan et al.'s pairwise form of Welford's method).
+# Memory grows with the number of grid points, not of samples. Points are
+# kept in order of first appearance, as GroupIndex numbers them.
+class PointStats:
+
+    def __init__(self, num_channels=NUM_CHANNELS):
+        self.keys = numpy.empty((0, 2))
+        self.first = numpy.empty((0, num_channels))
+        self.n = numpy.empty(0)
+        self.mean = numpy.empty((0, num_channels))
+        self.m2 = numpy.empty((0, num_channels))
+        self._lookup = {}
+
+    def add(self, alphabeta, values):
+        if not len(values):
+            return
+        (index, order) = GroupIndex.build(alphabeta)
+        values = values[order]
+        n = index.counts().astype(numpy.float64)
+        mean = index.mean(values)
+        m2 = index.m2(values, mean)
+
+        slots = numpy.array([
+            self._lookup.setdefault((float(a), float(b)), len(self._lookup))
+            for (a, b) in index.keys
+        ])
+        grow = len(self._lookup) - len(self.n)
+        if grow:
+            width = self.mean.shape[1]
+            new = slots >= len(self.n)
+            self.keys = numpy.concatenate((self.keys, index.keys[new]))
+            self.first = numpy.concatenate((self.first, index.first(values)[new]))
+            self.n = numpy.concatenate((self.n, numpy.zeros(grow)))
+            self.mean = numpy.concatenate((self.mean, numpy.zeros((grow, width))))
+            self.m2 = numpy.concatenate((self.m2, numpy.zeros((grow, width))))
+
+        n_a = self.n[slots][:, numpy.newaxis]
+        n_b = n[:, numpy.newaxis]
+        total = n_a + n_b
+        delta = mean - self.mean[slots]
+        self.mean[slots] += delta * n_b / total
+        self.m2[slots] += m2 + delta * delta * n_a * n_b / total
+        self.n[slots] = total[:, 0]
+
+    def std(self):
+        return numpy.sqrt(self.m2 / self.n[:, numpy.newaxis])
+
+
+# Read a sweep file in pieces of about chunk_bytes, each a whole number of
+# lines, as arrays of samples.
+def read_sample_chunks(data_path, chunk_bytes=STREAM_CHUNK_BYTES):
+    with open(data_path, 'rb') as f:
+        rest = b''
         while True:
-                
-            line = f.readline()
-            if not line: break
-                
-            values = list(map(float, line.split(',')))
-                
-            alphabeta = (values[0], values[1])
-            
-            pressures = calibration.apply(values[2:])
-
-            for i in range(1, NUM_CHANNELS):
-                pressures[i] = pressures[i] / pressures[0]
-                    
-            if not alphabeta in data_map:
-                data_map[alphabeta] = []
-                for i in range(0, NUM_CHANNELS):
-                    data_map[alphabeta].append([])
-                for i in range(0, NUM_CHANNELS):
-                    data_map[alphabeta][i].append(pressures[i])
-
-    label = Path(data_path).stem
-    data = Channels(label + '.data')
-    sigma = Channels(label + '.sigma')
-
-    for alphabeta in data_map:
-        for m in (data, sigma):
-            m.alpha.append(alphabeta[0])
-            m.beta.append(alphabeta[1])
-        for i in range(0, NUM_CHANNELS):
-            data_array = data_map[alphabeta][i]
-            data[i].append(numpy.mean(data_array))
-            sigma[i].append(numpy.std(data_array))
-
-    return (data, sigma)
-    
+            block = f.read(chunk_bytes)
+            text = rest + block
+            if block:
+                cut = text.rfind(b'\n') + 1
+                (text, rest) = (text[:cut], text[cut:])
+            if text.strip():
+                yield _parse_samples(text)
+            if not block:
+                break
+
+
+def _parse_samples(text):
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            values = numpy.fromstring(
+                text.strip().replace(b'\n', b','), dtype=numpy.float64, sep=',')
+        if len(values) % NUM_COLUMNS == 0:
+            return values.reshape(-1, NUM_COLUMNS)
+    except (ValueError, DeprecationWarning):
+        pass
+    # Blank lines, CRs or something malformed; let loadtxt deal with it
+    return numpy.loadtxt(
+        text.decode('ascii').splitlines(), delimiter=',', ndmin=2).reshape(-1, NUM_COLUMNS)
+
+
+def _calibration(cal):
+    if type(cal) == str:
+        return Calibration(cal)
+    return cal
+
+
+# Per-point statistics of a sweep file, as (keys, first, mean, std)
+# arrays, points in order of first appearance
+def read_points(data_path, cal, stream=None, chunk_bytes=STREAM_CHUNK_BYTES):
+
+    if stream is None:
+        stream = os.path.getsize(data_path) > STREAM_THRESHOLD_BYTES
+    calibration = _calibration(cal)
+
+    if stream:
+        stats = PointStats()
+        for samples in read_sample_chunks(data_path, chunk_bytes):
+            stats.add(samples[:, 0:2], calibrate_samples(samples, calibration))
+        return (stats.keys, stats.first, stats.mean, stats.std())
+
+    samples = read_samples(data_path)
+    pressures = calibrate_samples(samples, calibration)
+
+    (index, order) = GroupIndex.build(samples[:, 0:2])
+    pressures = pressures[order]
+    mean = index.mean(pressures)
+    return (index.keys, index.first(pressures), mean, index.std(pressures))
+
+
+def points_to_channels(label, points, average=False):
+    (keys, first, mean, std) = points
+    (alpha, beta) = (keys[:, 0], keys[:, 1])
+    if average:
+        return (
+            Channels(label + '.data', alpha, beta, mean),
+            Channels(label + '.sigma', alpha, beta, std))
+    return (
+        Channels(label + '.data', alpha, beta, first),
+        Channels(label + '.sigma', alpha, beta, numpy.zeros_like(first)))
+
+
+# The data of each (alpha, beta) point is its first sample, and sigma is
+# 0, as the loader has always done and as the calibration tables are made
+# from. With average=True, the data is the mean of all the samples of the
+# point and sigma their standard deviation instead; this is for analysis
+# (e.g. uncertainty), and the tables do not use it. Files larger than
+# STREAM_THRESHOLD_BYTES are read in streaming mode unless stream says
+# otherwise.
+def read_channels(data_path, cal, stream=None, average=False):
+    return points_to_channels(
+        Path(data_path).stem, read_points(data_path, cal, stream), average)
+
+
+# Streaming counterpart of read_channels: the same results, to rounding,
+# in memory bounded by the number of grid points and the chunk size.
+def read_channels_streaming(data_path, cal, chunk_bytes=STREAM_CHUNK_BYTES, average=False):
+    return points_to_channels(
+        Path(data_path).stem, read_points(data_path, cal, True, chunk_bytes), average)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+import numpy
+
+import instrument
+import sweep
+
+########################################################################
+
+# On-disk cache of per-file sweep.read_channels results.
+#
+# Each entry is a directory of .npy files that is loaded memory-mapped.
+# It holds the per-point statistics of sweep.read_points, so one entry
+# serves read_channels both with and without average.
+# An entry is keyed on the content hashes of the sweep CSV and the sensor
+# .cal file, and on the alpha/beta limits applied to the data, so any
+# change in the inputs selects a new entry. When a new entry is written,
+# stale entries for the same sweep file are removed.
+#
+# Bump CACHE_VERSION whenever read_channels changes what it computes.
+
+CACHE_VERSION = 2
+
+cache_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.cache', 'sweep')
+
+ARRAYS = ['keys', 'first', 'mean', 'std']
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(data_path, cal_path, limits):
+    key = {
+        'version': CACHE_VERSION,
+        'data': file_hash(data_path),
+        'cal': file_hash(cal_path),
+        'limits': limits,
+    }
+    return hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _entry_prefix(data_path):
+    return Path(data_path).stem + '-'
+
+# Entry names of a sweep file: its stem, a dash and a key. Matching the
+# whole name keeps "run1" from claiming the entries of "run1-b".
+def _entry_pattern(data_path):
+    return re.compile(re.escape(_entry_prefix(data_path)) + '[0-9a-f]{64}')
+
+def _load(entry, label, average):
+    points = [numpy.load(os.path.join(entry, k + '.npy'), mmap_mode='r') for k in ARRAYS]
+    return sweep.points_to_channels(label, points, average)
+
+def _store(entry, points):
+    parent = os.path.dirname(entry)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent)
+    for (k, a) in zip(ARRAYS, points):
+        numpy.save(os.path.join(tmp, k + '.npy'), numpy.asarray(a, dtype=numpy.float64))
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another process got there first with the same content
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _prune(data_path, keep):
+    if not os.path.isdir(cache_dir):
+        return
+    pattern = _entry_pattern(data_path)
+    for name in os.listdir(cache_dir):
+        if pattern.fullmatch(name) and name != keep:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+
+# Returns (entry, exists) for the cache entry of a sweep file
+def lookup(data_path, cal_path, limits=None):
+    limits = dict(limits or {})
+    name = _entry_prefix(data_path) + cache_key(data_path, cal_path, limits)
+    entry = os.path.join(cache_dir, name)
+    return (entry, os.path.isdir(entry))
+
+# Parse a sweep file into the given cache entry. This only writes files,
+# so it can run in a worker process and hand back just the number of
+# tunnel points it parsed. Callers record the parse stage, so that it is
+# in the report of the parent process.
+def build(data_path, cal_path, limits, entry):
+    limits = dict(limits or {})
+    points = sweep.read_points(data_path, cal_path)
+    parsed = len(points[0])
+    if limits:
+        keys = points[0]
+        mask = sweep.alphabeta_limits(**limits)(keys[:, 0], keys[:, 1])
+        points = [a[mask] for a in points]
+
+    _prune(data_path, os.path.basename(entry))
+    _store(entry, points)
+    return parsed
+
+def load(entry, data_path, average=False):
+    return _load(entry, Path(data_path).stem, average)
+
+def read_channels(data_path, cal_path, limits=None, average=False):
+    (entry, exists) = lookup(data_path, cal_path, limits)
+    if not exists:
+        with instrument.stage('parse') as s:
+            s['rows'] = build(data_path, cal_path, limits, entry)
+    return load(entry, data_path, average)
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import numpy as np
+
+import benchmark
+import sweep
+from calibration import Calibration
+
+########################################################################
+
+# Per-point grouping of sweep samples, in memory and streamed.
+
+def samples(seed=0, points=20, n=500):
+    rng = np.random.default_rng(seed)
+    grid = np.column_stack((rng.integers(-10, 10, points), rng.integers(-5, 5, points)))
+    grid = np.unique(grid, axis=0)
+    rows = grid[rng.integers(0, len(grid), n)].astype(np.float64)
+    return (rows, rng.normal(0, 1, (n, sweep.NUM_CHANNELS)))
+
+# Samples of each point by a dict, points in order of first appearance
+def by_point(alphabeta, values):
+    groups = {}
+    for (ab, v) in zip(map(tuple, alphabeta), values):
+        groups.setdefault(ab, []).append(v)
+    return groups
+
+def test_group_index():
+    (alphabeta, values) = samples()
+    (index, order) = sweep.GroupIndex.build(alphabeta)
+    groups = by_point(alphabeta, values)
+    assert [tuple(k) for k in index.keys] == list(groups)
+    assert list(index.counts()) == [len(g) for g in groups.values()]
+    v = values[order]
+    np.testing.assert_allclose(index.mean(v), [np.mean(g, axis=0) for g in groups.values()])
+    np.testing.assert_allclose(index.std(v), [np.std(g, axis=0) for g in groups.values()])
+    np.testing.assert_equal(index.first(v), [g[0] for g in groups.values()])
+    np.testing.assert_equal(
+        index.asymmetry(v), [np.ptp(g, axis=0) for g in groups.values()])
+    (alpha, beta) = index.keys[3]
+    assert index.find(alpha, beta) == 3
+    np.testing.assert_equal(v[index.rows(3)], groups[(alpha, beta)])
+
+def test_channels():
+    (alphabeta, values) = samples(1)
+    c = sweep.Channels('c', alphabeta[:, 0], alphabeta[:, 1], values)
+    assert len(c) == sweep.NUM_CHANNELS and len(list(c.values())) == sweep.NUM_CHANNELS
+    np.testing.assert_equal(c.as_array(), values)
+    limits = sweep.alphabeta_limits(max_abs_alpha=5)
+    r = c.restrict_alphabeta(limits)
+    keep = np.abs(alphabeta[:, 0]) <= 5
+    np.testing.assert_equal(r.as_array(), values[keep])
+    # Point by point for predicates that only take scalars
+    r = c.restrict_alphabeta(lambda a, b: abs(a) <= 5 and b > 0)
+    np.testing.assert_equal(r.as_array(), values[keep & (alphabeta[:, 1] > 0)])
+    a = c.asymmetry()
+    groups = by_point(np.abs(alphabeta), values)
+    assert [(x, y) for (x, y) in zip(a.alpha, a.beta)] == list(groups)
+    np.testing.assert_equal(a.as_array(), [np.ptp(g, axis=0) for g in groups.values()])
+
+def test_streaming_statistics():
+    (alphabeta, values) = samples(2, n=2000)
+    index = sweep.GroupIndex.build(alphabeta)[0]
+    stats = sweep.PointStats()
+    for i in range(0, len(values), 300):
+        stats.add(alphabeta[i:i + 300], values[i:i + 300])
+    groups = by_point(alphabeta, values)
+    np.testing.assert_equal(stats.keys, index.keys)
+    np.testing.assert_equal(stats.n, [len(g) for g in groups.values()])
+    np.testing.assert_equal(stats.first, [g[0] for g in groups.values()])
+    np.testing.assert_allclose(stats.mean, [np.mean(g, axis=0) for g in groups.values()])
+    np.testing.assert_allclose(stats.std(), [np.std(g, axis=0) for g in groups.values()])
+
+def test_streaming_read_channels():
+    cal = Calibration(benchmark.cal_file)
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'sweep.csv')
+        benchmark.write_sweep(path, benchmark.synthetic_samples(5000, cal, step=10))
+        for average in [False, True]:
+            whole = sweep.read_channels(path, cal, stream=False, average=average)
+            streamed = sweep.read_channels_streaming(path, cal, 16 << 10, average=average)
+            for (a, b) in zip(whole, streamed):
+                np.testing.assert_equal(a.alpha, b.alpha)
+                np.testing.assert_equal(a.beta, b.beta)
+                np.testing.assert_allclose(a.as_array(), b.as_array(), rtol=1e-9, atol=1e-12)
@@ -0,0 +1,242 @@
+import os
+import numpy as np
+
+import airdata_engine
+import calibration
+import raw_data
+import sweep_cache
+from plotting import pyplot, ensure_dir
+
+########################################################################
+
+# Propagation of pressure sensor noise through the firmware airdata math.
+#
+# Every tunnel point (one (alpha, beta) of one run) is taken as the
+# nominal hole pressures of a point in the operating envelope. Each of
+# them is perturbed many times over with Gaussian noise, independently
+# per hole, the deltas (dp0, dpa, dpb) formed from the noisy holes as
+# raw_data does, and the lot pushed through airdata_engine, the float32
+# batch version of the firmware's table lookups. For each point this
+# gives the distribution of alpha, beta, q and p that the noise alone
+# produces.
+#
+# The noise of each hole is either:
+#
+#   measured      the standard deviation of the samples at each tunnel
+#                 point, from sweep.read_channels with average=True (so
+#                 it includes the tunnel's own unsteadiness), or
+#   trustability  a fixed number of counts RMS of the Honeywell
+#                 TruStability sensors, plus their quantization, turned
+#                 into pressure by the gain of each sensor in the .cal
+#                 file, at the tunnel q of the point or at given values
+#                 of q (in the units of the .cal file).
+#
+# Pressures are in the units of raw_data, i.e. normalized by the tunnel
+# q, so q and p come out as fractions of the true q. p is the static
+# correction only, with raw_baro = 0.
+
+DEFAULT_SAMPLES = 4096
+
+# Perturbed samples generated and looked up at a time
+BLOCK = 1 << 20
+
+# RMS noise of a TruStability reading, in counts. The datasheet gives no
+# figure; measure it on the bench with the probe at rest.
+default_counts_rms = 1.0
+
+OUTPUTS = ['alpha', 'beta', 'q', 'p']
+
+# The surface of airdata_engine.SURFACES each output comes from
+output_surfaces = dict(zip(OUTPUTS, airdata_engine.SURFACES))
+
+########################################################################
+
+# Nominal hole pressures and their measured sigmas, one row per tunnel
+# point, with holes in the order of raw_data.raw_pressures; and the
+# tunnel q of each point, and the gain of each hole's sensor.
+def read_points(files=None):
+    columns = {k: [] for k in ['alpha', 'beta', 'q', 'pressures', 'sigma']}
+    for f in files or raw_data.raw_data_files:
+        (data, sigma) = sweep_cache.read_channels(
+            os.path.join(raw_data.raw_data_dir, f),
+            raw_data.cal_file,
+            raw_data.restrict_limits,
+            average=True)
+        holes = range(1, len(raw_data.raw_pressures) + 1)
+        columns['alpha'].append(np.trunc(data.alpha))
+        columns['beta'].append(np.trunc(data.beta))
+        columns['q'].append(np.asarray(data[0]))
+        columns['pressures'].append(np.column_stack([data[c] for c in holes]))
+        columns['sigma'].append(np.column_stack([sigma[c] for c in holes]))
+    points = {k: np.concatenate(v) for (k, v) in columns.items()}
+    points['gains'] = calibration.Calibration(raw_data.cal_file).gains[1:len(raw_data.raw_pressures) + 1]
+    return points
+
+# Noise cases to run, each a (name, q, sigma) with sigma per point and
+# hole in normalized units
+def noise_cases(points, model='measured', counts_rms=default_counts_rms, q=None):
+    if model == 'measured':
+        return [('measured', points['q'], points['sigma'])]
+    # Quantization to whole counts adds a uniform error of 1/12 counts^2
+    counts = np.sqrt(counts_rms ** 2 + 1.0 / 12)
+    pressure = counts * np.abs(points['gains'])
+    if q is None:
+        return [('tunnel q', points['q'], pressure[None, :] / points['q'][:, None])]
+    return [
+        ('q %g' % v, np.full(len(points['q']), float(v)), np.tile(pressure / v, (len(points['q']), 1)))
+        for v in q
+    ]
+
+########################################################################
+
+def _deltas(holes):
+    d = {k: holes[..., i] for (i, k) in enumerate(raw_data.raw_pressures)}
+    return [raw_data.derived_columns[k](d) for k in ('dp0', 'dpa', 'dpb')]
+
+# Percentiles of each row of v over the entries where ok, at the given
+# fractions, taking the nearest lower rank
+def _row_percentiles(v, ok, fractions):
+    v = np.where(ok, v, np.nan)
+    v.sort(axis=1)
+    n = ok.sum(axis=1)
+    rows = np.arange(len(v))
+    out = []
+    for f in fractions:
+        i = np.maximum(np.floor(f * (n - 1)).astype(np.int64), 0)
+        out.append(np.where(n > 0, v[rows, i], np.nan))
+    return out
+
+def _block_stats(engine, pressures, sigma, samples, level, rng):
+    (m, holes) = pressures.shape
+    noise = rng.standard_normal((m, samples, holes), dtype=np.float32)
+    noise *= sigma[:, None, :].astype(np.float32)
+    noise += pressures[:, None, :].astype(np.float32)
+    r = engine(*_deltas(noise))
+    nominal = engine(*_deltas(pressures.astype(np.float32)))
+    stats = {}
+    for k in OUTPUTS:
+        bit = 1 << airdata_engine.SURFACES.index(output_surfaces[k])
+        ok = ((r['failed'] & bit) == 0).reshape(m, samples)
+        v = r[k].reshape(m, samples).astype(np.float64)
+        n = ok.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(ok, v, 0).sum(axis=1) / n
+            var = np.where(ok, np.square(v - mean[:, None]), 0).sum(axis=1) / n
+        (lower, upper) = _row_percentiles(v, ok, [(1 - level) / 2, (1 + level) / 2])
+        stats[k] = {
+            'nominal': np.where(
+                (nominal['failed'] & bit) == 0, nominal[k].astype(np.float64), np.nan),
+            'mean': mean,
+            'std': np.sqrt(var),
+            'lower': lower,
+            'upper': upper,
+            'failed': 1 - n / float(samples),
+        }
+    return stats
+
+# Distributions of the outputs at each point, from samples perturbed
+# copies of its hole pressures with the given sigmas. Returns, for each
+# output, per point arrays of the noise-free value ('nominal'), the mean,
+# standard deviation and the central `level` interval of the perturbed
+# values, leaving out failed lookups, and the fraction that failed.
+def propagate(engine, pressures, sigma, samples=DEFAULT_SAMPLES, level=0.95, seed=0):
+    rng = np.random.default_rng(seed)
+    per_block = max(1, BLOCK // samples)
+    parts = [
+        _block_stats(
+            engine, pressures[i:i + per_block], sigma[i:i + per_block], samples, level, rng)
+        for i in range(0, len(pressures), per_block)
+    ]
+    return {
+        k: {s: np.concatenate([p[k][s] for p in parts]) for s in parts[0][k]}
+        for k in OUTPUTS
+    }
+
+########################################################################
+
+# Column, header width and format of the summary table
+summary_columns = [
+    ('output', -6, '%-6s'),
+    ('median_std', 11, '%11.4g'),
+    ('p95_std', 11, '%11.4g'),
+    ('max_std', 11, '%11.4g'),
+    ('at_alpha', 8, '%8.0f'),
+    ('at_beta', 8, '%8.0f'),
+    ('max_bias', 11, '%11.4g'),
+    ('max_width', 11, '%11.4g'),
+    ('failed', 9, '%9.5f'),
+]
+
+# One row of numbers per output, over all the points: the spread of the
+# per-point standard deviations and where it is largest, the largest
+# bias of the mean against the noise-free value, the widest interval,
+# and the fraction of all samples whose lookup failed.
+def summary(points, stats):
+    rows = []
+    for k in OUTPUTS:
+        s = stats[k]
+        std = np.where(np.isfinite(s['std']), s['std'], -1)
+        i = int(np.argmax(std))
+        with np.errstate(invalid='ignore'):
+            rows.append({
+                'output': k,
+                'median_std': float(np.nanmedian(s['std'])),
+                'p95_std': float(np.nanpercentile(s['std'], 95)),
+                'max_std': float(s['std'][i]),
+                'at_alpha': float(points['alpha'][i]),
+                'at_beta': float(points['beta'][i]),
+                'max_bias': float(np.nanmax(np.abs(s['mean'] - s['nominal']))),
+                'max_width': float(np.nanmax(s['upper'] - s['lower'])),
+                'failed': float(np.mean(s['failed'])),
+            })
+    return rows
+
+def summary_table(rows):
+    lines = [' '.join('%*s' % (w, k) for (k, w, f) in summary_columns)]
+    for r in rows:
+        lines.append(' '.join(f % r[k] for (k, w, f) in summary_columns))
+    return '\n'.join(lines) + '\n'
+
+########################################################################
+
+def plot_case(name, alpha, beta, stats, path):
+    plt = pyplot()
+    fig, axes = plt.subplots(2, 2, figsize=(12, 10))
+    for (ax, k) in zip(axes.ravel(), OUTPUTS):
+        sc = ax.scatter(alpha, beta, c=stats[k]['std'], cmap='viridis', s=12)
+        ax.set_title('%s: std of %s' % (name, k))
+        ax.set_xlabel('alpha')
+        ax.set_ylabel('beta')
+        fig.colorbar(sc, ax=ax)
+    fig.tight_layout()
+    plt.savefig(path, dpi=150)
+    plt.close()
+    return path
+
+def plot_cases(points, results, queue, directory):
+    ensure_dir(directory)
+    (alpha, beta) = (queue.share(points['alpha']), queue.share(points['beta']))
+    for (name, stats) in results:
+        s = {k: {'std': queue.share(stats[k]['std'])} for k in OUTPUTS}
+        queue.submit(
+            plot_case, name, alpha, beta, s,
+            os.path.join(directory, 'noise_' + name.replace(' ', '_') + '.png'))
+
+# Plain lists and numbers, e.g. for saving as JSON
+def to_dict(points, case, stats, rows):
+    (name, q, sigma) = case
+    return {
+        'case': name,
+        'summary': rows,
+        'points': {
+            'alpha': points['alpha'].tolist(),
+            'beta': points['beta'].tolist(),
+            'q': q.tolist(),
+            'sigma': sigma.tolist(),
+            'outputs': {
+                k: {s: [None if not np.isfinite(v) else float(v) for v in stats[k][s]]
+                    for s in stats[k]}
+                for k in OUTPUTS
+            },
+        },
+    }
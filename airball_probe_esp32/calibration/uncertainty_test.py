@@ -0,0 +1,54 @@
+import numpy as np
+
+import airdata_engine
+import uncertainty
+
+########################################################################
+
+# Propagation through tables that make q and p linear in the holes:
+# with q_over_dp0 = k and minus_s_over_dp0 = m constant, q = k dp0 and
+# p = m dp0, where dp0 = c - s, so their standard deviations are k and m
+# times sqrt(sigma_c^2 + sigma_s^2).
+
+k = 2.0
+m = -0.5
+
+def engine():
+    axis = {'size': 31, 'step': 0.1, 'zero_offset': 0.0}
+    values = {'alpha': 3.0, 'beta': -1.0, 'q_over_dp0': k, 'minus_s_over_dp0': m}
+    return airdata_engine.Engine({
+        name: {'x': axis, 'y': axis, 'data': np.full(31 * 31, v, np.float32)}
+        for (name, v) in values.items()
+    })
+
+# Holes in the order of raw_data.raw_pressures: d, u, r, l, c, s
+pressures = np.array([
+    [0.6, 0.4, 0.55, 0.45, 1.0, 0.0],
+    [0.6, 0.4, 0.6, 0.4, 1.2, 0.1],
+    [0.7, 0.5, 0.4, 0.6, 0.9, -0.1],
+])
+
+sigma = np.array([
+    [0.01, 0.01, 0.01, 0.01, 0.01, 0.01],
+    [0.02, 0.01, 0.01, 0.01, 0.03, 0.04],
+    [0.0, 0.0, 0.0, 0.0, 0.02, 0.0],
+])
+
+def test_linear_outputs():
+    stats = uncertainty.propagate(engine(), pressures, sigma, samples=8192, seed=1)
+    dp0 = pressures[:, 4] - pressures[:, 5]
+    dp0_std = np.hypot(sigma[:, 4], sigma[:, 5])
+    for (name, factor) in [('q', k), ('p', m)]:
+        s = stats[name]
+        np.testing.assert_allclose(s['nominal'], factor * dp0, rtol=1e-6)
+        np.testing.assert_allclose(s['std'], abs(factor) * dp0_std, rtol=0.05)
+        np.testing.assert_allclose(s['mean'], s['nominal'], atol=0.05 * abs(factor) * dp0_std.max())
+        # Gaussian: the central 95% is 1.96 sigma either side
+        np.testing.assert_allclose(s['upper'] - s['lower'], 2 * 1.96 * s['std'], rtol=0.05)
+        np.testing.assert_equal(s['failed'], 0)
+    # Constant tables, and deltas well away from 0, give constant alpha
+    # and beta
+    for name in ['alpha', 'beta']:
+        np.testing.assert_equal(stats[name]['std'], 0)
+        np.testing.assert_equal(stats[name]['mean'], stats[name]['nominal'])
+    np.testing.assert_equal(stats['beta']['nominal'], [-1, -1, 1])
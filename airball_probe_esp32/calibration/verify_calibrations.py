@@ -1,115 +1,142 @@
 #!/usr/bin/python
 # coding=utf-8
 
-import operator
-import csv
-import matplotlib
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-import math
 import numpy as np
-import scipy.optimize as spo
-import jinja2
-import sys
-import sweep
 import os
-import subprocess
+import sys
 
 import raw_data
+import instrument
+import probe_calibration_lib
+from plotting import pyplot, ensure_dir, PlotQueue, full_style, style_dir, style_dpi
 
 ########################################################################
 
-plots_dir = 'verification_plots'
-
-if not os.path.isdir(plots_dir):
-    os.mkdir(plots_dir)
-
-########################################################################        
-
-def calibration(dp0, dpa, dpb, raw_baro):
-    p = subprocess.Popen(
-        ['./probe_calibration_test'] +
-            list(map(str, [dp0, dpa, dpb, raw_baro])),
-        stdin=None,
-        stdout=subprocess.PIPE,
-        stderr=None)
-    p.wait()
-    if p.returncode != 0:
-        return {
-            'alpha': 0,
-            'beta': 0,
-            'q': 0,
-            'p': 0,
-        }
-    fields = list(map(float, p.stdout.readline().decode('utf-8').strip().split(',')))
-    return {
-        'alpha': fields[0],
-        'beta': fields[1],
-        'q': fields[2],
-        'p': fields[3],
+plots_dir = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'verification_plots')
+
+########################################################################
+
+# With blob, the tables are taken from a calibration blob rather than
+# the compiled-in probe_calibration.h (see probe_calibration_lib)
+def calibration(dp0, dpa, dpb, raw_baro, blob=None):
+    r = probe_calibration_lib.pressures_to_airdata(dp0, dpa, dpb, raw_baro, blob)
+    failed = r['err'] != 0
+    d = {
+        k: np.where(failed, 0.0, r[k]).astype(np.float64)
+        for k in ('alpha', 'beta', 'q', 'p')
     }
+    d['err'] = r['err']
+    return d
+
+def derive(deltas, blob=None):
+    with instrument.stage('verify', rows=len(deltas['dp0'])):
+        return calibration(
+            deltas['dp0'],
+            deltas['dpa'],
+            deltas['dpb'],
+            0.0,
+            blob)
 
 ########################################################################
 
-cal_derived = {
-    'alpha': [],
-    'beta': [],
-    'q': [],
-    'p': [],
-}
-
-for i in range(0, len(raw_data.deltas['alpha'])):
-    r = calibration(
-        raw_data.deltas['dp0'][i],
-        raw_data.deltas['dpa'][i],        
-        raw_data.deltas['dpb'][i],
-        0.0)
-    cal_derived['alpha'].append(r['alpha'])
-    cal_derived['beta'].append(r['beta'])
-    cal_derived['q'].append(r['q'])
-    cal_derived['p'].append(r['p'])
+# Summary numbers for a quick check without rendering any plots. Samples
+# the firmware could not evaluate, or for which it produced non-finite
+# values, are counted and left out of the errors.
+
+def summarize(views, cal_derived):
+    ok = cal_derived['err'] == 0
+    finite = ok & np.isfinite(cal_derived['alpha']) & np.isfinite(cal_derived['beta'])
+
+    def rms(x):
+        x = x[finite]
+        return float(np.sqrt(np.mean(np.square(x)))) if len(x) else float('nan')
+
+    return {
+        'samples': int(len(ok)),
+        'failed': int((~ok).sum()),
+        'nonfinite': int((ok & ~finite).sum()),
+        'alpha_rms_error': rms(cal_derived['alpha'] - views['ratios']['alpha']),
+        'beta_rms_error': rms(cal_derived['beta'] - views['ratios']['beta']),
+        'p_rms_error': rms(cal_derived['p'] - views['deltas']['minus_s']),
+    }
 
 ########################################################################
 
-def plot_comparison(title,
+def plot_comparison(ratios, title,
                     cal_derived_label, cal_derived_values,
-                    raw_data_label, raw_data_values):
+                    raw_data_label, raw_data_values, style=full_style):
+    plt = pyplot()
     fig = plt.figure(figsize=(11, 8.5))
     ax = plt.axes(projection='3d')
     ax.set_xlabel('dpa_over_dp0')
     ax.set_ylabel('dpb_over_dp0')
     ax.scatter3D(
-        raw_data.ratios['dpa_over_dp0'],
-        raw_data.ratios['dpb_over_dp0'],
+        ratios['dpa_over_dp0'],
+        ratios['dpb_over_dp0'],
         cal_derived_values,
-        label='calibration derived ' + cal_derived_label)
+        label='calibration derived ' + cal_derived_label,
+        rasterized=style.get('rasterized', False))
     if raw_data_label != None:
         ax.scatter3D(
-            raw_data.ratios['dpa_over_dp0'],
-            raw_data.ratios['dpb_over_dp0'],
+            ratios['dpa_over_dp0'],
+            ratios['dpb_over_dp0'],
             raw_data_values,
-            label='raw data ' + raw_data_label)
+            label='raw data ' + raw_data_label,
+            rasterized=style.get('rasterized', False))
     ax.legend()
-    plt.savefig(
-        os.path.join(
-            plots_dir,
-            title + '.png'),
-        dpi=600)
+    path = os.path.join(
+        style_dir(plots_dir, style),
+        title + '.png')
+    plt.savefig(path, dpi=style_dpi(600, style))
     plt.close()
+    return path
+
+# Previews bin the ratios, the derived values and the raw data together,
+# in ratio space
+def plot_verification(views, cal_derived, queue):
+    ensure_dir(style_dir(plots_dir, queue.style))
+    columns = {k: views['ratios'][k] for k in views['ratios']}
+    columns.update({'derived_' + k: cal_derived[k] for k in ('alpha', 'beta', 'q', 'p')})
+    columns['minus_s'] = views['deltas']['minus_s']
+    table = queue.share_table(queue.reduce(columns, ratios=True))
+    ratios = {k: table[k] for k in views['ratios']}
+    style = queue.style
+    queue.submit(
+        plot_comparison,
+        ratios,
+        'verify_alpha',
+        'alpha', table['derived_alpha'],
+        'alpha', table['alpha'],
+        style=style)
+    queue.submit(
+        plot_comparison,
+        ratios,
+        'verify_beta',
+        'beta', table['derived_beta'],
+        'beta', table['beta'],
+        style=style)
+    queue.submit(
+        plot_comparison,
+        ratios,
+        'verify_q',
+        'q', table['derived_q'],
+        None, None,
+        style=style)
+    queue.submit(
+        plot_comparison,
+        ratios,
+        'verify_p',
+        'p', table['derived_p'],
+        'minus_s', table['minus_s'],
+        style=style)
+
+########################################################################
+
+def main(workers=None):
+    views = raw_data.views(raw_data.load())
+    with PlotQueue(workers) as queue:
+        plot_verification(views, derive(views['deltas']), queue)
 
-plot_comparison(
-    'verify_alpha',
-    'alpha', cal_derived['alpha'], 
-    'alpha', raw_data.ratios['alpha'])
-plot_comparison(
-    'verify_beta',
-    'beta', cal_derived['beta'],
-    'beta', raw_data.ratios['beta'])
-plot_comparison(
-    'verify_q',
-    'q', cal_derived['q'],
-    None, None)
-plot_comparison(
-    'verify_p',
-    'p', cal_derived['p'],
-    'minus_s', raw_data.deltas['minus_s'])
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1 @@
+calibration/calibration_blob.cpp
\ No newline at end of file
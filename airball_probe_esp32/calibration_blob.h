@@ -0,0 +1 @@
+calibration/calibration_blob.h
\ No newline at end of file